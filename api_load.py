@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Load generator that replays the app's access pattern against the Rick and Morty API or ./api_server.py:
+every user walks the episode pages one after another, like ContinuousPagination, and preloads the characters
+of each episode on a page, like EpisodeDetails. Requests for a URL that is already in flight are deduplicated.
+Throughput and latency percentiles and histograms are written as JSON.
+Run with: ./api_load.py
+Usage:
+  ./api_load.py --api-url http://127.0.0.1:8080/api               # against a local ./api_server.py
+  ./api_load.py --users 20 --concurrency 64 --max-pages 5         # 20 users sharing 64 connections
+  ./api_load.py --api-url http://127.0.0.1:8080/api --etags       # revalidates with If-None-Match
+"""
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+LIVE_API_URL = "https://rickandmortyapi.com/api"
+DEFAULT_OUTPUT_PATH = "api_load_results.json"
+DEFAULT_USERS = 1
+DEFAULT_CONCURRENCY = 16
+DEFAULT_TIMEOUT_SECONDS = 10
+# EpisodeDetails preloads the first 20 characters of an episode.
+CHARACTERS_PER_EPISODE = 20
+# Upper bounds, in milliseconds, of the latency histogram buckets; the last bucket is unbounded.
+HISTOGRAM_BOUNDS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def latency_summary(latencies_ms):
+    """
+    Returns count, mean, p50/p95/p99, max and a histogram of latencies in milliseconds.
+    """
+    values = sorted(latencies_ms)
+    histogram = {}
+    bucket = 0
+    for value in values:
+        while bucket < len(HISTOGRAM_BOUNDS_MS) and value > HISTOGRAM_BOUNDS_MS[bucket]:
+            bucket += 1
+        label = f"<={HISTOGRAM_BOUNDS_MS[bucket]}" if bucket < len(HISTOGRAM_BOUNDS_MS) else f">{HISTOGRAM_BOUNDS_MS[-1]}"
+        histogram[label] = histogram.get(label, 0) + 1
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 3) if values else None,
+        "p50": _round(_percentile(values, 0.50)),
+        "p95": _round(_percentile(values, 0.95)),
+        "p99": _round(_percentile(values, 0.99)),
+        "max": _round(values[-1] if values else None),
+        "histogram": histogram,
+    }
+
+
+def _round(value):
+    return round(value, 3) if value is not None else None
+
+
+class ApiClient:
+    """
+    Pooled keep-alive HTTP client shared by all users. At most `concurrency` requests are on the wire at once,
+    and a request for a URL that is already in flight waits for that request's response instead.
+    """
+
+    def __init__(self, concurrency, timeout, use_etags):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=concurrency, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.timeout = timeout
+        self.use_etags = use_etags
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.etags = {}
+        self.latencies_ms = {}
+        self.statuses = {}
+        # Exceptions raised to the users, by type, such as a 200 response whose body is not JSON.
+        self.errors = {}
+        self.bytes_received = 0
+        self.deduplicated = 0
+
+    def get_json(self, url, kind):
+        """
+        Returns the decoded JSON at url, or None when the request failed.
+        """
+        with self.lock:
+            future = self.in_flight.get(url)
+            owner = future is None
+            if owner:
+                future = self.in_flight[url] = Future()
+            else:
+                self.deduplicated += 1
+        if not owner:
+            return future.result()
+        # The request runs on the calling thread, so waiters only ever wait for a request that is already running.
+        try:
+            value = self._fetch(url, kind)
+        except Exception as e:
+            # Waiters get the same error instead of blocking forever.
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            with self.lock:
+                del self.in_flight[url]
+
+    def record_error(self, error):
+        with self.lock:
+            name = type(error).__name__
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def _fetch(self, url, kind):
+        headers = {}
+        cached = self.etags.get(url) if self.use_etags else None
+        if cached:
+            headers["If-None-Match"] = cached[0]
+        with self.slots:
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+                content = response.content
+                status = response.status_code
+            except requests.RequestException as e:
+                content = b""
+                status = type(e).__name__
+            elapsed_ms = (time.perf_counter() - start) * 1000
+        with self.lock:
+            self.latencies_ms.setdefault(kind, []).append(elapsed_ms)
+            self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+            self.bytes_received += len(content)
+        if status == 304 and cached:
+            return cached[1]
+        if status != 200:
+            return None
+        value = json.loads(content)
+        etag = response.headers.get("ETag")
+        if self.use_etags and etag:
+            with self.lock:
+                self.etags[url] = (etag, value)
+        return value
+
+
+def walk_episodes(client, fan_out, api_url, max_pages, characters_per_episode):
+    """
+    Loads episode pages one at a time, following info.next, and preloads each episode's characters
+    concurrently while the next page loads. Returns the number of pages loaded.
+    Preloads that raise are counted in client.errors, like a failed request is counted in client.statuses.
+    """
+    url = f"{api_url}/episode"
+    pages = 0
+    preloads = []
+    while url and (max_pages is None or pages < max_pages):
+        page = client.get_json(url, "page")
+        if page is None:
+            break
+        pages += 1
+        for episode in page["results"]:
+            for character_url in episode["characters"][:characters_per_episode]:
+                preloads.append(fan_out.submit(client.get_json, character_url, "character"))
+        url = page["info"]["next"]
+    for preload in preloads:
+        try:
+            preload.result()
+        except Exception as e:
+            client.record_error(e)
+    return pages
+
+
+def run_load_step(args):
+    print(f"🚦\tReplaying {args.users} user(s) against {args.api_url} with {args.concurrency} concurrent requests...")
+    client = ApiClient(args.concurrency, args.timeout, args.etags)
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as fan_out:
+        with ThreadPoolExecutor(max_workers=args.users) as users:
+            pages = list(users.map(
+                lambda _: walk_episodes(client, fan_out, args.api_url, args.max_pages, args.characters_per_episode),
+                range(args.users),
+            ))
+    elapsed = time.time() - start
+    all_latencies = [latency for latencies in client.latencies_ms.values() for latency in latencies]
+    requests_sent = len(all_latencies)
+    results = {
+        "api_url": args.api_url,
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "etags": args.etags,
+        "elapsed_seconds": round(elapsed, 3),
+        "pages_walked": sum(pages),
+        "requests": requests_sent,
+        "deduplicated_requests": client.deduplicated,
+        "throughput_rps": round(requests_sent / elapsed, 2) if elapsed else None,
+        "bytes_received": client.bytes_received,
+        "statuses": dict(sorted(client.statuses.items())),
+        "errors": dict(sorted(client.errors.items())),
+        "latency_ms": {
+            "all": latency_summary(all_latencies),
+            **{kind: latency_summary(latencies) for kind, latencies in sorted(client.latencies_ms.items())},
+        },
+    }
+    print(f"\t✅\tStep completed: {requests_sent} requests ({client.deduplicated} deduplicated) in {elapsed:.2f} seconds")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the app's API access pattern and measure latency.")
+    parser.add_argument("--api-url", default=LIVE_API_URL, help="API root, e.g. http://127.0.0.1:8080/api for ./api_server.py.")
+    parser.add_argument("--users", type=int, default=DEFAULT_USERS, help="Users walking the episode list at the same time.")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Maximum requests in flight.")
+    parser.add_argument("--max-pages", type=int, help="Episode pages each user loads (defaults to all).")
+    parser.add_argument("--characters-per-episode", type=int, default=CHARACTERS_PER_EPISODE,
+                        help="Characters preloaded for each episode.")
+    parser.add_argument("--etags", action="store_true", help="Revalidate responses already seen with If-None-Match.")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT_SECONDS, help="Per-request timeout in seconds.")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_PATH, help="Where to write the JSON results.")
+    args = parser.parse_args()
+    args.api_url = args.api_url.rstrip("/")
+    results = run_load_step(args)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    summary = results["latency_ms"]["all"]
+    print(f"\t📊\t{results['throughput_rps']} requests/s, latency p50 {summary['p50']} ms, "
+          f"p95 {summary['p95']} ms, p99 {summary['p99']} ms (see {args.output})")
+    failed = sum(count for status, count in results["statuses"].items() if status not in ("200", "304"))
+    if failed:
+        print(f"\t⚠️\t{failed} requests failed")
+    if results["errors"]:
+        errors = ", ".join(f"{count} {name}" for name, count in results["errors"].items())
+        print(f"\t⚠️\tPreloads raised {errors}")
+
+
+if __name__ == "__main__":
+    main()
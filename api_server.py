@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Rick and Morty REST API (rickandmortyapi.com), served from the fixture JSON files
+in Libs/RickAndMortyEpisodesLib/Fixtures, so UI tests and load tests run offline with stable timings.
+Episodes, characters and locations beyond the fixtures are synthesized from them, so datasets of any size
+keep consistent pagination (info.next/prev) and links that resolve on this server.
+Run with: ./api_server.py
+Usage:
+  ./api_server.py                                          # serves the real dataset on http://127.0.0.1:8080/api
+  ./api_server.py --port 0                                 # picks a free port and prints it
+  ./api_server.py --episodes 100000 --characters 2000000   # synthesizes a large dataset
+  ./api_server.py --latency-ms 80 --jitter-ms 40 --bandwidth-kbps 512 --error-rate 0.02
+"""
+import argparse
+import asyncio
+import base64
+import functools
+import hashlib
+import json
+import os
+import random
+import re
+import resource
+import time
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURES_DIR = "Libs/RickAndMortyEpisodesLib/Fixtures"
+LIVE_API_URL = "https://rickandmortyapi.com/api"
+API_PATH = "/api"
+PAGE_SIZE = 20
+# The API root, which lists the resources under plural keys.
+ENDPOINTS_FIXTURE = "endpoints.json"
+# (fixture page, single item fixture) per resource, as named by the API routes.
+RESOURCE_FIXTURES = {
+    "character": ("characters_first_page.json", "character_rick.json"),
+    "location": ("locations_first_page.json", "location_earth1.json"),
+    "episode": ("episodes_first_page.json", "episode_pilot.json"),
+}
+# Fields holding links to other resources; synthesized items point them at items that exist.
+LINK_FIELDS = {
+    "character": ["episode", "origin", "location"],
+    "location": ["residents"],
+    "episode": ["characters"],
+}
+LINK_PATTERN = re.compile(r"/(character|location|episode)/(\d+)$")
+IDS_PATTERN = re.compile(r"^\[?(\d+(?:,\d+)*)\]?$")
+# An 8x8 JPEG in the Rick and Morty green, served for every character avatar.
+AVATAR_JPEG = base64.b64decode(
+    "/9j/4AAQSkZJRgABAgAAAQABAAD//gAPTGF2YzYxLjMuMTAwAP/bAEMACBQUFxQXGxsbGxsbIB4gISEhICAgICEhISQkJCoqKiQkJCEhJCQo"
+    "KCoqLi8uKysqKy8vMjIyPDw5OUZGSFZWZ//EAEwAAQEAAAAAAAAAAAAAAAAAAAAGAQEBAAAAAAAAAAAAAAAAAAAFBhABAAAAAAAAAAAAAAAAAAAA"
+    "ABEBAAAAAAAAAAAAAAAAAAAAAP/AABEIAAgACAMBIgACEQADEQD/2gAMAwEAAhEDEQA/AK8BDjn/2Q=="
+)
+# Rendered responses are kept, with their ETags, for the most recently requested URLs only,
+# so memory stays bounded however large the synthesized dataset is.
+RESPONSE_CACHE_SIZE = 8192
+MAX_REQUEST_HEAD_BYTES = 16 * 1024
+KEEP_ALIVE_TIMEOUT_SECONDS = 75
+INJECTED_ERROR_STATUSES = [500, 503, 429]
+BANDWIDTH_CHUNK_BYTES = 4096
+DEFAULT_BACKLOG = 4096
+STATS_INTERVAL_SECONDS = 10
+STATUS_REASONS = {
+    200: "OK",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class FixtureDataset:
+    """
+    The API's episodes, characters and locations, built on demand from the fixtures.
+    Item N is its fixture when there is one, otherwise a copy of fixture template (N - 1) % len(templates)
+    whose id, url, name and links are shifted by the same amount, so every link stays within the dataset.
+    """
+
+    def __init__(self, fixtures_dir, base_url, counts=None):
+        self.base_url = base_url
+        self.templates = {}
+        self.fixtures = {}
+        self.counts = {}
+        for resource_name, (page_file, item_file) in RESOURCE_FIXTURES.items():
+            page = self._load(os.path.join(fixtures_dir, page_file))
+            items = {item["id"]: item for item in page["results"]}
+            item = self._load(os.path.join(fixtures_dir, item_file))
+            items[item["id"]] = item
+            self.fixtures[resource_name] = items
+            self.templates[resource_name] = [items[item_id] for item_id in sorted(items)]
+            self.counts[resource_name] = (counts or {}).get(resource_name) or page["info"]["count"]
+        self.endpoints = self._load(os.path.join(fixtures_dir, ENDPOINTS_FIXTURE))
+        self.render = functools.lru_cache(maxsize=RESPONSE_CACHE_SIZE)(self._render)
+
+    def _load(self, path):
+        with open(path, encoding="utf-8") as f:
+            # Links are rewritten once, on the raw text, to point at this server.
+            return json.loads(f.read().replace(LIVE_API_URL, self.base_url))
+
+    def _shift_link(self, url, shift):
+        match = LINK_PATTERN.search(url)
+        if not match or not shift and int(match.group(2)) <= self.counts[match.group(1)]:
+            return url
+        resource_name, item_id = match.group(1), int(match.group(2))
+        item_id = (item_id - 1 + shift) % self.counts[resource_name] + 1
+        return f"{self.base_url}/{resource_name}/{item_id}"
+
+    def item(self, resource_name, item_id):
+        if not 1 <= item_id <= self.counts[resource_name]:
+            return None
+        template = self.fixtures[resource_name].get(item_id)
+        shift = 0
+        if template is None:
+            templates = self.templates[resource_name]
+            template = templates[(item_id - 1) % len(templates)]
+            shift = item_id - template["id"]
+        item = dict(template)
+        if shift:
+            item["id"] = item_id
+            item["url"] = f"{self.base_url}/{resource_name}/{item_id}"
+            item["name"] = f"{template['name']} #{item_id}"
+            if "image" in item:
+                item["image"] = f"{self.base_url}/character/avatar/{item_id}.jpeg"
+        for field in LINK_FIELDS[resource_name]:
+            value = item.get(field)
+            if isinstance(value, list):
+                item[field] = [self._shift_link(url, shift) for url in value]
+            elif isinstance(value, dict) and value.get("url"):
+                item[field] = {**value, "url": self._shift_link(value["url"], shift)}
+        return item
+
+    def page(self, resource_name, page_number):
+        count = self.counts[resource_name]
+        pages = (count + PAGE_SIZE - 1) // PAGE_SIZE
+        if not 1 <= page_number <= pages:
+            return None
+        first_id = (page_number - 1) * PAGE_SIZE + 1
+        last_id = min(first_id + PAGE_SIZE - 1, count)
+        page_url = f"{self.base_url}/{resource_name}?page="
+        return {
+            "info": {
+                "count": count,
+                "pages": pages,
+                "next": f"{page_url}{page_number + 1}" if page_number < pages else None,
+                "prev": f"{page_url}{page_number - 1}" if page_number > 1 else None,
+            },
+            "results": [self.item(resource_name, item_id) for item_id in range(first_id, last_id + 1)],
+        }
+
+    def _render(self, target):
+        """
+        Returns (status, content type, body, ETag) for a request target such as /api/episode?page=2.
+        """
+        url = urlsplit(target)
+        path = url.path.rstrip("/")
+        if path == API_PATH:
+            return self._json(200, self.endpoints)
+        parts = path[len(API_PATH) + 1:].split("/") if path.startswith(API_PATH + "/") else []
+        if len(parts) == 3 and parts[:2] == ["character", "avatar"] and parts[2].endswith(".jpeg"):
+            return 200, "image/jpeg", AVATAR_JPEG, _etag(AVATAR_JPEG)
+        if not parts or parts[0] not in RESOURCE_FIXTURES:
+            return self._not_found()
+        resource_name = parts[0]
+        if len(parts) == 1:
+            try:
+                page_number = int(parse_qs(url.query).get("page", ["1"])[0])
+            except ValueError:
+                return self._not_found()
+            page = self.page(resource_name, page_number)
+            return self._json(200, page) if page else self._not_found()
+        match = IDS_PATTERN.match(parts[1]) if len(parts) == 2 else None
+        if not match:
+            return self._not_found()
+        ids = [int(item_id) for item_id in match.group(1).split(",")]
+        if len(ids) == 1 and "," not in parts[1]:
+            item = self.item(resource_name, ids[0])
+            return self._json(200, item) if item else self._not_found()
+        # Like the real API, several ids return an array of the items that exist.
+        return self._json(200, [item for item in map(functools.partial(self.item, resource_name), ids) if item])
+
+    def _json(self, status, value):
+        body = json.dumps(value, separators=(",", ":")).encode("utf-8")
+        return status, "application/json; charset=utf-8", body, _etag(body) if status == 200 else None
+
+    def _not_found(self):
+        return self._json(404, {"error": "There is nothing here"})
+
+
+def _etag(body):
+    return f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+
+
+class ApiServer:
+    """
+    Minimal HTTP/1.1 server with keep-alive, on asyncio streams, so thousands of idle connections cost
+    only their sockets. Latency, bandwidth and error injection are applied per request.
+    """
+
+    def __init__(self, latency_seconds=0.0, jitter_seconds=0.0, bandwidth_bytes_per_second=0, error_rate=0.0,
+                 max_age_seconds=0, seed=None):
+        self.dataset = None
+        self.latency_seconds = latency_seconds
+        self.jitter_seconds = jitter_seconds
+        self.bandwidth_bytes_per_second = bandwidth_bytes_per_second
+        self.error_rate = error_rate
+        self.max_age_seconds = max_age_seconds
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.not_modified = 0
+        self.injected_errors = 0
+        self.bytes_sent = 0
+        self.connections = 0
+        self.peak_connections = 0
+
+    def _respond(self, method, target, headers):
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.injected_errors += 1
+            status = self.random.choice(INJECTED_ERROR_STATUSES)
+            extra_headers = {"Retry-After": "1"} if status in (429, 503) else {}
+            body = json.dumps({"error": "Injected failure"}).encode("utf-8")
+            return status, "application/json; charset=utf-8", body, extra_headers
+        if method not in ("GET", "HEAD"):
+            return 405, "text/plain", b"", {"Allow": "GET, HEAD"}
+        status, content_type, body, etag = self.dataset.render(target)
+        extra_headers = {}
+        if etag:
+            extra_headers["ETag"] = etag
+            if self.max_age_seconds:
+                extra_headers["Cache-Control"] = f"public, max-age={self.max_age_seconds}"
+            if_none_match = headers.get("if-none-match", "")
+            if etag in if_none_match.split(", ") or if_none_match.strip() == "*":
+                self.not_modified += 1
+                return 304, None, b"", extra_headers
+        return status, content_type, body, extra_headers
+
+    async def _write_body(self, writer, body):
+        if not self.bandwidth_bytes_per_second:
+            writer.write(body)
+            return
+        for offset in range(0, len(body), BANDWIDTH_CHUNK_BYTES):
+            chunk = body[offset:offset + BANDWIDTH_CHUNK_BYTES]
+            writer.write(chunk)
+            await writer.drain()
+            await asyncio.sleep(len(chunk) / self.bandwidth_bytes_per_second)
+
+    async def handle_connection(self, reader, writer):
+        self.connections += 1
+        self.peak_connections = max(self.peak_connections, self.connections)
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_TIMEOUT_SECONDS)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+                    break
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ", 2)
+                except ValueError:
+                    writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(":")
+                    if name:
+                        headers[name.strip().lower()] = value.strip()
+                request_body_length = int(headers.get("content-length", "0") or 0)
+                if request_body_length:
+                    await reader.readexactly(request_body_length)
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+
+                self.requests += 1
+                status, content_type, body, extra_headers = self._respond(method, target, headers)
+                if self.latency_seconds or self.jitter_seconds:
+                    delay = self.latency_seconds + self.random.uniform(-self.jitter_seconds, self.jitter_seconds)
+                    await asyncio.sleep(max(0.0, delay))
+                response_headers = [f"HTTP/1.1 {status} {STATUS_REASONS.get(status, 'Unknown')}"]
+                if content_type:
+                    response_headers.append(f"Content-Type: {content_type}")
+                response_headers.append(f"Content-Length: {len(body)}")
+                response_headers.extend(f"{name}: {value}" for name, value in extra_headers.items())
+                response_headers.append("Connection: keep-alive" if keep_alive else "Connection: close")
+                writer.write(("\r\n".join(response_headers) + "\r\n\r\n").encode("latin-1"))
+                if method != "HEAD":
+                    await self._write_body(writer, body)
+                    self.bytes_sent += len(body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def report_stats(self):
+        last_requests = 0
+        last_time = time.time()
+        while True:
+            await asyncio.sleep(STATS_INTERVAL_SECONDS)
+            now = time.time()
+            if self.requests != last_requests:
+                rate = (self.requests - last_requests) / (now - last_time)
+                print(f"📊\t{rate:.0f} requests/s, {self.connections} open connections (peak {self.peak_connections}), "
+                      f"{self.not_modified} not modified, {self.injected_errors} injected errors, "
+                      f"{self.bytes_sent / 1_000_000:.1f} MB sent")
+            last_requests = self.requests
+            last_time = now
+
+
+def raise_open_files_limit():
+    """
+    Raises the soft limit on open files to the hard limit, so thousands of keep-alive connections fit.
+    """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    # macOS reports an unlimited hard limit but refuses soft limits above OPEN_MAX.
+    for limit in (hard, 10240):
+        if limit == resource.RLIM_INFINITY or limit <= soft:
+            continue
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+            return limit
+        except (ValueError, OSError):
+            continue
+    return soft
+
+
+async def serve(args):
+    server = ApiServer(
+        latency_seconds=args.latency_ms / 1000,
+        jitter_seconds=args.jitter_ms / 1000,
+        bandwidth_bytes_per_second=args.bandwidth_kbps * 1000 / 8,
+        error_rate=args.error_rate,
+        max_age_seconds=args.max_age,
+        seed=args.seed,
+    )
+    tcp_server = await asyncio.start_server(
+        server.handle_connection, args.host, args.port,
+        backlog=args.backlog, limit=MAX_REQUEST_HEAD_BYTES, start_serving=False,
+    )
+    port = tcp_server.sockets[0].getsockname()[1]
+    base_url = f"http://{args.host}:{port}{API_PATH}"
+    server.dataset = FixtureDataset(
+        args.fixtures, base_url,
+        counts={"episode": args.episodes, "character": args.characters, "location": args.locations},
+    )
+    counts = server.dataset.counts
+    print(f"🛰️\tServing {counts['episode']} episodes, {counts['character']} characters and "
+          f"{counts['location']} locations at {base_url}", flush=True)
+    asyncio.get_running_loop().create_task(server.report_stats())
+    try:
+        async with tcp_server:
+            await tcp_server.serve_forever()
+    finally:
+        print(f"\t✅\tServed {server.requests} requests ({server.not_modified} not modified, "
+              f"{server.injected_errors} injected errors) to at most {server.peak_connections} connections at once")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the Rick and Morty API from the fixtures.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on.")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on, 0 for any free port.")
+    parser.add_argument("--fixtures", default=FIXTURES_DIR, help="Directory with the fixture JSON files.")
+    parser.add_argument("--episodes", type=int, help="Number of episodes (defaults to the fixtures' count).")
+    parser.add_argument("--characters", type=int, help="Number of characters (defaults to the fixtures' count).")
+    parser.add_argument("--locations", type=int, help="Number of locations (defaults to the fixtures' count).")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Delay added before every response.")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Random +/- variation of the delay.")
+    parser.add_argument("--bandwidth-kbps", type=float, default=0.0, help="Per-connection bandwidth cap, 0 for none.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 500, 503 or 429.")
+    parser.add_argument("--max-age", type=int, default=0, help="Cache-Control max-age in seconds, 0 to send none.")
+    parser.add_argument("--seed", type=int, help="Seed for latency jitter and error injection.")
+    parser.add_argument("--backlog", type=int, default=DEFAULT_BACKLOG, help="Listen backlog for bursts of new connections.")
+    args = parser.parse_args()
+    open_files = raise_open_files_limit()
+    print(f"🔧\tOpen files limit: {open_files}")
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
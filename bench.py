@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Script to benchmark the repository tooling (clot.py, format.py, test.py) on synthetic repositories.
+Run with: ./bench.py
+Usage:
+  ./bench.py                                  # benchmarks the default repository sizes
+  ./bench.py --sizes 10,1000 --repeat 5       # benchmarks specific sizes, 5 runs each
+  ./bench.py --compare bench_results_old.json # prints the change against earlier results
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+DEFAULT_SIZES = "10,100,1000,10000"
+DEFAULT_REPEAT = 3
+DEFAULT_OUTPUT_PATH = "bench_results.json"
+RANDOM_SEED = 42
+# Share of files touched on the synthetic feature branch.
+MODIFIED_FILES_RATIO = 0.02
+ADDED_FILES_RATIO = 0.01
+DELETED_FILES_RATIO = 0.005
+FEATURES = ["Character", "Episode", "Location", "Settings", "Skeleton", "Reuse", "EntryPoints", "Decorations"]
+FEATURE_FILE_KINDS = ["feature", "logic", "view"]
+
+STAND_IN_SWIFT_FORMAT = '''#!/usr/bin/env python3
+"""Stand-in for swift-format: reads every file it is given, like the real formatter, and changes nothing."""
+import sys
+
+if "--version" in sys.argv:
+    print("601.0.0-bench")
+    sys.exit(0)
+paths = [arg for arg in sys.argv[2:] if not arg.startswith("-")]
+if not paths:
+    sys.stdout.write(sys.stdin.read())
+for path in paths:
+    with open(path, "rb") as f:
+        f.read()
+'''
+
+STAND_IN_XCODEBUILD = '''#!/usr/bin/env python3
+"""Stand-in for xcodebuild: prints test output in xcodebuild's format for the synthetic test classes."""
+import os
+import sys
+import time
+
+if "-version" in sys.argv:
+    print("Xcode 16.0-bench")
+    sys.exit(0)
+if "build-for-testing" in sys.argv:
+    scheme = sys.argv[sys.argv.index("-scheme") + 1]
+    products_dir = os.path.join(sys.argv[sys.argv.index("-derivedDataPath") + 1], "Build", "Products")
+    os.makedirs(products_dir, exist_ok=True)
+    with open(os.path.join(products_dir, f"{scheme}_{scheme}_iphonesimulator18.0-arm64.xctestrun"), "w") as f:
+        f.write("<plist/>")
+    print("** TEST BUILD SUCCEEDED **")
+    sys.exit(0)
+only_testing = [sys.argv[i + 1] for i, arg in enumerate(sys.argv) if arg == "-only-testing"]
+only_testing += [arg.split(":", 1)[1] for arg in sys.argv if arg.startswith("-only-testing:")]
+skip_testing = [sys.argv[i + 1] for i, arg in enumerate(sys.argv) if arg == "-skip-testing"]
+classes = os.environ.get("BENCH_TEST_CLASSES", "RickAndMortyEpisodesLibTests/SyntheticTests").split(",")
+failing_classes = set(filter(None, os.environ.get("BENCH_FAILING_TEST_CLASSES", "").split(",")))
+delay = float(os.environ.get("BENCH_TEST_SECONDS", "0.001"))
+
+
+def matches(selectors, target, test_class):
+    # Swift Testing functions are selected as Target/function(), classes as Target/Class.
+    return [s for s in selectors if s.split("(")[0] in (target, test_class) or s.startswith(test_class + "/")]
+
+
+failed = False
+for test_class in classes:
+    target, name = test_class.split("/")
+    if (only_testing and not matches(only_testing, target, test_class)) or matches(skip_testing, target, test_class):
+        continue
+    status = "failed" if test_class in failing_classes else "passed"
+    failed = failed or status == "failed"
+    for i in range(3):
+        print(f"Test Case '-[{target}.{name} test{i}]' started.", flush=True)
+        time.sleep(delay)
+        print(f"Test Case '-[{target}.{name} test{i}]' {status} ({delay:.3f} seconds).", flush=True)
+print("** TEST FAILED **" if failed else "** TEST SUCCEEDED **")
+sys.exit(65 if failed else 0)
+'''
+
+STAND_IN_XCRUN = '''#!/usr/bin/env python3
+"""Stand-in for xcrun simctl: lists one iPhone 16 simulator and pretends to clone and delete it."""
+import json
+import sys
+import uuid
+
+args = sys.argv[1:]
+if args[:2] == ["simctl", "list"]:
+    device = {"name": "iPhone 16", "udid": "00000000-0000-0000-0000-000000000016", "state": "Shutdown", "isAvailable": True}
+    print(json.dumps({"devices": {"com.apple.CoreSimulator.SimRuntime.iOS-18-0": [device]}}))
+elif args[:2] == ["simctl", "clone"]:
+    print(str(uuid.uuid4()).upper())
+elif args[:2] != ["simctl", "delete"]:
+    sys.exit(f"stand-in xcrun does not support: {' '.join(args)}")
+'''
+
+
+def _swift_source(rng, type_name):
+    properties = "\n".join(
+        f"  var property{i}: {rng.choice(['Int', 'String', 'URL?', '[Int]'])}" for i in range(rng.randint(3, 12))
+    )
+    functions = "\n\n".join(
+        f"  func action{i}(value: Int) -> Int {{\n"
+        f"    let doubled = value * {rng.randint(2, 9)}\n"
+        f"    return doubled + {rng.randint(0, 100)}\n"
+        f"  }}"
+        for i in range(rng.randint(2, 10))
+    )
+    return f"import Foundation\n\nstruct {type_name} {{\n{properties}\n\n{functions}\n}}\n"
+
+
+def _json_source(rng, index):
+    results = [
+        {
+            "id": index * 100 + i,
+            "name": f"Episode {i}",
+            "air_date": f"December {rng.randint(1, 28)}, 2013",
+            "episode": f"S01E{i:02d}",
+            "characters": [f"https://rickandmortyapi.com/api/character/{c}" for c in range(rng.randint(1, 20))],
+        }
+        for i in range(rng.randint(1, 20))
+    ]
+    return json.dumps({"info": {"count": len(results), "next": None, "prev": None}, "results": results}, indent=4)
+
+
+def _markdown_source(rng, index):
+    paragraphs = [
+        " ".join(rng.choice(["Rick", "Morty", "portal", "gun", "episode", "cache", "network", "view"]) for _ in range(40))
+        for _ in range(rng.randint(2, 8))
+    ]
+    return f"# Notes {index}\n\n" + "\n\n".join(paragraphs) + "\n"
+
+
+def _synthetic_files(num_files, rng):
+    """
+    Returns {relative_path: content} shaped like this repository: Swift features, tests, JSON fixtures and docs.
+    """
+    files = {}
+    for i in range(num_files):
+        kind = rng.random()
+        feature = FEATURES[i % len(FEATURES)]
+        module = f"Libs/Module{i // 500}Lib"
+        if kind < 0.6:
+            file_kind = FEATURE_FILE_KINDS[i % len(FEATURE_FILE_KINDS)]
+            path = f"{module}/Sources/Features/{feature}/{feature}{i}.{file_kind}.swift"
+            files[path] = _swift_source(rng, f"{feature}{i}")
+        elif kind < 0.75:
+            files[f"{module}/Tests/{feature}{i}.tests.swift"] = _swift_source(rng, f"{feature}{i}Tests")
+        elif kind < 0.9:
+            files[f"{module}/Fixtures/{feature.lower()}_{i}.json"] = _json_source(rng, i)
+        else:
+            files[f"docs/{feature.lower()}/notes_{i}.md"] = _markdown_source(rng, i)
+    return files
+
+
+def _write_files(root, files):
+    for rel_path, content in files.items():
+        path = root / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content, encoding="utf-8")
+
+
+def _git(root, *args):
+    subprocess.run(["git", *args], cwd=root, check=True, stdout=subprocess.DEVNULL)
+
+
+def create_synthetic_repo_step(root, num_files):
+    """
+    Creates a git repository with num_files files on 'main' and a checked out feature branch
+    that modifies, adds and deletes a realistic share of them.
+    """
+    print(f"🏗️\tCreating synthetic repository with {num_files} files...")
+    start = time.time()
+    rng = random.Random(RANDOM_SEED + num_files)
+    files = _synthetic_files(num_files, rng)
+    root.mkdir(parents=True)
+    _write_files(root, files)
+    _git(root, "init", "-q", "-b", "main")
+    _git(root, "config", "user.name", "Bench")
+    _git(root, "config", "user.email", "bench@example.com")
+    _git(root, "add", "-A")
+    _git(root, "commit", "-q", "-m", "Synthetic baseline")
+    _git(root, "checkout", "-q", "-b", "feature/bench")
+
+    paths = sorted(files)
+    for rel_path in rng.sample(paths, max(1, int(len(paths) * MODIFIED_FILES_RATIO))):
+        lines = files[rel_path].splitlines(keepends=True)
+        insert_at = rng.randint(0, len(lines))
+        lines[insert_at:insert_at] = [f"// Changed on the feature branch ({rng.randint(0, 10**6)})\n"] * rng.randint(1, 20)
+        (root / rel_path).write_text("".join(lines), encoding="utf-8")
+    added = _synthetic_files(max(1, int(len(paths) * ADDED_FILES_RATIO)), random.Random(rng.random()))
+    _write_files(root, {f"Libs/NewFeatureLib/{path}": content for path, content in added.items()})
+    for rel_path in rng.sample(paths, int(len(paths) * DELETED_FILES_RATIO)):
+        (root / rel_path).unlink()
+    _git(root, "add", "-A")
+    _git(root, "commit", "-q", "-m", "Synthetic feature branch")
+    elapsed = time.time() - start
+    print(f"\t✅\tSynthetic repository created (took {elapsed:.2f} seconds)")
+
+
+def install_stand_in_tools_step(bin_dir):
+    """
+    Writes stand-in swift-format, xcodebuild and xcrun executables to bin_dir and puts them first on PATH.
+    """
+    print(f"🧰\tInstalling stand-in swift-format, xcodebuild and xcrun in {bin_dir}")
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    stand_ins = [("swift-format", STAND_IN_SWIFT_FORMAT), ("xcodebuild", STAND_IN_XCODEBUILD), ("xcrun", STAND_IN_XCRUN)]
+    for name, source in stand_ins:
+        path = bin_dir / name
+        path.write_text(source, encoding="utf-8")
+        path.chmod(0o755)
+    os.environ["PATH"] = f"{bin_dir}{os.pathsep}{os.environ['PATH']}"
+
+
+def _measure(name, num_files, repeat, func, **params):
+    """
+    Runs func repeat times with its output silenced and returns a result record with wall-clock statistics.
+    """
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            try:
+                func()
+            except SystemExit as e:
+                if e.code:
+                    raise RuntimeError(f"{name} exited with {e.code}") from e
+        samples.append(time.perf_counter() - start)
+    result = {
+        "name": name,
+        "files": num_files,
+        "params": params,
+        "repeat": repeat,
+        "min_seconds": min(samples),
+        "median_seconds": statistics.median(samples),
+        "max_seconds": max(samples),
+    }
+    print(f"\t⏱️\t{_describe(result)} - median {result['median_seconds']:.3f}s (min {result['min_seconds']:.3f}s)")
+    return result
+
+
+def _describe(result):
+    params = " ".join(f"{key}={value}" for key, value in result["params"].items())
+    return f"{result['name']}{' ' + params if params else ''} - {result['files']} files"
+
+
+def run_benchmarks_step(root, num_files, repeat):
+    import clot
+    import format as format_script
+    import test as test_script
+
+    print(f"⏱️\tBenchmarking {num_files} files...")
+    # The stand-in xcodebuild reports these classes, so test drivers see a realistically sized suite.
+    os.environ["BENCH_TEST_CLASSES"] = ",".join(_test_classes(root))
+    results = []
+    previous_cwd = os.getcwd()
+    # The drivers operate on the current directory, like they do when run from the repository root.
+    os.chdir(root)
+    try:
+        results.append(_measure(
+            "format.find_swift_files_step", num_files, repeat,
+            lambda: format_script.find_swift_files_step(root),
+        ))
+        with contextlib.redirect_stdout(io.StringIO()):
+            swift_files = format_script.find_swift_files_step(root)
+        results.append(_measure(
+            "format.format_files_step", num_files, repeat,
+            lambda: format_script.format_files_step(root, swift_files),
+        ))
+        jobs_options = sorted({1, os.cpu_count() or 1})
+        for jobs in jobs_options:
+            results.append(_measure(
+                "clot.count_for_branch", num_files, repeat,
+                lambda: clot.count_for_branch(jobs=jobs),
+                jobs=jobs,
+            ))
+        results.append(_measure("test.run_all_tests", num_files, repeat, test_script.run_all_tests))
+    finally:
+        os.chdir(previous_cwd)
+    return results
+
+
+def _test_classes(root):
+    return sorted(
+        f"RickAndMortyEpisodesLibTests/{path.name.split('.')[0]}Tests"
+        for path in root.glob("Libs/*/Tests/*.tests.swift")
+    )[:50] or ["RickAndMortyEpisodesLibTests/SyntheticTests"]
+
+
+def _machine_info():
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=Path(__file__).parent, encoding="utf-8", stderr=subprocess.DEVNULL
+        ).strip()
+    except Exception:
+        commit = None
+    return {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "tooling_commit": commit,
+    }
+
+
+def compare_results_step(results, baseline_path):
+    print(f"📊\tComparing with {baseline_path}")
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    def key(result):
+        return result["name"], result["files"], json.dumps(result["params"], sort_keys=True)
+
+    baseline_by_key = {key(result): result for result in baseline["results"]}
+    for result in results:
+        old = baseline_by_key.get(key(result))
+        if old is None:
+            continue
+        change = (result["median_seconds"] - old["median_seconds"]) / old["median_seconds"] * 100 if old["median_seconds"] else 0.0
+        emoji = "⚠️" if change > 10 else "✅"
+        print(
+            f"\t{emoji}\t{_describe(result)} - "
+            f"{old['median_seconds']:.3f}s -> {result['median_seconds']:.3f}s ({change:+.0f}%)"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the repository tooling on synthetic repositories.')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='Comma-separated numbers of files per synthetic repository.')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='Runs per measurement.')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT_PATH, help='Where to write the JSON results.')
+    parser.add_argument('--compare', help='Earlier JSON results to compare against.')
+    parser.add_argument('--keep', action='store_true', help='Keep the synthetic repositories for inspection.')
+    args = parser.parse_args()
+
+    print('🔧\tStarting tooling benchmarks...')
+    start = time.time()
+    sys.path.insert(0, str(Path(__file__).parent.resolve()))
+    work_dir = Path(tempfile.mkdtemp(prefix="rnm_bench_"))
+    results = []
+    try:
+        install_stand_in_tools_step(work_dir / "bin")
+        for num_files in [int(size) for size in args.sizes.split(",")]:
+            root = work_dir / f"repo_{num_files}"
+            create_synthetic_repo_step(root, num_files)
+            results.extend(run_benchmarks_step(root, num_files, args.repeat))
+    finally:
+        if args.keep:
+            print(f"📁\tSynthetic repositories kept in {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"machine": _machine_info(), "results": results}, f, indent=4)
+    print(f"📝\tResults written to {args.output}")
+    if args.compare:
+        compare_results_step(results, args.compare)
+    elapsed = time.time() - start
+    print(f'🎉\tAll benchmarks completed! (total time: {elapsed:.2f} seconds)')
+
+
+if __name__ == '__main__':
+    main()
@@ -3,95 +3,811 @@
 Script to count tokens in a file using tiktoken.
 Run with: ./clot.py <filename>
 """
+import hashlib
+import json
+import multiprocessing
 import os
 import subprocess
 import sys
+import tempfile
 import tiktoken
 import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from repo_files import list_repo_files
+from steps import MAX_RSS_UNIT_BYTES
+
+ENCODING_MODEL = "gpt-4"
+TOKEN_CACHE_PATH = ".clot_cache.json"
+TOKEN_CACHE_MAX_ENTRIES = 50000
+# Files larger than this are tokenized in chunks so peak memory does not grow with file size.
+STREAM_THRESHOLD_BYTES = 8 * 1024 * 1024
+STREAM_CHUNK_CHARS = 1024 * 1024
+COUNTABLE_EXTENSIONS = {"py", "swift", "json", "md"}
+TREE_REPORT_PATH = "clot_tree.json"
+OUTPUT_FORMATS = ("text", "json", "ndjson")
+
+# Building a tiktoken encoder is far more expensive than encoding a typical
+# source file, so each process (including pool workers) builds it only once.
+_encoding = None
+# Seconds spent in this process on phases that are not attributed to a single file.
+_phase_seconds = {"git": 0.0, "encoder_load": 0.0}
+
+# Token count of one file or blob, with where the time went. bytes is None for cached blobs, which are not read.
+FileTokenCount = namedtuple(
+    "FileTokenCount",
+    ["tokens", "bytes", "read_seconds", "encode_seconds", "encoder_load_seconds", "is_cached"],
+)
 
 def print_usage():
     print("Usage:")
     print("  ./clot.py file <filename>   # Count tokens in a file")
     print("  ./clot.py branch            # Count tokens in current branch diffs")
+    print("  ./clot.py diff              # Count tokens only in added and removed lines of branch diffs")
+    print("  ./clot.py tree [path]       # Count tokens in the whole tree, rolled up by directory")
+    print("  ./clot.py bench <filename>  # Compare memory and speed of whole-file and streaming counting")
+    print("Options for 'branch' and 'diff':")
+    print("  --limit <N>                 # Report each file against a token limit")
+    print("  --hard_limit                # Exit with an error if any file is over the limit")
+    print("  --range <base>..<head>      # Count changes in a revision range, read from git objects")
+    print("  --staged                    # Count changes staged in the index, read from git objects")
+    print("Options for 'branch' and 'tree':")
+    print("  --jobs <N>                  # Count files in N worker processes")
+    print("  --no-cache                  # Do not read or update the token count cache")
+    print("Options for 'file' and 'branch':")
+    print("  --format text|json|ndjson   # Output format; json and ndjson include per-file and per-phase timings")
+    print("Options for 'tree':")
+    print(f"  --json <path>               # Where to write the JSON report (default: {TREE_REPORT_PATH})")
+
+def get_encoding():
+    global _encoding
+    if _encoding is None:
+        start = time.perf_counter()
+        _encoding = tiktoken.encoding_for_model(ENCODING_MODEL)
+        _phase_seconds["encoder_load"] += time.perf_counter() - start
+    return _encoding
+
+def _take_encoder_load_seconds():
+    """
+    Returns encoder load time not yet attributed to a result, so pool workers can report it once.
+    """
+    seconds = _phase_seconds["encoder_load"]
+    _phase_seconds["encoder_load"] = 0.0
+    return seconds
+
+def run_git(args, **kwargs):
+    """
+    Runs a git command and returns its output, adding the time spent to the git phase.
+    """
+    start = time.perf_counter()
+    try:
+        return subprocess.check_output(["git", *args], **kwargs)
+    finally:
+        _phase_seconds["git"] += time.perf_counter() - start
+
+def git_blob_sha(data):
+    """
+    Returns the SHA git would assign to a blob with the given content.
+    """
+    sha = hashlib.sha1(f"blob {len(data)}\0".encode("ascii"))
+    sha.update(data)
+    return sha.hexdigest()
+
+def git_blob_sha_for_file(file):
+    """
+    Same as git_blob_sha, but hashes the file in chunks instead of reading it into memory.
+    """
+    with open(file, "rb") as f:
+        sha = hashlib.sha1(f"blob {os.fstat(f.fileno()).st_size}\0".encode("ascii"))
+        while chunk := f.read(STREAM_CHUNK_CHARS):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+class TokenCountCache:
+    """
+    On-disk token counts keyed by encoding name and git blob SHA, evicting the least recently used entries.
+    """
+
+    def __init__(self, path=TOKEN_CACHE_PATH, max_entries=TOKEN_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.encoding_name = tiktoken.encoding_name_for_model(ENCODING_MODEL)
+        # Ordered from least to most recently used.
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.is_dirty = False
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = OrderedDict((key, count) for key, count in json.load(f))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"⚠️\tIgnoring unreadable token cache {self.path}: {e}")
+            self.entries = OrderedDict()
+        return self
+
+    def save(self):
+        if not self.is_dirty:
+            return
+        # A unique temporary file keeps concurrent runs (e.g. parallel pre-push hooks) from clobbering each other.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(list(self.entries.items()), f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.is_dirty = False
+
+    def key_for_blob(self, blob_sha):
+        return f"{self.encoding_name}:{blob_sha}"
+
+    def key_for_file(self, file):
+        return self.key_for_blob(git_blob_sha_for_file(file))
+
+    def get(self, key):
+        count = self.entries.get(key)
+        if count is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # Recency is only persisted along with new entries, so runs that add nothing don't rewrite the cache.
+        self.entries.move_to_end(key)
+        return count
+
+    def put(self, key, count):
+        self.entries[key] = count
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self.is_dirty = True
+
+    def summary(self):
+        return f"token cache: {self.hits} hit(s), {self.misses} miss(es)"
+
+def count_tokens(file, cache=None):
+    if cache is not None:
+        key = cache.key_for_file(file)
+        count = cache.get(key)
+        if count is None:
+            count = count_tokens(file)
+            cache.put(key, count)
+        return count
+    return measure_file(file).tokens
+
+def measure_file(file):
+    """
+    Counts tokens in file and returns them as a FileTokenCount with read and encode times.
+    """
+    encoder_load_seconds = _take_encoder_load_seconds()
+    encoding = get_encoding()
+    encoder_load_seconds += _take_encoder_load_seconds()
+    size = os.path.getsize(file)
+    start = time.perf_counter()
+    if size > STREAM_THRESHOLD_BYTES:
+        count, encode_seconds = _count_streaming(file, STREAM_CHUNK_CHARS)
+        read_seconds = time.perf_counter() - start - encode_seconds
+    else:
+        with open(file, "r", encoding="utf-8") as f:
+            text = f.read()
+        read_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        count = len(encoding.encode(text))
+        encode_seconds = time.perf_counter() - start
+    return FileTokenCount(count, size, read_seconds, encode_seconds, encoder_load_seconds, False)
+
+def measure_text(text):
+    """
+    Counts tokens in text and returns them as a FileTokenCount; bytes and read time are left for the caller.
+    """
+    encoder_load_seconds = _take_encoder_load_seconds()
+    encoding = get_encoding()
+    encoder_load_seconds += _take_encoder_load_seconds()
+    start = time.perf_counter()
+    count = len(encoding.encode(text))
+    encode_seconds = time.perf_counter() - start
+    return FileTokenCount(count, None, 0.0, encode_seconds, encoder_load_seconds, False)
+
+def count_tokens_streaming(file, chunk_chars=STREAM_CHUNK_CHARS):
+    """
+    Counts tokens reading the file in chunks of chunk_chars characters.
+    Text is only split at boundaries where the encoder's pre-tokenizer always splits too,
+    so the total matches encoding the whole file at once.
+    Peak memory is bounded by the chunk size plus the longest run of text without such a boundary.
+    """
+    return _count_streaming(file, chunk_chars)[0]
 
-def count_tokens(file):
-    encoding = tiktoken.encoding_for_model("gpt-4")
+def _count_streaming(file, chunk_chars):
+    encoding = get_encoding()
+    count = 0
+    encode_seconds = 0.0
+    pending = ""
     with open(file, "r", encoding="utf-8") as f:
-        text = f.read()
-    tokens = encoding.encode(text)
+        while chunk := f.read(chunk_chars):
+            pending += chunk
+            split_at = _last_safe_split(pending)
+            if split_at > 0:
+                start = time.perf_counter()
+                count += len(encoding.encode(pending[:split_at]))
+                encode_seconds += time.perf_counter() - start
+                pending = pending[split_at:]
+    if pending:
+        start = time.perf_counter()
+        count += len(encoding.encode(pending))
+        encode_seconds += time.perf_counter() - start
+    return count, encode_seconds
+
+def _last_safe_split(text):
+    """
+    Returns the last index where text can be split without changing its tokens, or 0 if there is none.
+    The encoder's pre-tokenizer always splits after a newline that is followed by a whitespace run
+    without further newlines, and before a space that follows a non-whitespace character.
+    """
+    newline_split = 0
+    end = len(text)
+    newline = text.rfind("\n")
+    while newline != -1:
+        # The whitespace run after the newline must end before the next newline (and within text).
+        if text[newline + 1:end].strip():
+            newline_split = newline + 1
+            break
+        end = newline
+        newline = text.rfind("\n", 0, newline)
+    space_split = 0
+    space = text.rfind(" ", 1)
+    while space != -1:
+        if not text[space - 1].isspace():
+            space_split = space
+            break
+        space = text.rfind(" ", 1, space)
+    return max(newline_split, space_split)
+
+def benchmark_streaming(file):
+    """
+    Counts file with whole-file and streaming tokenization, each in a fresh process,
+    and prints token counts, throughput and peak memory for both.
+    """
+    size = os.path.getsize(file)
+    print(f"⏱️\tBenchmarking {file} ({size / (1024 * 1024):.1f} MiB)")
+    results = {}
+    for mode in ("whole", "streaming"):
+        # A fresh process per mode keeps the peak RSS of one mode from hiding the other.
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=get_encoding) as executor:
+            results[mode] = executor.submit(_benchmark_count, file, mode).result()
+    print(f"\t{'Mode':<10}\t{'Tokens':>10}\t{'Seconds':>8}\t{'MiB/s':>8}\t{'Py peak MiB':>11}\t{'RSS growth MiB':>14}")
+    for mode, (count, elapsed, python_peak, rss_growth) in results.items():
+        throughput = size / (1024 * 1024) / elapsed if elapsed > 0 else float("inf")
+        print(
+            f"\t{mode:<10}\t{count:>10}\t{elapsed:>8.2f}\t{throughput:>8.1f}"
+            f"\t{python_peak / (1024 * 1024):>11.1f}\t{rss_growth / (1024 * 1024):>14.1f}"
+        )
+    if results["whole"][0] != results["streaming"][0]:
+        print("❌\tToken counts differ between whole-file and streaming tokenization.")
+        sys.exit(1)
+
+def _benchmark_count(file, mode):
+    import resource
+    import tracemalloc
+
+    def count():
+        if mode == "streaming":
+            return count_tokens_streaming(file)
+        with open(file, "r", encoding="utf-8") as f:
+            return count_tokens_in_text(f.read())
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAX_RSS_UNIT_BYTES
+    start = time.perf_counter()
+    token_count = count()
+    elapsed = time.perf_counter() - start
+    rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAX_RSS_UNIT_BYTES - rss_before
+    # tracemalloc slows allocations down, so Python heap usage is measured in a separate pass.
+    tracemalloc.start()
+    count()
+    _, python_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return token_count, elapsed, python_peak, rss_growth
+
+def count_tokens_in_text(text):
+    tokens = get_encoding().encode(text)
     return len(tokens)
 
+def decode_blob(data):
+    """
+    Decodes blob bytes the way open(..., "r") would, including universal newline translation,
+    so blob and working tree counts agree.
+    """
+    return data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+
+def measure_file_if_decodable(file):
+    """
+    Same as measure_file, but returns None for a file that is not valid UTF-8 instead of raising.
+    """
+    try:
+        return measure_file(file)
+    except UnicodeDecodeError:
+        return None
+
+def count_tokens_in_files(files, jobs=1, cache=None, skip_undecodable=False):
+    """
+    Returns a FileTokenCount for each file, in the same order as files.
+    Only files whose content is not in the cache are tokenized.
+    With skip_undecodable, files that are not valid UTF-8 get None instead of failing the whole count.
+    With jobs > 1 the files are counted in a process pool where every worker builds the encoder once.
+    """
+    measure = measure_file_if_decodable if skip_undecodable else measure_file
+    if cache is None:
+        return _map_in_pool(measure, files, jobs)
+    results = []
+    keys = []
+    for f in files:
+        # For cache hits, hashing the file is the only read.
+        start = time.perf_counter()
+        key = cache.key_for_file(f)
+        count = cache.get(key)
+        read_seconds = time.perf_counter() - start
+        keys.append(key)
+        results.append(None if count is None else FileTokenCount(count, os.path.getsize(f), read_seconds, 0.0, 0.0, True))
+    missed = [i for i, result in enumerate(results) if result is None]
+    missed_results = _map_in_pool(measure, [files[i] for i in missed], jobs)
+    for i, result in zip(missed, missed_results):
+        results[i] = result
+        if result is not None:
+            cache.put(keys[i], result.tokens)
+    return results
+
+def count_tokens_in_blobs(blob_shas, jobs=1, cache=None):
+    """
+    Returns a FileTokenCount for each git blob, in the same order as blob_shas.
+    Blob SHAs double as cache keys, so cached blobs are never even read from the object store.
+    """
+    results = [None] * len(blob_shas)
+    keys = [None] * len(blob_shas)
+    if cache is not None:
+        keys = [cache.key_for_blob(sha) for sha in blob_shas]
+        for i, key in enumerate(keys):
+            count = cache.get(key)
+            if count is not None:
+                results[i] = FileTokenCount(count, None, 0.0, 0.0, 0.0, True)
+    missed = [i for i, result in enumerate(results) if result is None]
+    reads = {}
+
+    def read_blobs(reader):
+        for i in missed:
+            start = time.perf_counter()
+            data = reader.read(blob_shas[i])
+            reads[i] = (len(data), time.perf_counter() - start)
+            yield decode_blob(data)
+
+    with GitBlobReader() as reader:
+        missed_results = _map_in_pool(measure_text, read_blobs(reader), jobs, len(missed))
+    for i, result in zip(missed, missed_results):
+        size, read_seconds = reads[i]
+        results[i] = result._replace(bytes=size, read_seconds=read_seconds)
+        if cache is not None:
+            cache.put(keys[i], result.tokens)
+    return results
+
+def _map_in_pool(func, items, jobs, num_items=None):
+    if num_items is None:
+        num_items = len(items)
+    if jobs <= 1 or num_items <= 1:
+        return [func(item) for item in items]
+    jobs = min(jobs, num_items)
+    # Hand out a few items per task so small files don't drown in IPC overhead.
+    chunksize = max(1, num_items // (jobs * 4))
+    with ProcessPoolExecutor(max_workers=jobs, initializer=get_encoding) as executor:
+        return list(executor.map(func, items, chunksize=chunksize))
+
+class GitBlobReader:
+    """
+    Reads blob contents through a single long-lived `git cat-file --batch` process.
+    """
+
+    def __init__(self):
+        self.proc = None
+
+    def __enter__(self):
+        self.proc = subprocess.Popen(
+            ["git", "cat-file", "--batch"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        return self
+
+    def __exit__(self, *exc_info):
+        self.proc.stdin.close()
+        self.proc.stdout.close()
+        self.proc.wait()
+
+    def read(self, blob_sha):
+        self.proc.stdin.write(f"{blob_sha}\n".encode("ascii"))
+        self.proc.stdin.flush()
+        header = self.proc.stdout.readline().decode("ascii").split()
+        if len(header) != 3:
+            raise RuntimeError(f"git cat-file could not read {blob_sha}: {' '.join(header)}")
+        size = int(header[2])
+        data = self.proc.stdout.read(size)
+        # Every object is followed by a newline separator.
+        self.proc.stdout.read(1)
+        return data
+
+def list_changed_blobs(rev_range=None):
+    """
+    Returns (path, blob_sha) pairs for files changed in rev_range, or staged in the index when rev_range is None.
+    blob_sha is None for deleted files and submodules.
+    """
+    cmd = ["git", "diff", "--raw", "-z", "--no-abbrev", "--no-renames"]
+    cmd += [rev_range] if rev_range else ["--cached"]
+    fields = run_git(cmd[1:]).split(b"\0")
+    changed_blobs = []
+    for meta, path in zip(fields[0::2], fields[1::2]):
+        # Raw format: ":<old mode> <new mode> <old sha> <new sha> <status>"
+        _, new_mode, _, new_sha, _ = meta.decode("ascii").split(" ")
+        is_blob = new_mode not in ("000000", "160000")
+        changed_blobs.append((path.decode("utf-8"), new_sha if is_blob else None))
+    return changed_blobs
+
 def is_exempt_from_token_counting(file):
-    allowed_extensions = {"py", "swift", "json", "md"}
     ext = file.rsplit(".", 1)[-1].lower() if "." in file else ""
-    return ext in allowed_extensions
+    return ext in COUNTABLE_EXTENSIONS
 
-def count_for_branch(limit=None, is_hard_limit=False):
+def get_branch_merge_base(log=print):
+    """
+    Returns (current_branch, merge_base) for the checked out feature branch, exiting if on 'main'.
+    """
     # Get current branch name
     try:
-        current_branch = subprocess.check_output([
-            "git", "rev-parse", "--abbrev-ref", "HEAD"
-        ], encoding="utf-8").strip()
+        current_branch = run_git(["rev-parse", "--abbrev-ref", "HEAD"], encoding="utf-8").strip()
     except Exception as e:
-        print(f"❌\tError getting current branch: {e}")
+        log(f"❌\tError getting current branch: {e}")
         sys.exit(1)
 
     if current_branch == "main":
-        print("❌\tAlready on 'main' branch. Please checkout a feature branch.")
+        log("❌\tAlready on 'main' branch. Please checkout a feature branch.")
         sys.exit(1)
 
+    try:
+        merge_base = run_git(["merge-base", "main", current_branch], encoding="utf-8").strip()
+    except Exception as e:
+        log(f"❌\tError finding merge base with 'main': {e}")
+        sys.exit(1)
+    return current_branch, merge_base
+
+def count_for_branch(limit=None, is_hard_limit=False, jobs=1, cache=None, report=None):
+    report = report or TokenReport(cache=cache)
+    current_branch, merge_base = get_branch_merge_base(log=report.log)
+    report.context["branch"] = current_branch
+
     # Get list of changed files since branch diverged from main
     try:
-        # Find merge-base
-        merge_base = subprocess.check_output([
-            "git", "merge-base", "main", current_branch
-        ], encoding="utf-8").strip()
-        # Get changed files
-        changed_files = subprocess.check_output([
-            "git", "diff", "--name-only", f"{merge_base}..{current_branch}"
-        ], encoding="utf-8").strip().splitlines()
+        changed_files = run_git(
+            ["diff", "--name-only", f"{merge_base}..{current_branch}"], encoding="utf-8"
+        ).strip().splitlines()
         # Remove empty strings to avoid false positives when git diff returns an empty string
         changed_files = [f for f in changed_files if f]
     except Exception as e:
-        print(f"❌\tError getting changed files: {e}")
+        report.log(f"❌\tError getting changed files: {e}")
         sys.exit(1)
 
-    print(f"🔀\tCurrent branch: {current_branch}")
-    print(f"🔄\tChanged files since diverging from 'main':")
+    report.log(f"🔀\tCurrent branch: {current_branch}")
+    report.log(f"🔄\tChanged files since diverging from 'main':")
     if not changed_files:
-        print("  (No files changed)")
+        report.log("  (No files changed)")
         return
 
     exempt_files = []
     missing_files = []
-    files_over_limit = []
+    files_to_count = []
     for f in changed_files:
         if not is_exempt_from_token_counting(f):
             exempt_files.append(f)
         elif os.path.exists(f):
-            count = count_tokens(f)
-            if limit:
-                percent = (count / limit) * 100
-                if percent >= 100:
-                    print(f"\t⚠️\t{f} - {count} token(s) - {percent:.0f}% of limit")
-                    files_over_limit.append(f)
-                else:
-                    print(f"\t✅\t{f} - {count} token(s) - {percent:.0f}% of limit")
-            else:
-                print(f"\t- {f} - {count} token(s)")
+            files_to_count.append(f)
         else:
             missing_files.append(f)
 
+    results = count_tokens_in_files(files_to_count, jobs=jobs, cache=cache)
+
+    report_token_counts(report, zip(files_to_count, results), exempt_files, limit=limit, is_hard_limit=is_hard_limit)
+
+def count_for_revisions(rev_range=None, limit=None, is_hard_limit=False, jobs=1, cache=None, report=None):
+    """
+    Counts tokens in files changed in rev_range (e.g. main..HEAD), or staged in the index when rev_range is None.
+    Contents come straight from the git object store, so no checkout is needed.
+    """
+    report = report or TokenReport(cache=cache)
+    report.context["range"] = rev_range or "--staged"
+    try:
+        changed_blobs = list_changed_blobs(rev_range)
+    except Exception as e:
+        report.log(f"❌\tError getting changed files: {e}")
+        sys.exit(1)
+
+    if rev_range:
+        report.log(f"🔀\tRevision range: {rev_range}")
+    else:
+        report.log("🔀\tStaged changes")
+    report.log(f"🔄\tChanged files:")
+    if not changed_blobs:
+        report.log("  (No files changed)")
+        return
+
+    exempt_files = []
+    blobs_to_count = []
+    for path, blob_sha in changed_blobs:
+        if not is_exempt_from_token_counting(path):
+            exempt_files.append(path)
+        elif blob_sha is not None:
+            blobs_to_count.append((path, blob_sha))
+
+    results = count_tokens_in_blobs([sha for _, sha in blobs_to_count], jobs=jobs, cache=cache)
+    report_token_counts(
+        report,
+        zip([path for path, _ in blobs_to_count], results),
+        exempt_files,
+        limit=limit,
+        is_hard_limit=is_hard_limit,
+    )
+
+def iter_diff_hunks(diff_lines):
+    """
+    Yields (path, hunk_header, added_text, removed_text) for every hunk of a unified diff.
+    Only the current hunk is held in memory, so the diff can be consumed as a stream.
+    """
+    path = None
+    header = None
+    added = []
+    removed = []
+    for line in diff_lines:
+        if line.startswith("diff --git "):
+            if header is not None:
+                yield path, header, "".join(added), "".join(removed)
+            path, header, added, removed = None, None, [], []
+        elif header is None:
+            # File header lines; "+++ /dev/null" marks a deletion, so keep the "---" path then.
+            if line.startswith("--- ") and path is None:
+                path = _diff_header_path(line)
+            elif line.startswith("+++ ") and not line.startswith("+++ /dev/null"):
+                path = _diff_header_path(line)
+            elif line.startswith("@@"):
+                header = line.rstrip("\n")
+        elif line.startswith("@@"):
+            yield path, header, "".join(added), "".join(removed)
+            header, added, removed = line.rstrip("\n"), [], []
+        elif line.startswith("+"):
+            added.append(line[1:])
+        elif line.startswith("-"):
+            removed.append(line[1:])
+    if header is not None:
+        yield path, header, "".join(added), "".join(removed)
+
+def _diff_header_path(line):
+    path = line[4:].rstrip("\n")
+    if path.startswith('"') and path.endswith('"'):
+        path = path[1:-1]
+    # Strip the "a/" or "b/" prefix.
+    return path.split("/", 1)[1] if "/" in path else path
+
+def count_for_diff(rev_range=None, is_staged=False, limit=None, is_hard_limit=False):
+    """
+    Counts tokens only in the added and removed lines of the diff, per file and per hunk.
+    Defaults to the current branch since it diverged from main.
+    """
+    if is_staged:
+        print("🔀\tStaged changes")
+        diff_args = ["--cached"]
+    elif rev_range:
+        print(f"🔀\tRevision range: {rev_range}")
+        diff_args = [rev_range]
+    else:
+        current_branch, merge_base = get_branch_merge_base()
+        print(f"🔀\tCurrent branch: {current_branch}")
+        diff_args = [f"{merge_base}..{current_branch}"]
+    print(f"🔄\tChanged lines:")
+
+    cmd = ["git", "diff", "--no-color", "--no-ext-diff", "--unified=0", *diff_args]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, encoding="utf-8", errors="replace")
+    exempt_files = set()
+    file_counts = []
+    current_path = None
+    current_hunks = []
+    for path, header, added, removed in iter_diff_hunks(proc.stdout):
+        if not is_exempt_from_token_counting(path):
+            exempt_files.add(path)
+            continue
+        if path != current_path:
+            if current_path is not None:
+                file_counts.append(_report_diff_file(current_path, current_hunks, limit))
+            current_path, current_hunks = path, []
+        current_hunks.append((header, count_tokens_in_text(added), count_tokens_in_text(removed)))
+    if current_path is not None:
+        file_counts.append(_report_diff_file(current_path, current_hunks, limit))
+    proc.stdout.close()
+    if proc.wait() != 0:
+        print(f"❌\tError getting diff: git diff exited with {proc.returncode}")
+        sys.exit(1)
+
+    if not file_counts and not exempt_files:
+        print("  (No files changed)")
+        return
+    files_over_limit = [path for path, count in file_counts if limit and count >= limit]
     exempt_files = sorted(exempt_files)
-    missing_files = sorted(missing_files)
     if exempt_files:
         print("\t⚠️\tExempt files: " + ", ".join(exempt_files))
-
     if is_hard_limit and files_over_limit:
         print("❌\tFiles over limit: " + ", ".join(files_over_limit))
         sys.exit(1)
 
-    return
+def _report_diff_file(path, hunks, limit):
+    added = sum(hunk_added for _, hunk_added, _ in hunks)
+    removed = sum(hunk_removed for _, _, hunk_removed in hunks)
+    count = added + removed
+    if limit:
+        percent = (count / limit) * 100
+        emoji = "⚠️" if percent >= 100 else "✅"
+        print(f"\t{emoji}\t{path} - {count} token(s) (+{added}/-{removed}) - {percent:.0f}% of limit")
+    else:
+        print(f"\t- {path} - {count} token(s) (+{added}/-{removed})")
+    for header, hunk_added, hunk_removed in hunks:
+        print(f"\t\t{header} - +{hunk_added}/-{hunk_removed} token(s)")
+    return path, count
+
+def count_for_tree(root, jobs=1, cache=None, json_path=TREE_REPORT_PATH):
+    """
+    Counts tokens in every countable file under root and rolls the totals up by directory.
+    Prints a table sorted by token count and writes the same data as JSON to json_path.
+    """
+    print(f"🌳\tCounting tokens under: {root}")
+    files = list_repo_files(root, COUNTABLE_EXTENSIONS)
+    results = count_tokens_in_files([os.path.join(root, f) for f in files], jobs=jobs, cache=cache, skip_undecodable=True)
+    skipped_files = [f for f, result in zip(files, results) if result is None]
+    counts = [result.tokens for result in results if result is not None]
+    files = [f for f, result in zip(files, results) if result is not None]
+
+    root_parts = [] if os.path.normpath(root) == "." else [os.path.normpath(root).replace(os.sep, "/")]
+    directories = {}
+    for f, count in zip(files, counts):
+        parts = root_parts + f.split("/")[:-1]
+        # Every ancestor directory, from the root itself down to the file's own directory.
+        for depth in range(len(root_parts), len(parts) + 1):
+            directory = "/".join(parts[:depth]) or "."
+            totals = directories.setdefault(directory, {"tokens": 0, "files": 0})
+            totals["tokens"] += count
+            totals["files"] += 1
+
+    rows = sorted(directories.items(), key=lambda item: (-item[1]["tokens"], item[0]))
+    print(f"\t{'Tokens':>10}\t{'Files':>6}\tDirectory")
+    for directory, totals in rows:
+        print(f"\t{totals['tokens']:>10}\t{totals['files']:>6}\t{directory}")
+
+    report = {
+        "root": os.path.abspath(root),
+        "total_tokens": sum(counts),
+        "total_files": len(files),
+        "directories": [{"path": directory, **totals} for directory, totals in rows],
+        "files": [
+            {"path": "/".join(root_parts + [f]), "tokens": count}
+            for f, count in sorted(zip(files, counts), key=lambda item: (-item[1], item[0]))
+        ],
+        "skipped_files": ["/".join(root_parts + [f]) for f in skipped_files],
+    }
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    if skipped_files:
+        print("\t⚠️\tSkipped files that are not valid UTF-8: " + ", ".join(report["skipped_files"]))
+    print(f"🔢\tTotal: {report['total_tokens']} token(s) in {report['total_files']} file(s) (see {json_path})")
+
+class TokenReport:
+    """
+    Writes per-file token counts as text, or as JSON/NDJSON records followed by a summary with phase timings.
+    In the machine-readable formats, human-readable messages go to stderr so stdout stays parseable.
+    """
+
+    def __init__(self, output_format="text", cache=None):
+        self.output_format = output_format
+        self.cache = cache
+        self.start = time.perf_counter()
+        self.context = {}
+        self.records = []
+        self.exempt_files = []
+        self.files_over_limit = []
+        self.is_finished = False
+
+    def log(self, message):
+        print(message, file=sys.stdout if self.output_format == "text" else sys.stderr)
+
+    def add_file(self, path, result, limit=None):
+        count = result.tokens
+        percent = (count / limit) * 100 if limit else None
+        if percent is not None and percent >= 100:
+            self.files_over_limit.append(path)
+        if self.output_format == "text":
+            if percent is None:
+                print(f"\t- {path} - {count} token(s)")
+            elif percent >= 100:
+                print(f"\t⚠️\t{path} - {count} token(s) - {percent:.0f}% of limit")
+            else:
+                print(f"\t✅\t{path} - {count} token(s) - {percent:.0f}% of limit")
+            return
+        record = {"type": "file", "path": path, **result._asdict()}
+        if limit:
+            record["limit_percent"] = round(percent, 1)
+        self.records.append(record)
+        if self.output_format == "ndjson":
+            print(json.dumps(record), flush=True)
+
+    def finish(self):
+        """
+        Writes the summary record; does nothing in text mode or when already finished.
+        """
+        if self.is_finished or self.output_format == "text":
+            return
+        self.is_finished = True
+        elapsed = time.perf_counter() - self.start
+        tokens = sum(record["tokens"] for record in self.records)
+        encoded_tokens = sum(record["tokens"] for record in self.records if not record["is_cached"])
+        encode_seconds = sum(record["encode_seconds"] for record in self.records)
+        summary = {
+            "type": "summary",
+            **self.context,
+            "files": len(self.records),
+            "tokens": tokens,
+            "bytes": sum(record["bytes"] or 0 for record in self.records),
+            "elapsed_seconds": elapsed,
+            "git_seconds": _phase_seconds["git"],
+            "encoder_load_seconds": (
+                sum(record["encoder_load_seconds"] for record in self.records) + _phase_seconds["encoder_load"]
+            ),
+            "read_seconds": sum(record["read_seconds"] for record in self.records),
+            "encode_seconds": encode_seconds,
+            "tokens_per_second": tokens / elapsed if elapsed > 0 else None,
+            "encode_tokens_per_second": encoded_tokens / encode_seconds if encode_seconds > 0 else None,
+            "cache_hits": self.cache.hits if self.cache else None,
+            "cache_misses": self.cache.misses if self.cache else None,
+            "exempt_files": sorted(self.exempt_files),
+            "files_over_limit": self.files_over_limit,
+        }
+        if self.output_format == "ndjson":
+            print(json.dumps(summary), flush=True)
+        else:
+            print(json.dumps({"files": self.records, "summary": summary}, indent=4))
+
+def report_token_counts(report, file_results, exempt_files, limit=None, is_hard_limit=False):
+    for f, result in file_results:
+        report.add_file(f, result, limit=limit)
+
+    exempt_files = sorted(exempt_files)
+    report.exempt_files = exempt_files
+    if exempt_files:
+        report.log("\t⚠️\tExempt files: " + ", ".join(exempt_files))
+
+    if is_hard_limit and report.files_over_limit:
+        # The summary is still useful to dashboards when the check fails.
+        report.finish()
+        report.log("❌\tFiles over limit: " + ", ".join(report.files_over_limit))
+        sys.exit(1)
+
+# Options that take a value, so positional arguments can be told apart from option values.
+OPTIONS_WITH_VALUE = {"--limit", "--range", "--jobs", "--format", "--json"}
+
+def positional_arguments():
+    """
+    Returns the arguments after the sub-command that are neither options nor the values of options.
+    """
+    positionals = []
+    args = iter(sys.argv[2:])
+    for arg in args:
+        if arg in OPTIONS_WITH_VALUE:
+            next(args, None)
+        elif not arg.startswith("--"):
+            positionals.append(arg)
+    return positionals
 
 def pass_optional_argument(arg_name, num_following_args):
     """
@@ -111,6 +827,63 @@ def pass_optional_argument(arg_name, num_following_args):
             return None
     return None
 
+def parse_limit_arguments():
+    """
+    Returns (limit, is_hard_limit) from the --limit and --hard_limit arguments.
+    """
+    limit_arg = pass_optional_argument("--limit", 1)
+    limit = None
+    hard_limit_arg = pass_optional_argument("--hard_limit", 0)
+    if limit_arg is not None:
+        try:
+            limit = int(limit_arg)
+        except Exception:
+            print("❌\tInvalid or missing value for --limit argument.")
+            sys.exit(1)
+    return limit, hard_limit_arg is not None
+
+def parse_jobs_argument(default):
+    jobs_arg = pass_optional_argument("--jobs", 1)
+    if jobs_arg is None:
+        return default
+    try:
+        jobs = int(jobs_arg)
+    except Exception:
+        print("❌\tInvalid or missing value for --jobs argument.")
+        sys.exit(1)
+    if jobs < 1:
+        print("❌\t--jobs must be at least 1.")
+        sys.exit(1)
+    return jobs
+
+def parse_format_argument():
+    output_format = pass_optional_argument("--format", 1) or "text"
+    if output_format not in OUTPUT_FORMATS:
+        print(f"❌\tInvalid value for --format argument: {output_format} (expected one of: {', '.join(OUTPUT_FORMATS)})")
+        sys.exit(1)
+    return output_format
+
+def parse_range_argument():
+    """
+    Returns the --range argument. A single revision would diff against the working tree, whose files have
+    no blob in the object store yet, so only ranges between two revisions are accepted.
+    """
+    rev_range = pass_optional_argument("--range", 1)
+    if rev_range is not None and ".." not in rev_range:
+        print(f"❌\tInvalid value for --range argument: {rev_range} (expected <base>..<head>)")
+        sys.exit(1)
+    return rev_range
+
+def load_cache_unless_disabled():
+    if pass_optional_argument("--no-cache", 0) is not None:
+        return None
+    return TokenCountCache().load()
+
+def _cache_summary_suffix(cache):
+    if cache is None:
+        return ""
+    return f" ({cache.summary()})"
+
 def main():
     if len(sys.argv) < 2:
         print("❌\tMissing sub-command.")
@@ -119,35 +892,94 @@ def main():
 
     sub_command = sys.argv[1]
     start = time.time()
+    positionals = positional_arguments()
     if sub_command == "file":
-        if len(sys.argv) != 3:
+        if not positionals:
             print("❌\tMissing filename argument for 'file' sub-command.")
             print_usage()
             sys.exit(1)
-        filename = sys.argv[2]
+        filename = positionals[0]
+        cache = load_cache_unless_disabled()
+        report = TokenReport(output_format=parse_format_argument(), cache=cache)
         if not os.path.exists(filename):
-            print(f"❌\tFile not found: {filename}")
+            report.log(f"❌\tFile not found: {filename}")
             sys.exit(1)
-        print(f"📄\tCounting tokens in: {filename}")
+        report.log(f"📄\tCounting tokens in: {filename}")
         try:
-            token_count = count_tokens(filename)
+            [result] = count_tokens_in_files([filename], cache=cache)
+            if cache is not None:
+                cache.save()
             elapsed = time.time() - start
-            print(f"🔢\tToken count: {token_count}")
-            print(f"✅\tCompleted in {elapsed:.2f} seconds.")
+            if report.output_format == "text":
+                print(f"🔢\tToken count: {result.tokens}")
+                print(f"✅\tCompleted in {elapsed:.2f} seconds{_cache_summary_suffix(cache)}.")
+            else:
+                report.add_file(filename, result)
+                report.finish()
         except Exception as e:
-            print(f"❌\tError: {e}")
+            report.log(f"❌\tError: {e}")
             sys.exit(1)
     elif sub_command == "branch":
-        limit_arg = pass_optional_argument("--limit", 1)
-        limit = None
-        hard_limit_arg = pass_optional_argument("--hard_limit", 0)
-        if limit_arg is not None:
-            try:
-                limit = int(limit_arg)
-            except Exception:
-                print("❌\tInvalid or missing value for --limit argument.")
-                sys.exit(1)
-        count_for_branch(limit=limit, is_hard_limit=hard_limit_arg is not None)
+        limit, is_hard_limit = parse_limit_arguments()
+        jobs = parse_jobs_argument(default=1)
+        rev_range = parse_range_argument()
+        is_staged = pass_optional_argument("--staged", 0) is not None
+        cache = load_cache_unless_disabled()
+        report = TokenReport(output_format=parse_format_argument(), cache=cache)
+        try:
+            if rev_range is not None or is_staged:
+                count_for_revisions(
+                    rev_range=rev_range,
+                    limit=limit,
+                    is_hard_limit=is_hard_limit,
+                    jobs=jobs,
+                    cache=cache,
+                    report=report,
+                )
+            else:
+                count_for_branch(limit=limit, is_hard_limit=is_hard_limit, jobs=jobs, cache=cache, report=report)
+        finally:
+            # Counts are worth keeping even when the hard limit check exits early.
+            if cache is not None:
+                cache.save()
+        report.finish()
+        elapsed = time.time() - start
+        report.log(f"✅\tCompleted in {elapsed:.2f} seconds{_cache_summary_suffix(cache)}.")
+    elif sub_command == "diff":
+        limit, is_hard_limit = parse_limit_arguments()
+        count_for_diff(
+            rev_range=pass_optional_argument("--range", 1),
+            is_staged=pass_optional_argument("--staged", 0) is not None,
+            limit=limit,
+            is_hard_limit=is_hard_limit,
+        )
+        elapsed = time.time() - start
+        print(f"✅\tCompleted in {elapsed:.2f} seconds.")
+    elif sub_command == "tree":
+        root = positionals[0] if positionals else "."
+        if not os.path.isdir(root):
+            print(f"❌\tDirectory not found: {root}")
+            sys.exit(1)
+        jobs = parse_jobs_argument(default=os.cpu_count() or 1)
+        json_path = pass_optional_argument("--json", 1) or TREE_REPORT_PATH
+        cache = load_cache_unless_disabled()
+        try:
+            count_for_tree(root, jobs=jobs, cache=cache, json_path=json_path)
+        finally:
+            if cache is not None:
+                cache.save()
+        elapsed = time.time() - start
+        print(f"✅\tCompleted in {elapsed:.2f} seconds{_cache_summary_suffix(cache)}.")
+    elif sub_command == "bench":
+        if not positionals:
+            print("❌\tMissing filename argument for 'bench' sub-command.")
+            print_usage()
+            sys.exit(1)
+        filename = positionals[0]
+        if not os.path.exists(filename):
+            print(f"❌\tFile not found: {filename}")
+            sys.exit(1)
+        benchmark_streaming(filename)
         elapsed = time.time() - start
         print(f"✅\tCompleted in {elapsed:.2f} seconds.")
     else:
@@ -0,0 +1,68 @@
+"""
+Cheap fingerprints of input files and tools, shared by the scripts that skip work whose inputs are unchanged.
+"""
+import hashlib
+import os
+import shutil
+
+from repo_files import EXCLUDE_DIRS
+
+# Extensions of the sources and resources that Tuist picks up from the Sources/, Resources/, Tests/ and Fixtures/
+# globs and that Xcode builds. Anything else (.DS_Store, editor swap and backup files, notes) affects neither.
+PROJECT_FILE_EXTENSIONS = frozenset({
+    'swift', 'h', 'm', 'mm', 'c', 'cpp', 'metal',
+    'json', 'png', 'jpg', 'jpeg', 'pdf', 'svg', 'heic', 'gif', 'ttf', 'otf',
+    'plist', 'strings', 'stringsdict', 'xcstrings', 'storyboard', 'xib',
+    'xctestplan', 'resolved', 'entitlements', 'xcprivacy',
+})
+READ_CHUNK_BYTES = 1024 * 1024
+
+
+def has_project_file_extension(path):
+    name = os.path.basename(path)
+    return '.' in name and name.rsplit('.', 1)[-1].lower() in PROJECT_FILE_EXTENSIONS
+
+
+def hash_file(path):
+    """
+    Returns the SHA-256 of the file's content, or 'missing' when it does not exist.
+    """
+    sha = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            while chunk := f.read(READ_CHUNK_BYTES):
+                sha.update(chunk)
+    except FileNotFoundError:
+        return 'missing'
+    return sha.hexdigest()
+
+
+def hash_files(*paths, exclude_dirs=EXCLUDE_DIRS):
+    """
+    Returns {path: content hash} for the given files and for the files under the given directories,
+    leaving out excluded directories such as build products.
+    """
+    hashes = {}
+    for path in paths:
+        if os.path.isdir(path):
+            for dir_path, dir_names, file_names in os.walk(path):
+                dir_names[:] = sorted(name for name in dir_names if name not in exclude_dirs)
+                for file_name in sorted(file_names):
+                    file_path = os.path.join(dir_path, file_name)
+                    hashes[file_path] = hash_file(file_path)
+        else:
+            hashes[path] = hash_file(path)
+    return hashes
+
+
+def executable_fingerprint(name):
+    """
+    Identifies the executable found on PATH by its resolved path, size and modification time,
+    which change when the tool is upgraded, without running it. Returns 'missing' when it is not on PATH.
+    """
+    path = shutil.which(name)
+    if path is None:
+        return 'missing'
+    real_path = os.path.realpath(path)
+    stat = os.stat(real_path)
+    return f'{real_path}:{stat.st_size}:{stat.st_mtime_ns}'
@@ -1,28 +1,49 @@
 #!/usr/bin/env python3
 """
 Script to find and format all Swift files in the repository using swift-format.
+Only files that changed since they were last formatted are passed to swift-format.
 Run with: ./format.py
+Usage:
+  ./format.py          # formats Swift files changed since the last successful run
+  ./format.py --all    # formats every Swift file, ignoring the manifest
+  ./format.py --watch  # keeps running and formats Swift files as they are saved
+  ./format.py --check  # prints a diff of unformatted Swift files and fails, without writing to disk
 """
+import argparse
+import difflib
+import hashlib
+import heapq
+import json
 import os
-import subprocess
+import select
+import struct
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-EXCLUDE_DIRS = ['build', '.build']
+from repo_files import EXCLUDE_DIRS, list_repo_files
+from steps import run_command, start_trace, traced_step
+
 SWIFT_FORMAT_CMD = 'swift-format'
+SWIFT_FORMAT_CONFIG = '.swift-format'
 LINT_ARGS = ['format', '--in-place']
+CHECK_ARGS = ['format']
+# Content hashes of files as swift-format last left them, with the config and formatter they were formatted with.
+MANIFEST_PATH = '.format_manifest.json'
+MANIFEST_VERSION = 1
+# Used when the system does not report ARG_MAX.
+FALLBACK_ARG_MAX = 256 * 1024
+WATCH_DIRS = ['Apps', 'Libs']
+# Saves closer together than this are formatted as one batch.
+WATCH_DEBOUNCE_SECONDS = 0.2
+WATCH_POLL_SECONDS = 0.5
 
+@traced_step
 def find_swift_files_step(root_dir):
     import time
     print('🔍\tFinding Swift files...')
     start = time.time()
-    swift_files = []
-    for dirpath, dirnames, filenames in os.walk(root_dir):
-        if any(excluded in Path(dirpath).parts for excluded in EXCLUDE_DIRS):
-            continue
-        for filename in filenames:
-            if filename.endswith('.swift'):
-                file_path = Path(dirpath) / filename
-                swift_files.append(str(file_path.relative_to(root_dir)))
+    swift_files = list_repo_files(root_dir, ['swift'])
     elapsed = time.time() - start
     if swift_files:
         print(f'\t✅\tFound {len(swift_files)} Swift files (took {elapsed:.2f} seconds)')
@@ -32,34 +53,426 @@ def find_swift_files_step(root_dir):
 
 
 
-def format_files_step(swift_files):
+def _file_sha(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+
+def _file_entry(path):
+    stat = os.stat(path)
+    return {'sha': _file_sha(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+
+@traced_step
+def formatter_fingerprint_step(root_dir):
+    """
+    Returns what, besides file contents, decides formatting output: the config and the formatter version.
+    """
+    config_path = Path(root_dir) / SWIFT_FORMAT_CONFIG
+    config_sha = _file_sha(config_path) if config_path.exists() else None
+    result = run_command([SWIFT_FORMAT_CMD, '--version'], capture=True)
+    formatter_version = result.stdout.decode('utf-8', 'replace').strip() if result.returncode == 0 else None
+    return {'config_sha': config_sha, 'formatter_version': formatter_version}
+
+
+
+def load_manifest(root_dir, fingerprint):
+    """
+    Returns the manifest's file entries, or an empty dict if it is missing or was written for another
+    config or formatter version.
+    """
+    try:
+        with open(Path(root_dir) / MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION or manifest.get('fingerprint') != fingerprint:
+        print('\t⚠️\tFormatter config or version changed, formatting all files')
+        return {}
+    return manifest.get('files', {})
+
+
+
+def save_manifest(root_dir, fingerprint, files):
+    manifest_path = Path(root_dir) / MANIFEST_PATH
+    tmp_path = manifest_path.with_name(manifest_path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': MANIFEST_VERSION, 'fingerprint': fingerprint, 'files': files}, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+
+@traced_step
+def select_changed_files_step(root_dir, swift_files, manifest_files):
+    """
+    Returns the files whose content differs from when they were last formatted.
+    Files with unchanged size and modification time are trusted without hashing.
+    """
+    import time
+    print('🔎\tSelecting files changed since last format...')
+    start = time.time()
+    changed_files = []
+    for file in swift_files:
+        entry = manifest_files.get(file)
+        if entry is None:
+            changed_files.append(file)
+            continue
+        stat = os.stat(Path(root_dir) / file)
+        if stat.st_size == entry['size'] and stat.st_mtime_ns == entry['mtime_ns']:
+            continue
+        if stat.st_size != entry['size'] or _file_sha(Path(root_dir) / file) != entry['sha']:
+            changed_files.append(file)
+        else:
+            # Touched but not modified; remember the new mtime to skip hashing next time.
+            entry['mtime_ns'] = stat.st_mtime_ns
+    elapsed = time.time() - start
+    print(f'\t✅\t{len(changed_files)} of {len(swift_files)} files changed (took {elapsed:.2f} seconds)')
+    return changed_files
+
+
+
+def _max_shard_args_bytes():
+    """
+    Returns how many bytes of file arguments one swift-format invocation may take.
+    The environment shares ARG_MAX with the arguments, and half of the rest is kept as headroom.
+    """
+    try:
+        arg_max = os.sysconf('SC_ARG_MAX')
+    except (AttributeError, ValueError, OSError):
+        arg_max = FALLBACK_ARG_MAX
+    if arg_max <= 0:
+        arg_max = FALLBACK_ARG_MAX
+    env_bytes = sum(len(key) + len(value) + 2 for key, value in os.environ.items())
+    return max(4096, (arg_max - env_bytes) // 2)
+
+
+
+def plan_shards(root_dir, swift_files, jobs, max_args_bytes=None):
+    """
+    Splits swift_files (relative to root_dir) into at least `jobs` shards of similar total file size,
+    each small enough for one argv. Files keep their original relative order within a shard.
+    """
+    if max_args_bytes is None:
+        max_args_bytes = _max_shard_args_bytes()
+    sizes = {file: os.path.getsize(Path(root_dir) / file) for file in swift_files}
+    num_shards = max(1, min(jobs, len(swift_files)))
+    while True:
+        # Largest files first onto the currently lightest shard.
+        heap = [(0, i) for i in range(num_shards)]
+        shards = [[] for _ in range(num_shards)]
+        args_bytes = [0] * num_shards
+        for file in sorted(swift_files, key=lambda f: -sizes[f]):
+            total, i = heapq.heappop(heap)
+            shards[i].append(file)
+            args_bytes[i] += len(os.fsencode(file)) + 1
+            heapq.heappush(heap, (total + sizes[file], i))
+        if max(args_bytes) <= max_args_bytes or num_shards >= len(swift_files):
+            break
+        num_shards += max(1, num_shards // 2)
+    order = {file: index for index, file in enumerate(swift_files)}
+    return [sorted(shard, key=order.get) for shard in shards if shard]
+
+
+
+def _format_shard(root_dir, shard):
+    cmd = [SWIFT_FORMAT_CMD] + LINT_ARGS + shard
+    return run_command(cmd, name=f'swift-format ({len(shard)} files)', cwd=root_dir, capture=True)
+
+
+
+@traced_step
+def format_files_step(root_dir, swift_files, jobs=None):
+    """
+    Formats swift_files (relative to root_dir) in place with up to `jobs` concurrent swift-format processes
+    and returns the files of shards that failed.
+    """
     import time
     if not swift_files:
         print('⚠️\tNo Swift files to format.')
-        return
-    cmd = [SWIFT_FORMAT_CMD] + LINT_ARGS
-    mock_command = ' '.join(cmd)
-    mock_command = f'{mock_command} <{len(swift_files)} eligible files>'
-    cmd += swift_files
+        return []
+    jobs = jobs or os.cpu_count() or 1
+    shards = plan_shards(root_dir, swift_files, jobs)
+    mock_command = ' '.join([SWIFT_FORMAT_CMD] + LINT_ARGS)
+    mock_command = f'{mock_command} <{len(swift_files)} eligible files in {len(shards)} shard(s), {jobs} at a time>'
     print('🧹\tFormatting Swift files...')
     print(f'🧹\tRunning: {mock_command}')
     start = time.time()
-    result = subprocess.run(cmd, cwd=os.getcwd())
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(lambda shard: _format_shard(root_dir, shard), shards))
     elapsed = time.time() - start
+    failed_files = []
+    # Output is printed per shard, in shard order, so it never interleaves.
+    for index, (shard, result) in enumerate(zip(shards, results)):
+        if result.stdout:
+            print(result.stdout.decode('utf-8', 'replace'), end='')
+        if result.stderr:
+            print(result.stderr.decode('utf-8', 'replace'), end='')
+        if result.returncode != 0:
+            print(f'\t❌\tShard {index + 1}/{len(shards)} failed with exit code {result.returncode} ({len(shard)} files)')
+            failed_files.extend(shard)
+    cpu_seconds = sum(result.user_seconds + result.system_seconds for result in results)
+    if failed_files:
+        print(f'\t❌\tFormatting failed (took {elapsed:.2f} seconds, cpu {cpu_seconds:.2f}s)')
+    else:
+        print(f'\t✅\tFormatting completed successfully (took {elapsed:.2f} seconds, cpu {cpu_seconds:.2f}s)')
+    return failed_files
+
+
+
+def _check_file(root_dir, file):
+    """
+    Formats file through swift-format's stdin/stdout and returns (file, unified diff or None, error or None).
+    """
+    original = (Path(root_dir) / file).read_bytes()
+    # --assume-filename lets swift-format find the .swift-format config that applies to the file.
+    cmd = [SWIFT_FORMAT_CMD] + CHECK_ARGS + ['--assume-filename', file]
+    result = run_command(cmd, name=f'swift-format {file}', cwd=root_dir, input=original, capture=True)
     if result.returncode != 0:
-        print(f'\t❌\tFormatting failed (took {elapsed:.2f} seconds)')
+        return file, None, result.stderr.decode('utf-8', 'replace') or f'exit code {result.returncode}'
+    if result.stdout == original:
+        return file, None, None
+    diff = difflib.unified_diff(
+        original.decode('utf-8', 'replace').splitlines(keepends=True),
+        result.stdout.decode('utf-8', 'replace').splitlines(keepends=True),
+        fromfile=f'a/{file}',
+        tofile=f'b/{file}',
+    )
+    return file, ''.join(diff), None
+
+
+
+@traced_step
+def check_files_step(root_dir, swift_files, jobs=None):
+    """
+    Checks that swift_files are formatted, with up to `jobs` concurrent swift-format processes,
+    printing a unified diff for each file that is not. Nothing is written to disk.
+    Returns the files that are not formatted or could not be checked.
+    """
+    import time
+    jobs = jobs or os.cpu_count() or 1
+    print(f'🔎\tChecking formatting of {len(swift_files)} Swift files, {jobs} at a time...')
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(lambda file: _check_file(root_dir, file), swift_files))
+    elapsed = time.time() - start
+    offending_files = []
+    for file, diff, error in results:
+        if error is not None:
+            print(f'\t❌\tCould not check {file}: {error.strip()}')
+            offending_files.append(file)
+        elif diff is not None:
+            print(diff, end='' if diff.endswith('\n') else '\n')
+            offending_files.append(file)
+    if offending_files:
+        print(f'\t❌\t{len(offending_files)} of {len(swift_files)} Swift files are not formatted, run ./format.py (took {elapsed:.2f} seconds)')
     else:
-        print(f'\t✅\tFormatting completed successfully (took {elapsed:.2f} seconds)')
+        print(f'\t✅\tAll {len(swift_files)} Swift files are formatted (took {elapsed:.2f} seconds)')
+    return offending_files
+
+
+
+def record_formatted_files(root_dir, manifest_files, formatted_files, failed_files=()):
+    """
+    Updates manifest_files with the contents swift-format left in formatted_files, so later runs skip them.
+    """
+    failed_files = set(failed_files)
+    for file in formatted_files:
+        if file in failed_files:
+            manifest_files.pop(file, None)
+        elif (Path(root_dir) / file).exists():
+            manifest_files[file] = _file_entry(Path(root_dir) / file)
+
+
+
+class _InotifyWatcher:
+    """
+    Reports changed files under the watched directories using Linux inotify, watching new directories as they appear.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 0o2000000
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, root_dir, watch_dirs):
+        import ctypes
+        self.root_dir = Path(root_dir)
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.dirs_by_watch = {}
+        for watch_dir in watch_dirs:
+            self._watch_tree(self.root_dir / watch_dir)
+
+    def _watch_tree(self, directory):
+        for dirpath, dirnames, _ in os.walk(directory):
+            dirnames[:] = [d for d in dirnames if d not in EXCLUDE_DIRS]
+            mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+            watch = self.libc.inotify_add_watch(self.fd, os.fsencode(dirpath), mask)
+            if watch >= 0:
+                self.dirs_by_watch[watch] = Path(dirpath)
+
+    def read_changes(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        buffer = os.read(self.fd, 64 * 1024)
+        changes = set()
+        offset = 0
+        while offset < len(buffer):
+            watch, mask, _, name_length = self.EVENT_HEADER.unpack_from(buffer, offset)
+            offset += self.EVENT_HEADER.size
+            name = buffer[offset:offset + name_length].rstrip(b'\0').decode('utf-8', 'replace')
+            offset += name_length
+            directory = self.dirs_by_watch.get(watch)
+            if directory is None or not name:
+                continue
+            path = directory / name
+            if mask & self.IN_ISDIR:
+                if name not in EXCLUDE_DIRS:
+                    self._watch_tree(path)
+            elif mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO):
+                changes.add(str(path.relative_to(self.root_dir)))
+        return changes
+
+
+
+class _PollingWatcher:
+    """
+    Reports changed files by comparing the size and modification time of the Swift files every few hundred milliseconds.
+    """
+
+    def __init__(self, root_dir, watch_dirs):
+        self.root_dir = Path(root_dir)
+        self.watch_dirs = watch_dirs
+        self.snapshot = self._take_snapshot()
+
+    def _take_snapshot(self):
+        snapshot = {}
+        for watch_dir in self.watch_dirs:
+            for file in list_repo_files(self.root_dir / watch_dir, ['swift']):
+                path = f'{watch_dir}/{file}'
+                try:
+                    stat = os.stat(self.root_dir / path)
+                except FileNotFoundError:
+                    continue
+                snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def read_changes(self, timeout):
+        import time
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self._take_snapshot()
+            changes = {path for path, state in snapshot.items() if self.snapshot.get(path) != state}
+            self.snapshot = snapshot
+            if changes:
+                return changes
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            remaining = WATCH_POLL_SECONDS if deadline is None else max(0.0, deadline - time.monotonic())
+            time.sleep(min(WATCH_POLL_SECONDS, remaining))
+
+
+
+def _make_watcher(root_dir, watch_dirs):
+    if sys.platform.startswith('linux'):
+        try:
+            return _InotifyWatcher(root_dir, watch_dirs)
+        except (OSError, AttributeError) as e:
+            print(f'\t⚠️\tinotify unavailable ({e}), polling for changes instead')
+    return _PollingWatcher(root_dir, watch_dirs)
+
+
+
+def watch_step(root_dir, jobs):
+    """
+    Formats Swift files under WATCH_DIRS as they are saved, until interrupted.
+    Bursts of saves are debounced into one swift-format run over just those files, and the formatter's
+    own writes are ignored because their content already matches the manifest.
+    """
+    import time
+    fingerprint = formatter_fingerprint_step(root_dir)
+    manifest_files = load_manifest(root_dir, fingerprint)
+    watch_dirs = [d for d in WATCH_DIRS if (Path(root_dir) / d).is_dir()]
+    watcher = _make_watcher(root_dir, watch_dirs)
+    print(f'👀\tWatching {", ".join(watch_dirs)} for Swift changes ({type(watcher).__name__.strip("_")}), press Ctrl+C to stop')
+    try:
+        while True:
+            changes = watcher.read_changes(timeout=None)
+            while more_changes := watcher.read_changes(timeout=WATCH_DEBOUNCE_SECONDS):
+                changes |= more_changes
+            candidates = [
+                file for file in sorted(changes)
+                if file.endswith('.swift') and (Path(root_dir) / file).is_file()
+            ]
+            start = time.time()
+            files_to_format = [
+                file for file in candidates
+                if file not in manifest_files
+                or _file_sha(Path(root_dir) / file) != manifest_files[file]['sha']
+            ]
+            if not files_to_format:
+                continue
+            failed_files = format_files_step(root_dir, files_to_format, jobs=jobs)
+            record_formatted_files(root_dir, manifest_files, files_to_format, failed_files)
+            save_manifest(root_dir, fingerprint, manifest_files)
+            elapsed = time.time() - start
+            print(f'⚡\tFormatted {", ".join(files_to_format)} (took {elapsed * 1000:.0f} ms)')
+    except KeyboardInterrupt:
+        print('👋\tStopped watching.')
 
 
 
 def main():
     import time
+    parser = argparse.ArgumentParser(description='Format Swift files with swift-format.')
+    parser.add_argument('--all', action='store_true', help='Format every Swift file, ignoring the manifest of already formatted files.')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='Maximum number of concurrent swift-format processes (default: CPU count).')
+    parser.add_argument('--watch', action='store_true', help=f'Keep running and format Swift files under {" and ".join(WATCH_DIRS)} as they are saved.')
+    parser.add_argument('--check', action='store_true', help='Print a diff of every Swift file that is not formatted and exit non-zero, without modifying any file.')
+    args = parser.parse_args()
+
+    repo_root = Path(__file__).parent
+    if args.watch:
+        watch_step(repo_root, jobs=max(1, args.jobs))
+        return
+    start_trace('format_check' if args.check else 'format')
+    if args.check:
+        start = time.time()
+        swift_files = find_swift_files_step(repo_root)
+        if check_files_step(repo_root, swift_files, jobs=max(1, args.jobs)):
+            exit(1)
+        elapsed = time.time() - start
+        print(f'🎉\tAll steps completed! (total time: {elapsed:.2f} seconds)')
+        return
+
     print('🔧\tStarting Swift formatting process...')
     start = time.time()
-    repo_root = Path(__file__).parent
     swift_files = find_swift_files_step(repo_root)
-    format_files_step(swift_files)
+    fingerprint = formatter_fingerprint_step(repo_root)
+    manifest_files = {} if args.all else load_manifest(repo_root, fingerprint)
+    files_to_format = select_changed_files_step(repo_root, swift_files, manifest_files)
+    if files_to_format or not swift_files:
+        failed_files = format_files_step(repo_root, files_to_format, jobs=max(1, args.jobs))
+    else:
+        print('✅\tAll Swift files are already formatted.')
+        failed_files = []
+    swift_file_set = set(swift_files)
+    manifest_files = {file: entry for file, entry in manifest_files.items() if file in swift_file_set}
+    record_formatted_files(repo_root, manifest_files, files_to_format, failed_files)
+    save_manifest(repo_root, fingerprint, manifest_files)
+    if failed_files:
+        exit(1)
     elapsed = time.time() - start
     print(f'🎉\tAll steps completed! (total time: {elapsed:.2f} seconds)')
 
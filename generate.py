@@ -1,37 +1,112 @@
 #!/usr/bin/env python3
 """
 Script to generate the Xcode project using Tuist.
+Generation is skipped when the workspace exists and the project fingerprint (manifests, tuist and the
+paths of the sources and resources under Apps/ and Libs/) matches the one recorded after the last generation.
+Other scripts call ensure_project_generated() as a cheap precondition.
 Run with: ./generate.py
+Usage:
+  ./generate.py             # generates the project if needed and opens Xcode
+  ./generate.py --no-xcode  # generates the project if needed without opening Xcode
+  ./generate.py --force     # generates the project even when nothing changed
 """
 import argparse
+import hashlib
+import json
 import os
 import subprocess
 import time
 from pathlib import Path
 
-def tuist_generate_step(no_xcode=False):
-    print('⚡\tGenerate project with Tuist')
+from fingerprints import executable_fingerprint, has_project_file_extension, hash_file
+from repo_files import EXCLUDE_DIRS
+from steps import echo, run_step, start_trace, traced
+
+WORKSPACE_PATH = 'RickAndMorty.xcworkspace'
+FINGERPRINT_PATH = '.generate_fingerprint.json'
+MANIFEST_FILES = ['Tuist.swift', 'Workspace.swift']
+MANIFEST_DIRS = ['Tuist']
+PROJECT_ROOTS = ['Apps', 'Libs']
+PROJECT_MANIFEST_NAME = 'Project.swift'
+# Tuist writes these next to the manifests; they are outputs of generation, not inputs.
+GENERATED_DIR_SUFFIXES = ('.xcodeproj', '.xcworkspace')
+
+def _is_generated_or_excluded(dir_name):
+    return dir_name in EXCLUDE_DIRS or dir_name.endswith(GENERATED_DIR_SUFFIXES)
+
+def _walk(root):
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names[:] = sorted(name for name in dir_names if not _is_generated_or_excluded(name))
+        for file_name in sorted(file_names):
+            yield os.path.join(dir_path, file_name)
+
+def project_fingerprint():
+    """
+    Returns a hash of the Tuist manifests, the tuist executable and the set of source and resource paths under
+    Apps/ and Libs/. Only the manifests are read: sources are picked up by globs, so adding or removing a file
+    changes the generated project while editing one does not.
+    """
+    digest = hashlib.sha256()
+    digest.update(f'tuist:{executable_fingerprint("tuist")}\n'.encode())
+    manifest_paths = MANIFEST_FILES + [
+        path for manifest_dir in MANIFEST_DIRS for path in _walk(manifest_dir) if has_project_file_extension(path)
+    ]
+    for path in manifest_paths:
+        digest.update(f'{path}:{hash_file(path)}\n'.encode())
+    for project_root in PROJECT_ROOTS:
+        for path in _walk(project_root):
+            if os.path.basename(path) == PROJECT_MANIFEST_NAME:
+                digest.update(f'{path}:{hash_file(path)}\n'.encode())
+            elif has_project_file_extension(path):
+                digest.update(f'{path}\n'.encode())
+    return digest.hexdigest()
+
+def _recorded_fingerprint():
+    try:
+        with open(FINGERPRINT_PATH) as f:
+            return json.load(f).get('fingerprint')
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def _record_fingerprint(fingerprint):
+    with open(FINGERPRINT_PATH, 'w') as f:
+        json.dump({'fingerprint': fingerprint, 'generated_at': time.time()}, f, indent=2)
+
+def tuist_generate_step(no_xcode=False, prefix=None):
     cmd = ['tuist', 'generate']
     if no_xcode:
         cmd.append('--no-open')
-    print('⚡\tRunning:', ' '.join(cmd))
+    run_step(name='Generate project with Tuist', emoji='⚡', cmd=cmd, prefix=prefix)
+
+def ensure_project_generated(force=False, no_xcode=True, prefix=None):
+    """
+    Runs tuist generate unless the workspace exists and the project fingerprint is unchanged.
+    tuist's output is printed after prefix, if given, to tell it apart from steps running alongside.
+    Returns True when the project was generated.
+    """
     start = time.time()
-    result = subprocess.run(cmd, cwd=os.getcwd())
-    elapsed = time.time() - start
-    if result.returncode != 0:
-        print(f'\t❌\tStep failed: Tuist generate')
-        exit(result.returncode)
-    else:
-        print(f'\t✅\tStep completed: Tuist generate (took {elapsed:.2f} seconds)')
+    with traced('project_fingerprint'):
+        fingerprint = project_fingerprint()
+    if not force and Path(WORKSPACE_PATH).is_dir() and _recorded_fingerprint() == fingerprint:
+        elapsed = time.time() - start
+        echo(f'\t⏭️\tSkipped: Tuist generate (manifests and file list unchanged, checked in {elapsed:.2f} seconds)')
+        return False
+    tuist_generate_step(no_xcode=no_xcode, prefix=prefix)
+    _record_fingerprint(fingerprint)
+    return True
 
 def main():
     parser = argparse.ArgumentParser(description='Generate Xcode project using Tuist.')
     parser.add_argument('--no-xcode', action='store_true', help='Do not launch Xcode after generating the project.')
+    parser.add_argument('--force', action='store_true', help='Generate even when the manifests and file list are unchanged.')
     args = parser.parse_args()
 
+    start_trace('generate')
     print('🔧\tStarting project generation process...')
     start = time.time()
-    tuist_generate_step(no_xcode=args.no_xcode)
+    generated = ensure_project_generated(force=args.force, no_xcode=args.no_xcode)
+    if not generated and not args.no_xcode:
+        subprocess.run(['open', WORKSPACE_PATH], cwd=os.getcwd())
     elapsed = time.time() - start
     print(f'🎉\tAll steps completed successfully! (total time: {elapsed:.2f} seconds)')
 
@@ -1,63 +1,216 @@
 #!/usr/bin/env python3
 """
 Script to set up the development environment by installing dependencies with Homebrew and Tuist.
+Steps that don't depend on each other run in parallel as a step graph (see steps.py), and a step is skipped
+when the hash of its inputs matches the stamp it left in .install_stamps/ after its last successful run.
 Run with: ./install.py
+Usage:
+  ./install.py          # runs only the steps whose inputs changed
+  ./install.py --force  # runs every step again
 """
+import argparse
+import hashlib
+import json
 import os
-import subprocess
+import re
+import shutil
+import time
 from pathlib import Path
 
-def _run_install_step(*, name, emoji, cmd):
-    import time
-    print(f"{emoji}\t{name}")
-    print(f"{emoji}\tRunning: {' '.join(cmd)}")
-    start = time.time()
-    result = subprocess.run(cmd, cwd=os.getcwd())
-    elapsed = time.time() - start
+from fingerprints import executable_fingerprint, hash_files
+from steps import Step, StepFailed, echo, run_command, run_step_graph, start_trace
+
+STAMPS_DIR = Path('.install_stamps')
+VENV_PYTHON = Path('.venv/bin/python')
+VENV_SITE_PACKAGES_GLOB = '.venv/lib/python*/site-packages'
+REQUIREMENT_NAME_PATTERN = re.compile(r'[A-Za-z0-9][A-Za-z0-9._-]*')
+TUIST_VERSION_PATTERN = re.compile(r'cask "tuist", version: "([^"]+)"')
+
+class InstallStep:
+    def __init__(self, *, key, name, emoji, cmd, inputs, missing_outputs, deps=()):
+        self.key = key
+        self.name = name
+        self.emoji = emoji
+        self.cmd = cmd
+        # inputs() returns {label: fingerprint} and missing_outputs() the outputs that are not there, both cheaply.
+        self.inputs = inputs
+        self.missing_outputs = missing_outputs
+        self.deps = deps
+
+    @property
+    def stamp_path(self):
+        return STAMPS_DIR / f'{self.key}.json'
+
+def _tuist_version():
+    with open('Brewfile') as f:
+        match = TUIST_VERSION_PATTERN.search(f.read())
+    return match.group(1) if match else 'unpinned'
+
+def _missing_commands(*names):
+    return [name for name in names if shutil.which(name) is None]
+
+def _missing_paths(*paths):
+    return [str(path) for path in paths if not Path(path).exists()]
+
+def _normalized_distribution_name(name):
+    return re.sub(r'[-_.]+', '_', name).lower()
+
+def _requirement_names(path):
+    names = []
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            match = REQUIREMENT_NAME_PATTERN.match(line) if line and not line.startswith('-') else None
+            if match:
+                names.append(_normalized_distribution_name(match.group()))
+    return names
+
+def _missing_requirements(path):
+    """
+    Returns the requirements in path that have no .dist-info in the venv's site-packages,
+    e.g. because the venv was deleted and created again.
+    """
+    if not VENV_PYTHON.exists():
+        return [str(VENV_PYTHON)]
+    installed = {
+        _normalized_distribution_name(dist_info.name.split('-', 1)[0])
+        for site_packages in Path('.').glob(VENV_SITE_PACKAGES_GLOB)
+        for dist_info in site_packages.glob('*.dist-info')
+    }
+    return [name for name in _requirement_names(path) if name not in installed]
+
+STEPS = [
+    InstallStep(
+        key='brew_bundle',
+        name='Install dependencies with Homebrew',
+        emoji='🍺',
+        cmd=['brew', 'bundle'],
+        inputs=lambda: hash_files('Brewfile', 'Brewfile.lock.json'),
+        missing_outputs=lambda: _missing_commands('git-lfs', 'tuist', 'swift-format'),
+    ),
+    InstallStep(
+        key='create_venv',
+        name='Create Python virtual environment',
+        emoji='🧪',
+        cmd=['python3', '-m', 'venv', '.venv'],
+        inputs=lambda: {'python3': executable_fingerprint('python3')},
+        missing_outputs=lambda: _missing_paths(VENV_PYTHON),
+    ),
+    InstallStep(
+        key='pip_install_requirements',
+        name='Activate venv and install Python dependencies',
+        emoji='🐍',
+        cmd=[str(VENV_PYTHON), '-m', 'pip', 'install', '-r', 'requirements.txt'],
+        inputs=lambda: hash_files('requirements.txt', '.venv/pyvenv.cfg'),
+        missing_outputs=lambda: _missing_requirements('requirements.txt'),
+        deps=('create_venv',),
+    ),
+    InstallStep(
+        key='tuist_install',
+        name='Install Tuist',
+        emoji='🚀',
+        cmd=['tuist', 'install'],
+        inputs=lambda: {'tuist': _tuist_version(), **hash_files('Tuist.swift', 'Tuist')},
+        missing_outputs=lambda: _missing_paths('Tuist/.build'),
+        deps=('brew_bundle',),
+    ),
+]
+
+def _read_stamp(step):
+    try:
+        with open(step.stamp_path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def _write_stamp(step, inputs, input_hash):
+    STAMPS_DIR.mkdir(exist_ok=True)
+    stamp = {'hash': input_hash, 'inputs': inputs, 'completed_at': time.time()}
+    with open(step.stamp_path, 'w') as f:
+        json.dump(stamp, f, indent=2)
+    return stamp
+
+def _run_reason(step, stamp, inputs, input_hash, force):
+    """
+    Returns why the step has to run, or None when its stamp is up to date.
+    """
+    if force:
+        return '--force'
+    if stamp is None:
+        return 'no stamp from a previous run'
+    if stamp.get('hash') != input_hash:
+        previous = stamp.get('inputs', {})
+        changed = sorted(label for label in inputs.keys() | previous.keys() if inputs.get(label) != previous.get(label))
+        if changed:
+            return f"inputs changed: {', '.join(changed)}"
+        return 'a step it depends on changed or ran again'
+    missing = step.missing_outputs()
+    if missing:
+        return f"outputs missing: {', '.join(missing)}"
+    return None
+
+def _input_hash(step, inputs, dep_states):
+    """
+    Returns the hash of the step's inputs and of the states of the steps it depends on,
+    so a change upstream, or an upstream step running again, re-runs it too.
+    """
+    digest = hashlib.sha256(json.dumps(inputs, sort_keys=True).encode())
+    for dep in step.deps:
+        digest.update(dep_states[dep].encode())
+    return digest.hexdigest()
+
+def _state(stamp):
+    """
+    Identifies a step's last successful run by its input hash and completion time. It stays the same while
+    the step is skipped and changes whenever the step runs, even when its inputs are unchanged
+    (e.g. create_venv after .venv was deleted), so the steps depending on it run again.
+    """
+    return f"{stamp['hash']}@{stamp['completed_at']}"
+
+def run_step_if_needed(step, dep_states, force):
+    """
+    Runs the step unless its stamp matches its inputs, and returns its state (see _state()).
+    """
+    inputs = step.inputs()
+    input_hash = _input_hash(step, inputs, dep_states)
+    stamp = _read_stamp(step)
+    reason = _run_reason(step, stamp, inputs, input_hash, force)
+    if reason is None:
+        completed_at = time.strftime('%Y-%m-%d %H:%M', time.localtime(stamp['completed_at']))
+        echo(f'\t⏭️\tSkipped: {step.name} (inputs unchanged since {completed_at})')
+        return _state(stamp)
+    echo(f'{step.emoji}\t{step.name} ({reason})')
+    echo(f'{step.emoji}\tRunning: {" ".join(step.cmd)}')
+    # Steps run concurrently, so their output is prefixed with the step's emoji.
+    result = run_command(step.cmd, name=step.name, prefix=f'{step.emoji}\t')
     if result.returncode != 0:
-        print(f"\t❌\tStep failed: {name}")
-        exit(result.returncode)
-    else:
-        print(f"\t✅\tStep completed: {name} (took {elapsed:.2f} seconds)")
-
-def brew_bundle_step():
-    _run_install_step(name='Install dependencies with Homebrew', emoji='🍺', cmd=['brew', 'bundle'])
-
-def create_venv_step():
-    venv_python = Path('.venv/bin/python')
-    if not venv_python.exists():
-        _run_install_step(
-            name='Create Python virtual environment',
-            emoji='🧪',
-            cmd=['python3', '-m', 'venv', '.venv']
-        )
-    else:
-        print('\t✅\tVirtual environment already exists at .venv/bin/python')
-
-def pip_install_requirements_step():
-    venv_python = Path('.venv/bin/python')
-    if venv_python.exists():
-        _run_install_step(
-            name='Activate venv and install Python dependencies',
-            emoji='🐍',
-            cmd=[str(venv_python), '-m', 'pip', 'install', '-r', 'requirements.txt']
-        )
-    else:
-        print('\t❌\tVirtual environment not found at .venv/bin/python')
-        exit(1)
-
-def tuist_install_step():
-    _run_install_step(name='Install Tuist', emoji='🚀', cmd=['tuist', 'install'])
+        echo(f'\t❌\tStep failed: {step.name}')
+        raise StepFailed(result.returncode)
+    # Steps can rewrite their own inputs (brew bundle writes Brewfile.lock.json, tuist install Package.resolved),
+    # so the stamp records the inputs as the step left them, which is what the next run will see.
+    inputs = step.inputs()
+    input_hash = _input_hash(step, inputs, dep_states)
+    stamp = _write_stamp(step, inputs, input_hash)
+    echo(f'\t✅\tStep completed: {step.name} (took {result.elapsed:.2f} seconds, {result.describe_usage()})')
+    return _state(stamp)
 
 def main():
-    import time
+    parser = argparse.ArgumentParser(description='Install the development environment.')
+    parser.add_argument('--force', action='store_true', help='Run every step, even when its inputs are unchanged.')
+    args = parser.parse_args()
+
+    start_trace('install')
     print("🔧\tStarting installation process...")
     start = time.time()
-    brew_bundle_step()
-    create_venv_step()
-    pip_install_requirements_step()
-    tuist_install_step()
+    graph = [
+        Step(step.key, step.name, lambda dep_states, step=step: run_step_if_needed(step, dep_states, args.force), step.deps)
+        for step in STEPS
+    ]
+    _, returncode = run_step_graph(graph)
     elapsed = time.time() - start
+    if returncode != 0:
+        print(f"❌\tInstallation failed (total time: {elapsed:.2f} seconds)")
+        exit(returncode)
     print(f"🎉\tAll steps completed successfully! (total time: {elapsed:.2f} seconds)")
 
 if __name__ == '__main__':
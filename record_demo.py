@@ -3,13 +3,20 @@
 Script to record a demo video of the Rick and Morty app UI test using Xcode Simulator.
 Run with: ./record_demo.py
 """
+import io
 import os
 import subprocess
 import signal
+import struct
+import threading
 import time
 from pathlib import Path
 import json
 
+from generate import ensure_project_generated
+from steps import Step, echo, run_command, run_step, run_step_graph, start_trace, traced_step, wait_for_process
+from xcodebuild_log import XcodebuildTestLogParser, run_and_parse
+
 SCHEME = "RickAndMortyApp"
 SIMULATOR_NAME = "iPhone 16"
 PLATFORM = "platform=iOS Simulator"
@@ -22,31 +29,23 @@ FINAL_VIDEO_PATH = "record_demo_final_video.mp4"
 FINAL_THUMBNAIL_PATH = "record_demo_final_thumbnail.png"
 COMPILER_LOG_PATH = "record_demo_compiler.log"
 FFMPEG_CONVERT_VIDEO_LOG_PATH = "record_demo_ffmpeg_convert_video.log"
-FFMPEG_GET_THUMBNAIL_LOG_PATH = "record_demo_ffmpeg_get_thumbnail.log"
+RECORDING_LOG_PATH = "record_demo_recording.log"
+RECORDING_CHUNK_BYTES = 64 * 1024
+RECORDING_READY_TIMEOUT_SECONDS = 30
+RECORDING_TAIL_POLL_SECONDS = 0.05
+# Where the recorder puts the movie index (moov) relative to the media data, see _movie_layout().
+MOVIE_INDEX_FIRST = "index_first"
+MOVIE_INDEX_LAST = "index_last"
 THUMBNAIL_TIMESTAMP_SECONDS = 13
 VIDEO_END_TRIM_SECONDS = 1
 VIDEO_START_TRIM_SECONDS = 7
 SIMCTL = "xcrun simctl"
 XCODEBUILD = "xcodebuild"
 
-def _run_step(name, emoji, cmd, check=True):
-    print(f"{emoji}\t{name}")
-    print(f"{emoji}\tRunning: {' '.join(cmd)}")
-    start = time.time()
-    result = subprocess.run(cmd, cwd=os.getcwd(), check=check)
-    elapsed = time.time() - start
-    if result.returncode != 0:
-        print(f"\t❌\tStep failed: {name}")
-        exit(result.returncode)
-    else:
-        print(f"\t✅\tStep completed: {name} (took {elapsed:.2f} seconds)")
-    return result
-
+@traced_step
 def boot_simulator_step():
     # Check if the simulator is already booted
-    result = subprocess.run([
-        *SIMCTL.split(), "list", "devices", "--json"
-    ], capture_output=True, text=True)
+    result = run_command([*SIMCTL.split(), "list", "devices", "--json"], capture=True)
     devices = json.loads(result.stdout)["devices"]
     booted = False
     for runtime in devices:
@@ -57,27 +56,292 @@ def boot_simulator_step():
         if booted:
             break
     if booted:
-        print(f"📱\tSimulator '{SIMULATOR_NAME}' is already booted. Skipping boot step.")
+        echo(f"📱\tSimulator '{SIMULATOR_NAME}' is already booted. Skipping boot step.")
     else:
-        _run_step(
+        run_step(
             name="Boot iOS Simulator",
             emoji="📱",
             cmd=[*SIMCTL.split(), "boot", SIMULATOR_NAME],
-            check=False
         )
 
+def _has_exited(process):
+    """
+    Returns whether process has exited, without reaping it, so wait_for_process can still read its resource usage.
+    """
+    try:
+        return os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is not None
+    except ChildProcessError:
+        return True  # Already reaped.
+
+def _movie_layout(path):
+    """
+    Returns MOVIE_INDEX_FIRST when the movie box (moov) of the mp4/mov file written so far comes before any media data,
+    as in a fragmented or fast-start movie, MOVIE_INDEX_LAST when media data (mdat) comes first, so the index only
+    follows when the recording is finalized, or None when neither has been written yet.
+    """
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    with f:
+        file_size = os.fstat(f.fileno()).st_size
+        box_start = 0
+        while box_start + 8 <= file_size:
+            f.seek(box_start)
+            size, box_type = struct.unpack(">I4s", f.read(8))
+            if box_type == b"moov":
+                return MOVIE_INDEX_FIRST
+            if box_type == b"mdat":
+                return MOVIE_INDEX_LAST
+            if size == 1:
+                if box_start + 16 > file_size:
+                    return None
+                size = struct.unpack(">Q", f.read(8))[0]
+            if size < 8:
+                # Size 0 runs to the end of the file, so no box follows it yet.
+                return None
+            box_start += size
+    return None
+
+def _mp4_duration_seconds(path):
+    """
+    Returns the duration of an mp4/mov file from its movie header (moov/mvhd), without decoding anything.
+    """
+    with open(path, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        box_end = file_size
+        while f.tell() < box_end:
+            box_start = f.tell()
+            size, box_type = struct.unpack(">I4s", f.read(8))
+            if size == 1:
+                size = struct.unpack(">Q", f.read(8))[0]
+            elif size == 0:
+                size = box_end - box_start
+            if box_type == b"moov":
+                # Descend into the movie box instead of skipping it.
+                box_end = box_start + size
+                continue
+            if box_type == b"mvhd":
+                version = f.read(4)[0]
+                if version == 1:
+                    _, _, timescale, duration = struct.unpack(">QQIQ", f.read(28))
+                else:
+                    _, _, timescale, duration = struct.unpack(">IIII", f.read(16))
+                return duration / timescale
+            f.seek(box_start + size)
+    raise ValueError(f"no movie header in {path}")
+
+def _trim_args(duration):
+    """
+    Returns the ffmpeg input options that drop the first VIDEO_START_TRIM_SECONDS and the last
+    VIDEO_END_TRIM_SECONDS seconds of a recording of the given duration. A recording that is still being written
+    has no duration yet (None): only its start is trimmed here, and _trim_video_end() cuts the end afterwards.
+    """
+    if duration is None:
+        return ["-ss", str(VIDEO_START_TRIM_SECONDS)]
+    if duration < VIDEO_START_TRIM_SECONDS + VIDEO_END_TRIM_SECONDS:
+        print("⚠️\tVideo duration too short to trim. Skipping trim.")
+        return []
+    return ["-ss", str(VIDEO_START_TRIM_SECONDS), "-t", f"{duration - VIDEO_START_TRIM_SECONDS - VIDEO_END_TRIM_SECONDS:.3f}"]
+
+def _ffmpeg_cmd(input_path, duration=None):
+    # The frames are decoded once and split: one branch is encoded to H.264, the other yields the first frame
+    # at THUMBNAIL_TIMESTAMP_SECONDS of the trimmed video as the PNG thumbnail.
+    filter_graph = (
+        "[0:v]scale=-2:1024,split=2[video][frames];"
+        f"[frames]trim=start={THUMBNAIL_TIMESTAMP_SECONDS},select=eq(n\\,0)[thumbnail]"
+    )
+    return [
+        "ffmpeg",
+        "-y",
+        "-progress", "pipe:1",
+        *_trim_args(duration),
+        "-i", input_path,
+        "-filter_complex", filter_graph,
+        "-map", "[video]",
+        "-an",  # Remove audio
+        "-c:v", "libx264",  # Explicitly use H.264
+        "-preset", "fast",
+        "-crf", "23",
+        "-avoid_negative_ts", "make_zero",
+        FINAL_VIDEO_PATH,
+        "-map", "[thumbnail]",
+        "-frames:v", "1",
+        FINAL_THUMBNAIL_PATH
+    ]
+
+class DemoRecording:
+    """
+    A simulator screen recording that is transcoded as early as its format allows.
+    simctl writes the movie to RAW_VIDEO_PATH. When the movie index (moov) is written before the media data,
+    as in a fragmented mp4, the growing file is tailed into ffmpeg while the test runs. A regular QuickTime/mp4
+    only gets its index when the recorder finalizes it, and ffmpeg cannot demux it before that, so then ffmpeg
+    starts on the finished file once the recorder has exited.
+    """
+
+    def __init__(self, recorder, started_at):
+        self.recorder = recorder
+        # time.perf_counter() when the recorder was started, for its trace event.
+        self.started_at = started_at
+        self.recorder_result = None
+        self.ffmpeg = None
+        self.ffmpeg_started_at = None
+        self.ffmpeg_result = None
+        self.is_streamed = False
+        # Whether ffmpeg started without the recording's duration, so the end still has to be trimmed.
+        self.trims_end_later = False
+        self.recorded = threading.Event()
+        self.progress = {}
+        self.stopped_at = None
+        self.progress_thread = None
+        self.thread = threading.Thread(target=self._transcode, daemon=True)
+        self.thread.start()
+
+    def _start_ffmpeg(self, input_path, duration=None):
+        cmd = _ffmpeg_cmd(input_path, duration)
+        self.trims_end_later = duration is None
+        print(f"🎬\tRunning: {' '.join(cmd)}", flush=True)
+        self.ffmpeg_started_at = time.perf_counter()
+        with open(FFMPEG_CONVERT_VIDEO_LOG_PATH, "w") as ffmpeg_log_file:
+            self.ffmpeg = subprocess.Popen(
+                cmd,
+                stdin=subprocess.PIPE if input_path == "pipe:0" else subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=ffmpeg_log_file,
+            )
+        self.progress_thread = threading.Thread(target=self._read_progress, daemon=True)
+        self.progress_thread.start()
+
+    def _transcode(self):
+        layout = None
+        while layout is None and not self.recorded.is_set() and not _has_exited(self.recorder):
+            layout = _movie_layout(RAW_VIDEO_PATH)
+            if layout is None:
+                self.recorded.wait(RECORDING_TAIL_POLL_SECONDS)
+        if layout == MOVIE_INDEX_FIRST:
+            self.is_streamed = True
+            self._start_ffmpeg("pipe:0")
+            self._feed_ffmpeg()
+            return
+        self.recorded.wait()
+        if os.path.exists(RAW_VIDEO_PATH) and os.path.getsize(RAW_VIDEO_PATH) > 0:
+            try:
+                # A fragmented movie has no duration in its header, so its end is trimmed like a streamed one.
+                duration = _mp4_duration_seconds(RAW_VIDEO_PATH) or None
+            except (OSError, ValueError, struct.error) as e:
+                print(f"⚠️\tCould not get video duration: {e}")
+                duration = 0
+            self._start_ffmpeg(RAW_VIDEO_PATH, duration)
+
+    def _feed_ffmpeg(self):
+        try:
+            with open(RAW_VIDEO_PATH, "rb") as raw_file:
+                while True:
+                    # Sampled before reading, so an empty read after the recording ended means everything was fed.
+                    recorded = self.recorded.is_set()
+                    chunk = raw_file.read(RECORDING_CHUNK_BYTES)
+                    if chunk:
+                        self.ffmpeg.stdin.write(chunk)
+                    elif recorded:
+                        break
+                    else:
+                        self.recorded.wait(RECORDING_TAIL_POLL_SECONDS)
+        except BrokenPipeError:
+            pass  # ffmpeg exited early; its log says why.
+        finally:
+            try:
+                self.ffmpeg.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    def _read_progress(self):
+        self.progress = _read_ffmpeg_progress(io.TextIOWrapper(self.ffmpeg.stdout))
+
+    def stop(self):
+        if self.recorder_result is not None:
+            return
+        # os.kill rather than Popen.send_signal, which would reap an exited recorder before wait4 can.
+        os.kill(self.recorder.pid, signal.SIGINT)  # simulates Ctrl+C
+        self.recorder_result = wait_for_process(self.recorder, self.recorder.args, name="recordVideo", start=self.started_at)
+        self.stopped_at = time.time()
+        self.recorded.set()
+
+    def wait(self):
+        """
+        Waits for ffmpeg to finish and returns its CommandResult, or None if nothing was recorded.
+        """
+        self.thread.join()
+        if self.ffmpeg is None:
+            return None
+        self.progress_thread.join()
+        self.ffmpeg_result = wait_for_process(self.ffmpeg, self.ffmpeg.args, name="ffmpeg", start=self.ffmpeg_started_at)
+        return self.ffmpeg_result
+
+def _read_ffmpeg_progress(stream):
+    """
+    Reads ffmpeg's -progress key=value blocks and returns the last complete one.
+    """
+    progress = {}
+    block = {}
+    for line in stream:
+        key, _, value = line.strip().partition("=")
+        block[key] = value
+        if key == "progress":
+            progress = block
+            block = {}
+    return progress
+
+def _trim_video_end(video_seconds):
+    """
+    Cuts the last VIDEO_END_TRIM_SECONDS seconds off FINAL_VIDEO_PATH by remuxing it without re-encoding.
+    Returns the ffmpeg return code.
+    """
+    trimmed_path = f"{FINAL_VIDEO_PATH}.trimmed.mp4"
+    cmd = [
+        "ffmpeg",
+        "-y",
+        "-i", FINAL_VIDEO_PATH,
+        "-t", f"{video_seconds - VIDEO_END_TRIM_SECONDS:.3f}",
+        "-c", "copy",
+        trimmed_path,
+    ]
+    print(f"🎬\tRunning: {' '.join(cmd)}")
+    with open(FFMPEG_CONVERT_VIDEO_LOG_PATH, "a") as ffmpeg_log_file:
+        result = subprocess.run(cmd, stdout=ffmpeg_log_file, stderr=subprocess.STDOUT)
+    if result.returncode == 0:
+        os.replace(trimmed_path, FINAL_VIDEO_PATH)
+    return result.returncode
+
+def _has_recorded_video():
+    return os.path.exists(RAW_VIDEO_PATH) and os.path.getsize(RAW_VIDEO_PATH) > 0
+
+@traced_step
 def start_recording_step():
     print("🎥\tStarting screen recording...")
     start = time.time()
-    proc = subprocess.Popen([*SIMCTL.split(), "io", "booted", "recordVideo", RAW_VIDEO_PATH])
-    time.sleep(1)  # Ensure recording starts
+    started_at = time.perf_counter()
+    recorder_cmd = [*SIMCTL.split(), "io", "booted", "recordVideo", "--codec=h264", "--force", RAW_VIDEO_PATH]
+    print(f"🎥\tRunning: {' '.join(recorder_cmd)}")
+    with open(RECORDING_LOG_PATH, "w") as recording_log_file:
+        recorder = subprocess.Popen(recorder_cmd, stdout=recording_log_file, stderr=subprocess.STDOUT)
+    recording = DemoRecording(recorder, started_at)
+    # The recording is ready once the first bytes of video are written, not after a fixed delay.
+    deadline = time.monotonic() + RECORDING_READY_TIMEOUT_SECONDS
+    while not _has_recorded_video():
+        if _has_exited(recorder) or time.monotonic() >= deadline:
+            reason = "exited" if _has_exited(recorder) else "timed out"
+            recording.stop()
+            elapsed = time.time() - start
+            print(f"\t❌\tStep failed: screen recording {reason} without writing video after {elapsed:.2f} seconds (see {RECORDING_LOG_PATH})")
+            exit(recording.recorder_result.returncode or 1)
+        time.sleep(RECORDING_TAIL_POLL_SECONDS)
     elapsed = time.time() - start
     print(f"\t✅\tScreen recording started (took {elapsed:.2f} seconds)")
-    return proc
+    return recording
 
-def run_ui_test_step():
+@traced_step
+def run_ui_test_step(on_test_finished):
     # Redirect xcodebuild output to record_demo_compiler.log
-    log_file = open(COMPILER_LOG_PATH, "w")
     print(f"🧪\tRun UI Test (output redirected to {COMPILER_LOG_PATH})")
     cmd = [
         XCODEBUILD,
@@ -87,118 +351,101 @@ def run_ui_test_step():
         "-destination", DESTINATION,
         "-only-testing:" + f"{TEST_TARGET}/{TEST_NAME}"
     ]
+    test_method = TEST_NAME.rsplit("/", 1)[-1]
+
+    def on_event(event, result):
+        # The recording ends with the test itself rather than after xcodebuild tears down.
+        if event in ("passed", "failed") and result.name == test_method:
+            on_test_finished()
+
     start = time.time()
-    result = subprocess.run(cmd, stdout=log_file, stderr=subprocess.STDOUT)
+    returncode = run_and_parse(cmd, COMPILER_LOG_PATH, XcodebuildTestLogParser(on_event))
     elapsed = time.time() - start
-    log_file.close()
-    if result.returncode != 0:
+    if returncode != 0:
         print(f"\t❌\tStep failed: Run UI Test (see {COMPILER_LOG_PATH})")
-        exit(result.returncode)
+        exit(returncode)
     else:
         print(f"\t✅\tStep completed: Run UI Test (took {elapsed:.2f} seconds, see {COMPILER_LOG_PATH})")
 
-def stop_recording_step(proc):
+@traced_step
+def stop_recording_step(recording):
+    if recording.stopped_at is not None:
+        return
     print("🛑\tStopping screen recording...")
     start = time.time()
-    proc.send_signal(signal.SIGINT)  # simulates Ctrl+C
-    proc.wait()
+    recording.stop()
     elapsed = time.time() - start
     print(f"\t✅\tScreen recording stopped (took {elapsed:.2f} seconds)")
 
-def convert_and_trim_video_step():
-
-    print("🎬\tConverting and trimming video with ffmpeg...")
-    # Get video duration
-    probe_cmd = [
-        "ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "json", RAW_VIDEO_PATH
-    ]
-    probe_result = subprocess.run(probe_cmd, capture_output=True, text=True)
-    duration = None
-    try:
-        duration = float(json.loads(probe_result.stdout)["format"]["duration"])
-    except Exception as e:
-        print(f"⚠️\tCould not get video duration: {e}")
-    if duration is None or duration < 8:
-        print(f"⚠️\tVideo duration too short to trim. Skipping trim.")
-        trim_args = [
-            "-i", RAW_VIDEO_PATH,
-        ]
-    else:
-        # Trim first VIDEO_START_TRIM_SECONDS seconds and last VIDEO_END_TRIM_SECONDS second
-        start_trim = VIDEO_START_TRIM_SECONDS
-        end_trim = duration - VIDEO_END_TRIM_SECONDS - start_trim
-        start_trim = VIDEO_START_TRIM_SECONDS
-        end_trim = duration - VIDEO_END_TRIM_SECONDS - start_trim
-        trim_args = [
-            "-ss", str(start_trim),
-            "-i", RAW_VIDEO_PATH,
-            "-t", str(end_trim)
-        ]
-
-    ffmpeg_cmd = [
-        "ffmpeg",
-        "-y",
-        *trim_args,
-        "-an",  # Remove audio
-        "-vf", "scale=-2:1024",
-        "-c:v", "libx264",  # Explicitly use H.264
-        "-preset", "fast",
-        "-crf", "23",
-        "-avoid_negative_ts", "make_zero",
-        FINAL_VIDEO_PATH
-    ]
-    print(f"🎬\tRunning: {' '.join(ffmpeg_cmd)}")
-    with open(FFMPEG_CONVERT_VIDEO_LOG_PATH, "w") as ffmpeg_log_file:
-        start = time.time()
-        result = subprocess.run(ffmpeg_cmd, stdout=ffmpeg_log_file, stderr=subprocess.STDOUT)
-        elapsed = time.time() - start
-    if result.returncode != 0:
-        print(f"\t❌\tStep failed: ffmpeg convert/trim (see {FFMPEG_CONVERT_VIDEO_LOG_PATH})")
-        exit(result.returncode)
-    else:
-        print(f"\t✅\tStep completed: ffmpeg convert/trim (took {elapsed:.2f} seconds, see {FFMPEG_CONVERT_VIDEO_LOG_PATH})")
-
-    # Extract thumbnail at 14th second
-    print("🖼️\tExtracting thumbnail at 14th second...")
-    thumbnail_cmd = [
-        "ffmpeg",
-        "-y",
-        "-ss", str(THUMBNAIL_TIMESTAMP_SECONDS),
-        "-i", FINAL_VIDEO_PATH,
-        "-vframes", "1",
-        FINAL_THUMBNAIL_PATH
-    ]
-    print(f"🖼️\tRunning: {' '.join(thumbnail_cmd)}")
-    with open(FFMPEG_GET_THUMBNAIL_LOG_PATH, "w") as thumbnail_log_file:
-        start = time.time()
-        result = subprocess.run(thumbnail_cmd, stdout=thumbnail_log_file, stderr=subprocess.STDOUT)
-        elapsed = time.time() - start
+@traced_step
+def finish_video_step(recording):
+    print("🎬\tFinishing video and thumbnail encoding...")
+    result = recording.wait()
+    # Measured from when the recorder exited, which can be well before this step when the test ended early.
+    after_stop = time.time() - recording.stopped_at
+    if result is None:
+        print(f"\t❌\tStep failed: the screen recording produced no video (see {RECORDING_LOG_PATH})")
+        exit(1)
     if result.returncode != 0:
-        print(f"\t❌\tStep failed: ffmpeg thumbnail extract (see {FFMPEG_GET_THUMBNAIL_LOG_PATH})")
+        if not os.path.exists(FINAL_THUMBNAIL_PATH):
+            print(f"\t⚠️\tNo thumbnail was written: the recording may be shorter than {VIDEO_START_TRIM_SECONDS + THUMBNAIL_TIMESTAMP_SECONDS} seconds")
+        print(f"\t❌\tStep failed: ffmpeg convert/trim/thumbnail (see {FFMPEG_CONVERT_VIDEO_LOG_PATH})")
         exit(result.returncode)
-    else:
-        print(f"\t✅\tStep completed: ffmpeg thumbnail extract (took {elapsed:.2f} seconds, see {FFMPEG_GET_THUMBNAIL_LOG_PATH})")
+    try:
+        video_seconds = _mp4_duration_seconds(FINAL_VIDEO_PATH)
+    except (OSError, ValueError, struct.error):
+        video_seconds = None
+    # ffmpeg started before the recording had a duration, so the end is trimmed now. Unlike a short finished
+    # recording, the start has already been trimmed, so a recording too short to trim fails here.
+    if recording.trims_end_later:
+        if (video_seconds or 0) <= VIDEO_END_TRIM_SECONDS:
+            print(f"\t❌\tStep failed: the recording is too short to trim {VIDEO_START_TRIM_SECONDS} seconds from the start and {VIDEO_END_TRIM_SECONDS} from the end (see {FFMPEG_CONVERT_VIDEO_LOG_PATH})")
+            exit(1)
+        returncode = _trim_video_end(video_seconds)
+        if returncode != 0:
+            print(f"\t❌\tStep failed: ffmpeg end trim (see {FFMPEG_CONVERT_VIDEO_LOG_PATH})")
+            exit(returncode)
+        video_seconds -= VIDEO_END_TRIM_SECONDS
+    mode = "streamed while recording" if recording.is_streamed else "started after the recorder wrote the movie index"
+    print(f"\t✅\tStep completed: ffmpeg convert/trim/thumbnail ({mode}, done {after_stop:.2f} seconds after recording stopped, {result.describe_usage()}, see {FFMPEG_CONVERT_VIDEO_LOG_PATH})")
+    progress = recording.progress
+    if "frame" not in progress:
+        print("\t⚠️\tffmpeg reported no progress")
+        return
+    # frame and fps describe the first output (the video). ffmpeg's own speed follows the slowest output,
+    # which is the thumbnail once its single frame is written, so speed is derived from the video length instead.
+    speed = ""
+    if video_seconds and result.elapsed:
+        speed = f", {video_seconds:.2f} seconds of video in {result.elapsed:.2f} seconds ({video_seconds / result.elapsed:.2f}x realtime)"
+    print(f"\t📊\tEncoded {progress['frame']} frames at {progress.get('fps', '?')} fps{speed}")
 
 def main():
     # Cleanup previous outputs
-    for path in [RAW_VIDEO_PATH, FINAL_VIDEO_PATH, COMPILER_LOG_PATH, FFMPEG_CONVERT_VIDEO_LOG_PATH, FFMPEG_GET_THUMBNAIL_LOG_PATH]:
+    for path in [RAW_VIDEO_PATH, FINAL_VIDEO_PATH, FINAL_THUMBNAIL_PATH, COMPILER_LOG_PATH, FFMPEG_CONVERT_VIDEO_LOG_PATH, RECORDING_LOG_PATH]:
         if os.path.exists(path):
             try:
                 os.remove(path)
                 print(f"🧹\tRemoved previous output: {path}")
             except Exception as e:
                 print(f"⚠️\tCould not remove {path}: {e}")
+    start_trace("record_demo")
     print("🔧\tStarting demo recording process...")
     start = time.time()
-    boot_simulator_step()
-    recorder = start_recording_step()
+    # The project is generated while the simulator boots.
+    _, returncode = run_step_graph([
+        Step("generate", "Generate project", lambda _: ensure_project_generated(prefix="⚡\t")),
+        Step("boot", "Boot iOS Simulator", lambda _: boot_simulator_step()),
+    ])
+    if returncode:
+        exit(returncode)
+    recording = start_recording_step()
     try:
-        run_ui_test_step()
+        run_ui_test_step(on_test_finished=lambda: stop_recording_step(recording))
     except subprocess.CalledProcessError as e:
         print(f"❌\tUI Test failed: {e}")
     finally:
-        stop_recording_step(recorder)
-    convert_and_trim_video_step()
+        stop_recording_step(recording)
+    finish_video_step(recording)
     elapsed = time.time() - start
     print(f"🎉\tDemo recording completed! Video saved to {FINAL_VIDEO_PATH} (total time: {elapsed:.2f} seconds)")
 
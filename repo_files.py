@@ -0,0 +1,73 @@
+"""
+Fast discovery of source files in the repository, shared by the tooling scripts.
+Prefers the git index (tracked plus untracked files that are not ignored), so .gitignore is respected,
+and falls back to a directory walk that never descends into excluded directories.
+"""
+import os
+import subprocess
+
+# Directory names that never contain sources worth formatting or counting: VCS metadata,
+# build products, the Python virtual environment and Tuist/Xcode derived data.
+EXCLUDE_DIRS = frozenset({'.git', 'build', '.build', '.venv', 'Derived', 'DerivedData'})
+
+
+def list_repo_files(root, extensions, exclude_dirs=EXCLUDE_DIRS):
+    """
+    Returns sorted paths, relative to root, of files under root whose extension is in extensions
+    (given without the leading dot).
+    """
+    extensions = {ext.lower() for ext in extensions}
+    files = _list_git_files(root, extensions)
+    if files is None:
+        files = _walk_files(root, extensions, exclude_dirs)
+    files = [
+        file for file in files
+        if not any(part in exclude_dirs for part in file.split('/')[:-1])
+    ]
+    return sorted(files)
+
+
+def _has_extension(name, extensions):
+    return '.' in name and name.rsplit('.', 1)[-1].lower() in extensions
+
+
+def _list_git_files(root, extensions):
+    """
+    Returns matching files known to git under root, or None when root is not inside a git work tree.
+    """
+    pathspecs = [f':(icase)*.{ext}' for ext in sorted(extensions)]
+    cmd = ['git', 'ls-files', '-z', '--cached', '--others', '--exclude-standard', '--', *pathspecs]
+    try:
+        output = subprocess.run(cmd, cwd=root, capture_output=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    files = []
+    seen = set()
+    for path in output.decode('utf-8').split('\0'):
+        # --cached lists a file again for every unmerged stage, and still lists files deleted from the work tree.
+        if not path or path in seen or not _has_extension(path, extensions):
+            continue
+        seen.add(path)
+        if os.path.isfile(os.path.join(root, path)):
+            files.append(path)
+    return files
+
+
+def _walk_files(root, extensions, exclude_dirs):
+    files = []
+    pending_dirs = ['']
+    while pending_dirs:
+        rel_dir = pending_dirs.pop()
+        try:
+            entries = list(os.scandir(os.path.join(root, rel_dir) if rel_dir else root))
+        except OSError:
+            continue
+        for entry in entries:
+            rel_path = f'{rel_dir}/{entry.name}' if rel_dir else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                # Pruned here, before descending, rather than filtered out afterwards.
+                if entry.name not in exclude_dirs:
+                    pending_dirs.append(rel_path)
+            elif entry.is_file() and _has_extension(entry.name, extensions):
+                files.append(rel_path)
+    return files
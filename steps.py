@@ -0,0 +1,314 @@
+"""
+Shared step runner for the tooling scripts.
+Commands run as timed steps whose output is streamed with a prefix, copied to a log or captured, and whose
+CPU time and peak memory are read from wait4 when they exit. Independent steps can run concurrently as a
+dependency graph. Once a script calls start_trace(), every step and command is recorded as a Chrome
+trace_event and written to .traces/<script>.trace.json on exit, for chrome://tracing or ui.perfetto.dev.
+"""
+import atexit
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+TRACE_DIR = '.traces'
+# ru_maxrss is in bytes on macOS and in kilobytes on Linux.
+MAX_RSS_UNIT_BYTES = 1 if sys.platform == 'darwin' else 1024
+READ_CHUNK_BYTES = 64 * 1024
+
+# Steps print from several threads; whole lines are printed under this lock so they never interleave.
+_print_lock = threading.Lock()
+_trace = None
+
+
+def echo(line):
+    with _print_lock:
+        print(line, flush=True)
+
+
+class _Trace:
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.events = []
+        self.thread_ids = {}
+        self.lock = threading.Lock()
+
+    def _thread_id(self):
+        thread = threading.current_thread()
+        thread_id = self.thread_ids.get(thread.ident)
+        if thread_id is None:
+            thread_id = self.thread_ids[thread.ident] = len(self.thread_ids) + 1
+            self.events.append({
+                'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': thread_id,
+                'args': {'name': thread.name},
+            })
+        return thread_id
+
+    def add(self, name, category, start, end, args):
+        with self.lock:
+            self.events.append({
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': round((start - self.start) * 1_000_000),
+                'dur': round((end - start) * 1_000_000),
+                'pid': os.getpid(),
+                'tid': self._thread_id(),
+                'args': args,
+            })
+
+    def write(self):
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        path = os.path.join(TRACE_DIR, f'{self.name}.trace.json')
+        with self.lock:
+            events = [{
+                'name': 'process_name', 'ph': 'M', 'pid': os.getpid(), 'args': {'name': self.name},
+            }] + self.events
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        echo(f'🧭\tTrace written to {path} ({len(events)} events)')
+
+
+def start_trace(name):
+    """
+    Starts recording steps and commands, and writes them as a Chrome trace when the script exits.
+    """
+    global _trace
+    if _trace is None:
+        _trace = _Trace(name)
+        atexit.register(_trace.write)
+
+
+def _record(name, category, start, end, args):
+    if _trace is not None:
+        _trace.add(name, category, start, end, args)
+
+
+@contextmanager
+def traced(name, category='step', **args):
+    """
+    Records the enclosed block as a trace event; the yielded dict can be filled with more args.
+    """
+    start = time.perf_counter()
+    try:
+        yield args
+    finally:
+        _record(name, category, start, time.perf_counter(), args)
+
+
+def traced_step(func):
+    """
+    Decorator that records every call of a step function as a trace event named after it.
+    """
+    def wrapper(*args, **kwargs):
+        with traced(func.__name__):
+            return func(*args, **kwargs)
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+class CommandResult:
+    def __init__(self, cmd, returncode, elapsed, rusage, stdout=None, stderr=None):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.elapsed = elapsed
+        self.user_seconds = rusage.ru_utime if rusage else 0.0
+        self.system_seconds = rusage.ru_stime if rusage else 0.0
+        self.max_rss_bytes = rusage.ru_maxrss * MAX_RSS_UNIT_BYTES if rusage else 0
+        self.stdout = stdout
+        self.stderr = stderr
+
+    def describe_usage(self):
+        return (f'cpu {self.user_seconds + self.system_seconds:.2f}s '
+                f'({self.user_seconds:.2f}s user, {self.system_seconds:.2f}s sys), '
+                f'max rss {self.max_rss_bytes / 1_000_000:.0f} MB')
+
+
+def _reap(process):
+    """
+    Waits for process with wait4, so its resource usage is read as it exits. Returns (exit code, rusage).
+    """
+    try:
+        _, status, rusage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        # Already reaped elsewhere; the exit code is still known to Popen.
+        return process.wait(), None
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, rusage
+
+
+def _read_all(stream, chunks):
+    for chunk in iter(lambda: stream.read(READ_CHUNK_BYTES), b''):
+        chunks.append(chunk)
+    stream.close()
+
+
+def _write_all(stream, data):
+    try:
+        stream.write(data)
+        stream.close()
+    except BrokenPipeError:
+        pass
+
+
+def run_command(cmd, *, name=None, cwd=None, input=None, capture=False, prefix=None, log_path=None, on_line=None):
+    """
+    Runs cmd and returns a CommandResult with its exit code, wall time, CPU time and peak memory.
+    With capture=True, stdout and stderr are returned as bytes. Otherwise the combined output is, line by line,
+    copied to log_path, passed to on_line as text and printed after prefix: whichever are given, and passed
+    straight through to the terminal when none is.
+    """
+    name = name or os.path.basename(cmd[0])
+    start = time.perf_counter()
+    stdout = stderr = None
+    streaming = not capture and (prefix is not None or log_path or on_line)
+    try:
+        process = subprocess.Popen(
+            cmd,
+            cwd=cwd or os.getcwd(),
+            stdin=subprocess.PIPE if input is not None else None,
+            stdout=subprocess.PIPE if capture or streaming else None,
+            stderr=subprocess.PIPE if capture else subprocess.STDOUT if streaming else None,
+        )
+    except FileNotFoundError:
+        message = f'{cmd[0]}: command not found\n'.encode()
+        result = CommandResult(cmd, 127, time.perf_counter() - start, None, b'' if capture else None, message if capture else None)
+        if not capture:
+            echo(message.decode().rstrip())
+        _record(name, 'command', start, time.perf_counter(), {'cmd': ' '.join(cmd), 'returncode': 127})
+        return result
+    threads = []
+    if input is not None:
+        threads.append(threading.Thread(target=_write_all, args=(process.stdin, input)))
+    if capture:
+        stdout_chunks, stderr_chunks = [], []
+        threads.append(threading.Thread(target=_read_all, args=(process.stdout, stdout_chunks)))
+        threads.append(threading.Thread(target=_read_all, args=(process.stderr, stderr_chunks)))
+    for thread in threads:
+        thread.start()
+    if streaming:
+        log_file = open(log_path, 'wb') if log_path else None
+        try:
+            for raw_line in process.stdout:
+                if log_file:
+                    log_file.write(raw_line)
+                if on_line or prefix is not None:
+                    line = raw_line.decode('utf-8', 'replace')
+                    if on_line:
+                        on_line(line)
+                    if prefix is not None:
+                        echo(f'{prefix}{line.rstrip()}')
+        finally:
+            process.stdout.close()
+            if log_file:
+                log_file.close()
+    for thread in threads:
+        thread.join()
+    if capture:
+        stdout, stderr = b''.join(stdout_chunks), b''.join(stderr_chunks)
+    return wait_for_process(process, cmd, name=name, start=start, stdout=stdout, stderr=stderr)
+
+
+def wait_for_process(process, cmd, *, name=None, start=None, stdout=None, stderr=None):
+    """
+    Waits for a process started with subprocess.Popen, reading its CPU time and peak memory with wait4,
+    records it in the trace from start (a time.perf_counter() value) and returns its CommandResult.
+    """
+    name = name or os.path.basename(cmd[0])
+    returncode, rusage = _reap(process)
+    end = time.perf_counter()
+    result = CommandResult(cmd, returncode, end - start if start is not None else 0.0, rusage, stdout, stderr)
+    _record(name, 'command', start if start is not None else end, end, {
+        'cmd': ' '.join(cmd),
+        'returncode': returncode,
+        'cpu_user_seconds': round(result.user_seconds, 3),
+        'cpu_system_seconds': round(result.system_seconds, 3),
+        'max_rss_mb': round(result.max_rss_bytes / 1_000_000, 1),
+    })
+    return result
+
+
+def run_step(name, emoji, cmd, *, exit_on_failure=True, **kwargs):
+    """
+    Runs cmd as a step: announces it, runs it with run_command and reports its time and resource usage.
+    On failure it exits with the command's exit code, unless exit_on_failure is False.
+    """
+    echo(f'{emoji}\t{name}')
+    echo(f'{emoji}\tRunning: {" ".join(cmd)}')
+    with traced(name):
+        result = run_command(cmd, name=name, **kwargs)
+    if result.returncode != 0:
+        echo(f'\t❌\tStep failed: {name}')
+        if exit_on_failure:
+            exit(result.returncode)
+    else:
+        echo(f'\t✅\tStep completed: {name} (took {result.elapsed:.2f} seconds, {result.describe_usage()})')
+    return result
+
+
+class StepFailed(Exception):
+    def __init__(self, returncode):
+        super().__init__(f'exit code {returncode}')
+        self.returncode = returncode
+
+
+class Step:
+    """
+    A node of a step graph. func is called with the results of the steps that already finished, keyed by step key,
+    and fails by raising StepFailed or calling exit() with a non-zero code.
+    """
+
+    def __init__(self, key, name, func, deps=()):
+        self.key = key
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+
+
+def _run_graph_step(step, results):
+    with traced(step.name, category='graph'):
+        try:
+            return 0, step.func(results)
+        except StepFailed as e:
+            return e.returncode or 1, None
+        except SystemExit as e:
+            if e.code:
+                return e.code if isinstance(e.code, int) else 1, None
+            return 0, None
+
+
+def run_step_graph(steps):
+    """
+    Runs every step on its own thread as soon as the steps it depends on succeeded.
+    Returns ({key: func's return value} for the steps that succeeded, first failing exit code or 0).
+    Steps that depend on a failed step are reported and not run.
+    """
+    pending = {step.key: step for step in steps}
+    results = {}
+    running = {}
+    failed_returncode = 0
+    with ThreadPoolExecutor(max_workers=max(1, len(steps))) as executor:
+        while pending or running:
+            ready = [step for step in pending.values() if all(dep in results for dep in step.deps)]
+            for step in ready:
+                del pending[step.key]
+                running[executor.submit(_run_graph_step, step, results)] = step
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                step = running.pop(future)
+                returncode, value = future.result()
+                if returncode == 0:
+                    results[step.key] = value
+                elif not failed_returncode:
+                    failed_returncode = returncode
+    for step in pending.values():
+        echo(f'\t⚠️\tNot run: {step.name} (a step it depends on failed)')
+    return results, failed_returncode
@@ -6,18 +6,78 @@ Usage:
   ./test.py                # runs all tests
   ./test.py <test_name>    # runs a specific test (e.g. RickAndMortyAppUITests/testDemo)
   ./test.py <test_name> <scheme>  # runs a specific test with a given scheme
+  ./test.py --shards 4     # runs all tests split into 4 groups on 4 simulator clones, concurrently
+  ./test.py --affected     # runs only the tests affected by the changes since the branch left main
+  ./test.py --check-format # checks Swift formatting alongside project generation, then runs all tests
+  ./test.py stats          # reports test duration trends and flaky tests from the local test history
 """
+import argparse
+import glob
+import heapq
+import json
 import os
+import re
 import sys
 import subprocess
 import time
 import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from fingerprints import PROJECT_FILE_EXTENSIONS
+from generate import ensure_project_generated
+from repo_files import list_repo_files
+from steps import Step, StepFailed, run_command, run_step_graph, start_trace, traced_step
+from test_history import TestHistory
+from xcodebuild_log import XcodebuildTestLogParser, run_and_parse, slowest_tests, write_junit_report, write_slowest_tests_report
 
 DEFAULT_SCHEME = "RickAndMortyApp"
 COMPILER_LOG_PATH = "test_compiler.log"
+# build-for-testing gets its own log, so the test runs that follow it don't overwrite build errors.
+BUILD_LOG_PATH = "test_build.log"
 DEFAULT_WORKSPACE = "RickAndMorty.xcworkspace"
 DEFAULT_DESTINATION = "platform=iOS Simulator,name=iPhone 16"
 TEST_RESULTS_BUNDLE_FILE = "TestResults.xcresult"
+SHARD_LOG_PATH = "test_compiler.shard{index}.log"
+SHARD_RESULTS_BUNDLE_FILE = "TestResults.shard{index}.xcresult"
+SHARD_FAILED_FIRST_LOG_PATH = "test_compiler.shard{index}.failed-first.log"
+SHARD_FAILED_FIRST_RESULTS_BUNDLE_FILE = "TestResults.shard{index}.failed-first.xcresult"
+FAILED_FIRST_LOG_PATH = "test_compiler.failed-first.log"
+FAILED_FIRST_RESULTS_BUNDLE_FILE = "TestResults.failed-first.xcresult"
+JUNIT_REPORT_PATH = "test_results.junit.xml"
+SLOWEST_TESTS_REPORT_PATH = "test_slowest.txt"
+SLOWEST_TESTS_COUNT = 20
+# Derived data of test builds; a build is reused while the fingerprint of its inputs is unchanged.
+TEST_DERIVED_DATA_PATH = "DerivedData/Tests"
+TEST_BUILD_STAMP_PATH = "DerivedData/Tests/{scheme}.stamp.json"
+BUILD_INPUT_ROOTS = ["Apps", "Libs", "Tuist"]
+BUILD_INPUT_FILES = ["Tuist.swift", "Workspace.swift"]
+# Durations and outcomes of every test run, used to order and balance later runs.
+TEST_HISTORY_DB_PATH = ".test_history.sqlite"
+STATS_REPORT_COUNT = 20
+# Test targets of the DEFAULT_SCHEME test plan and the sources their tests are declared in.
+TEST_TARGET_SOURCES = {
+    "RickAndMortyEpisodesLibTests": "Libs/RickAndMortyEpisodesLib/Tests/*.tests.swift",
+    "RickAndMortyAppTests": "Apps/RickAndMortyApp/Tests/*.swift",
+    "RickAndMortyAppUITests": "Apps/RickAndMortyApp/UITests/*.swift",
+    "SharedLibTests": "Libs/SharedLib/Tests/*.swift",
+}
+# A UI test launches the app and drives it, so it is weighted as this many unit tests when balancing shards.
+UI_TEST_WEIGHT = 20
+
+TEST_ATTRIBUTE_PATTERN = re.compile(r"^\s*@Test\b")
+TYPE_DECLARATION_PATTERN = re.compile(
+    r"^(?:@\w+(?:\([^)]*\))?\s+)*(?:(?:final|public|internal)\s+)*(?:struct|class|actor|enum|extension)\s+(\w+)(.*)"
+)
+FUNC_DECLARATION_PATTERN = re.compile(
+    r"^(\s*)(?:(?:@\w+(?:\([^)]*\))?|static|public|internal)\s+)*func\s+(\w+)\s*\(([^)]*)\)?"
+)
+# Used by --affected to map changed files to the tests that depend on them.
+SOURCE_ROOTS = ["Apps", "Libs"]
+DECLARED_TYPE_PATTERN = re.compile(r"\b(?:struct|class|enum|protocol|actor|typealias)\s+([A-Z]\w*)")
+TYPE_REFERENCE_PATTERN = re.compile(r"\b[A-Z]\w*\b")
+IMPORT_PATTERN = re.compile(r"^\s*(?:@testable\s+)?import\s+(\w+)", re.MULTILINE)
+# Changes to these (Tuist manifests, test plans) can affect every test.
+ALL_TESTS_PATTERNS = ["Project.swift", "Workspace.swift", "Tuist.swift", "Tuist/*", "*.xctestplan"]
 
 def prepare_test_environment():
     # Remove old log and result files before running tests
@@ -28,62 +88,645 @@ def prepare_test_environment():
             shutil.rmtree(TEST_RESULTS_BUNDLE_FILE)
         else:
             os.remove(TEST_RESULTS_BUNDLE_FILE)
+    if os.path.isdir(FAILED_FIRST_RESULTS_BUNDLE_FILE):
+        shutil.rmtree(FAILED_FIRST_RESULTS_BUNDLE_FILE)
+    for report_path in [JUNIT_REPORT_PATH, SLOWEST_TESTS_REPORT_PATH, FAILED_FIRST_LOG_PATH]:
+        if os.path.exists(report_path):
+            os.remove(report_path)
 
-def run_all_tests():
-    print("🧪\tRunning all tests with xcodebuild...")
-    prepare_test_environment()
+def make_test_log_parser(prefix=""):
+    """
+    Returns a parser for xcodebuild output that prints every test as it starts, passes or fails.
+    """
+    emojis = {"started": "▶️", "passed": "✅", "failed": "❌", "skipped": "⏭️"}
+
+    def print_event(event, result):
+        duration = "" if event == "started" else f" ({result.seconds:.3f} seconds)"
+        print(f"\t{emojis[event]}\t{prefix}{result.identifier}{duration}", flush=True)
+
+    return XcodebuildTestLogParser(on_event=print_event)
+
+@traced_step
+def report_test_results_step(results):
+    """
+    Writes the JUnit XML and slowest tests reports for results and prints the failures and the slowest tests.
+    """
+    if not results:
+        print("\t⚠️\tNo test results found in the xcodebuild output")
+        return
+    write_junit_report(results, JUNIT_REPORT_PATH)
+    write_slowest_tests_report(results, SLOWEST_TESTS_REPORT_PATH, SLOWEST_TESTS_COUNT)
+    failed = [result for result in results if result.status == "failed"]
+    for result in failed:
+        print(f"\t❌\t{result.identifier} failed")
+        for message in result.failure_messages:
+            print(f"\t\t{message}")
+    print(f"🐢\tSlowest tests (full top {SLOWEST_TESTS_COUNT} in {SLOWEST_TESTS_REPORT_PATH}):")
+    for result in slowest_tests(results, 5):
+        print(f"\t\t{result.seconds:.3f}s\t{result.identifier}")
+    print(f"📝\t{len(results) - len(failed)} passed, {len(failed)} failed (JUnit report in {JUNIT_REPORT_PATH})")
+
+def _test_without_building_cmd(xctestrun_path, destination, bundle_path, test_names=(), skipped_test_names=()):
     cmd = [
         "xcodebuild",
-        "test",
-        "-workspace", DEFAULT_WORKSPACE,
-        "-scheme", DEFAULT_SCHEME,
-        "-destination", DEFAULT_DESTINATION,
-        "-resultBundlePath", TEST_RESULTS_BUNDLE_FILE
+        "test-without-building",
+        "-xctestrun", xctestrun_path,
+        "-destination", destination,
+        "-resultBundlePath", bundle_path
     ]
-    print(f"🧪\tRunning: {' '.join(cmd)}")
+    for test_name in test_names:
+        cmd += ["-only-testing", test_name]
+    for test_name in skipped_test_names:
+        cmd += ["-skip-testing", test_name]
+    return cmd
+
+def _run_tests(scheme, test_names=()):
+    """
+    Runs test_names (or every test of scheme) from the cached test build and returns (exit code, elapsed seconds).
+    Tests that failed the last time they ran go first, in their own xcodebuild run, for fast feedback.
+    """
+    prepare_test_environment()
+    xctestrun_path, fingerprint = build_for_testing_step(scheme)
+    units = _find_test_units()
+    history = TestHistory(TEST_HISTORY_DB_PATH)
+    selected_units = set(test_names) if test_names else set(units)
+    failed_first = sorted(history.previously_failed_units() & selected_units)
+    if failed_first and len(failed_first) < len(selected_units):
+        print(f"🔁\tRunning {len(failed_first)} previously failing test classes and functions first")
+        remaining = sorted(selected_units - set(failed_first)) if test_names else []
+        test_runs = [
+            (failed_first, [], FAILED_FIRST_LOG_PATH, FAILED_FIRST_RESULTS_BUNDLE_FILE),
+            (remaining, [] if test_names else failed_first, COMPILER_LOG_PATH, TEST_RESULTS_BUNDLE_FILE),
+        ]
+    else:
+        test_runs = [(list(test_names), [], COMPILER_LOG_PATH, TEST_RESULTS_BUNDLE_FILE)]
     start = time.time()
-    with open(COMPILER_LOG_PATH, "w") as log_file:
-        result = subprocess.run(cmd, stdout=log_file, stderr=subprocess.STDOUT)
+    returncode = 0
+    results = []
+    for only_testing, skip_testing, log_path, bundle_path in test_runs:
+        cmd = _test_without_building_cmd(xctestrun_path, DEFAULT_DESTINATION, bundle_path, only_testing, skip_testing)
+        print(f"🧪\tRunning: {' '.join(cmd)}")
+        parser = make_test_log_parser()
+        returncode = run_and_parse(cmd, log_path, parser) or returncode
+        results += parser.finished_results()
     elapsed = time.time() - start
-    if result.returncode != 0:
+    report_test_results_step(results)
+    record_test_history_step(history, scheme, fingerprint, results, units)
+    history.close()
+    return returncode, elapsed
+
+def run_all_tests():
+    print("🧪\tRunning all tests with xcodebuild...")
+    returncode, elapsed = _run_tests(DEFAULT_SCHEME)
+    if returncode != 0:
         print(f"\t❌\tTests failed (see {COMPILER_LOG_PATH})")
-        sys.exit(result.returncode)
+        sys.exit(returncode)
     else:
         print(f"\t✅\tAll tests passed (took {elapsed:.2f} seconds, see {COMPILER_LOG_PATH})")
 
 def run_specific_test(test_name, scheme=DEFAULT_SCHEME):
     print(f"🧪\tRunning specific test: {test_name} (scheme: {scheme}) with xcodebuild")
-    prepare_test_environment()
+    returncode, elapsed = _run_tests(scheme, [test_name])
+    if returncode != 0:
+        print(f"\t❌\tTest failed (see {COMPILER_LOG_PATH})")
+        sys.exit(returncode)
+    else:
+        print(f"\t✅\tTest passed (took {elapsed:.2f} seconds, see {COMPILER_LOG_PATH})")
+
+def run_selected_tests(test_names, scheme=DEFAULT_SCHEME):
+    print(f"🧪\tRunning {len(test_names)} selected test classes and functions (scheme: {scheme}) with xcodebuild")
+    returncode, elapsed = _run_tests(scheme, test_names)
+    if returncode != 0:
+        print(f"\t❌\tTests failed (see {COMPILER_LOG_PATH})")
+        sys.exit(returncode)
+    else:
+        print(f"\t✅\tSelected tests passed (took {elapsed:.2f} seconds, see {COMPILER_LOG_PATH})")
+
+def _test_units_in_file(target, path):
+    """
+    Returns {identifier: number of tests} for the tests declared in a Swift file.
+    Tests inside a type are grouped under the type (Target/Type); free Swift Testing functions
+    are their own unit (Target/function()), which is how -only-testing identifies them.
+    """
+    is_ui_test = target.endswith("UITests")
+    units = {}
+    current_type = None
+    is_test_case_class = False
+    pending_test_attribute = False
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            type_match = TYPE_DECLARATION_PATTERN.match(line)
+            if type_match:
+                current_type = type_match.group(1)
+                is_test_case_class = "XCTestCase" in type_match.group(2)
+                continue
+            if line.startswith("}"):
+                current_type = None
+                is_test_case_class = False
+            if TEST_ATTRIBUTE_PATTERN.match(line):
+                pending_test_attribute = True
+            func_match = FUNC_DECLARATION_PATTERN.match(line)
+            if not func_match:
+                continue
+            indent, name, parameters = func_match.groups()
+            is_xctest = is_test_case_class and indent and name.startswith("test") and not parameters.strip()
+            if not (pending_test_attribute or is_xctest):
+                continue
+            pending_test_attribute = False
+            if indent and current_type:
+                identifier = f"{target}/{current_type}"
+            else:
+                labels = "".join(f"{parameter.split(':')[0].split()[0]}:" for parameter in parameters.split(",") if ":" in parameter)
+                identifier = f"{target}/{name}({labels})"
+            units[identifier] = units.get(identifier, 0) + (UI_TEST_WEIGHT if is_ui_test else 1)
+    return units
+
+def _find_test_units():
+    units = {}
+    for target, pattern in TEST_TARGET_SOURCES.items():
+        for path in sorted(glob.glob(pattern)):
+            for identifier, weight in _test_units_in_file(target, path).items():
+                units[identifier] = units.get(identifier, 0) + weight
+    return units
+
+@traced_step
+def find_test_units_step():
+    """
+    Returns {identifier: weight} for every test class or free test function of DEFAULT_SCHEME.
+    """
+    print("🔍\tFinding test classes...")
+    start = time.time()
+    units = _find_test_units()
+    elapsed = time.time() - start
+    print(f"\t✅\tFound {len(units)} test classes and functions (took {elapsed:.2f} seconds)")
+    return units
+
+@traced_step
+def changed_files_step():
+    """
+    Returns the files changed since the current branch left main, including uncommitted and untracked files.
+    """
+    print("🔍\tFinding files changed since main...")
+    start = time.time()
+    try:
+        merge_base = subprocess.check_output(["git", "merge-base", "main", "HEAD"], encoding="utf-8").strip()
+        changed = subprocess.check_output(
+            ["git", "diff", "--name-only", "--no-renames", merge_base], encoding="utf-8"
+        ).splitlines()
+        untracked = subprocess.check_output(
+            ["git", "ls-files", "--others", "--exclude-standard"], encoding="utf-8"
+        ).splitlines()
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"\t❌\tCould not diff against main: {e}")
+        sys.exit(1)
+    changed_files = sorted(set(changed) | set(untracked))
+    elapsed = time.time() - start
+    print(f"\t✅\tFound {len(changed_files)} changed files (took {elapsed:.2f} seconds)")
+    return changed_files
+
+def _swift_target(path):
+    """
+    Returns the Tuist target a Swift file under SOURCE_ROOTS belongs to (e.g. RickAndMortyEpisodesLibTests).
+    """
+    parts = path.split("/")
+    if len(parts) < 3 or parts[0] not in SOURCE_ROOTS:
+        return None
+    if parts[2] in ("Tests", "UITests"):
+        return parts[1] + parts[2]
+    return parts[1]
+
+def build_dependency_map():
+    """
+    Returns {path: set of Swift files that reference a type declared in path} for every Swift file under SOURCE_ROOTS.
+    A file can only reference types of its own target and of the modules it imports.
+    """
+    declared_by_target = {}
+    references = {}
+    visible_modules = {}
+    for root in SOURCE_ROOTS:
+        for path in sorted(glob.glob(f"{root}/**/*.swift", recursive=True)):
+            target = _swift_target(path)
+            if target is None:
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+            for type_name in DECLARED_TYPE_PATTERN.findall(text):
+                declared_by_target.setdefault(target, {}).setdefault(type_name, set()).add(path)
+            references[path] = set(TYPE_REFERENCE_PATTERN.findall(text))
+            visible_modules[path] = {target} | set(IMPORT_PATTERN.findall(text))
+    dependents = {}
+    for path, type_names in references.items():
+        for module in visible_modules[path]:
+            declared = declared_by_target.get(module, {})
+            for type_name in type_names & declared.keys():
+                for declaring_path in declared[type_name]:
+                    if declaring_path != path:
+                        dependents.setdefault(declaring_path, set()).add(path)
+    return dependents
+
+def _convention_test_files(path):
+    """
+    Returns the test files the naming conventions tie to a source file:
+    Foo.feature.swift, Foo.logic.swift and Models/Foo.entity.swift are tested by Foo.tests.swift,
+    and Services changes are covered by the NetworkGateway tests.
+    """
+    parts = path.split("/")
+    if len(parts) < 4 or parts[0] not in SOURCE_ROOTS or parts[2] != "Sources":
+        return set()
+    tests_dir = "/".join(parts[:2] + ["Tests"])
+    stem = parts[-1].split(".")[0]
+    test_files = set(glob.glob(f"{tests_dir}/{stem}.tests.swift"))
+    if "Services" in parts:
+        test_files |= set(glob.glob(f"{tests_dir}/NetworkGateway*.tests.swift"))
+    return test_files
+
+@traced_step
+def affected_test_units_step(changed_files):
+    """
+    Returns {identifier: weight} for the tests affected by changed_files, or None if every test may be affected.
+    """
+    import fnmatch
+    print("🎯\tMapping changed files to affected tests...")
+    start = time.time()
+    dependents = build_dependency_map()
+    test_file_targets = {
+        test_file: target
+        for target, pattern in TEST_TARGET_SOURCES.items()
+        for test_file in glob.glob(pattern)
+    }
+    test_files = set()
+    pending = []
+    for path in changed_files:
+        if any(fnmatch.fnmatch(path, pattern) or fnmatch.fnmatch(path.rsplit("/", 1)[-1], pattern) for pattern in ALL_TESTS_PATTERNS):
+            print(f"\t⚠️\t{path} can affect every test")
+            return None
+        parts = path.split("/")
+        if parts[0] not in SOURCE_ROOTS:
+            continue
+        if "Fixtures" in parts:
+            # Fixtures are loaded by name, e.g. jsonFixtureNamed: "endpoints".
+            fixture_name = parts[-1].rsplit(".", 1)[0]
+            for test_file in test_file_targets:
+                with open(test_file, "r", encoding="utf-8") as f:
+                    if f'"{fixture_name}"' in f.read():
+                        test_files.add(test_file)
+        elif path.endswith(".swift"):
+            target = _swift_target(path)
+            if target in TEST_TARGET_SOURCES and path not in test_file_targets:
+                # A test helper (e.g. TestUtils.swift) can be used by every test of its target.
+                test_files |= set(glob.glob(TEST_TARGET_SOURCES[target]))
+            test_files |= _convention_test_files(path)
+            pending.append(path)
+        elif not path.endswith(".md"):
+            print(f"\t⚠️\t{path} can affect every test")
+            return None
+    # Everything that references a changed file, directly or through other files, is affected too.
+    visited = set(pending)
+    while pending:
+        path = pending.pop()
+        if path in test_file_targets:
+            test_files.add(path)
+        for dependent in dependents.get(path, ()):
+            if dependent not in visited:
+                visited.add(dependent)
+                pending.append(dependent)
+    units = {}
+    for test_file in sorted(test_files):
+        if os.path.exists(test_file):
+            units.update(_test_units_in_file(test_file_targets[test_file], test_file))
+    elapsed = time.time() - start
+    print(f"\t✅\t{len(units)} test classes and functions in {len(test_files)} files are affected (took {elapsed:.2f} seconds)")
+    return units
+
+def _unit_of_result(result, units_by_name):
+    """
+    Returns the test unit (Target/Class or Target/function()) a parsed test result belongs to, or None.
+    """
+    if result.suite and "." in result.suite:
+        # XCTest reports the suite as Target.Class.
+        target, class_name = result.suite.split(".", 1)
+        return units_by_name.get(class_name, f"{target}/{class_name}")
+    return units_by_name.get(result.suite) or units_by_name.get(result.name)
+
+@traced_step
+def record_test_history_step(history, scheme, fingerprint, results, units):
+    if not results:
+        return
+    units_by_name = {unit.split("/", 1)[1]: unit for unit in units}
+    history.record_run(scheme, fingerprint, [
+        (result.identifier, _unit_of_result(result, units_by_name), result.status, result.seconds)
+        for result in results
+    ])
+    print(f"📝\tRecorded {len(results)} results in {TEST_HISTORY_DB_PATH}")
+
+def historical_unit_weights(units, history):
+    """
+    Returns units ({identifier: weight}) weighted by their recorded durations in seconds, so shards are balanced
+    by how long tests actually take. Units without history are estimated from the seconds per weight of the others.
+    """
+    unit_seconds = history.unit_seconds()
+    known = {unit: unit_seconds[unit] for unit in units if unit in unit_seconds}
+    if not known:
+        return units
+    seconds_per_weight = sum(known.values()) / sum(units[unit] for unit in known)
+    return {unit: known.get(unit, weight * seconds_per_weight) for unit, weight in units.items()}
+
+def plan_test_shards(units, num_shards, first=()):
+    """
+    Splits units ({identifier: weight}) into at most num_shards groups of similar total weight,
+    placing the heaviest unit first into the lightest group. Units in first are placed before all others,
+    so they are spread over the groups and lead each group they land in.
+    """
+    num_shards = max(1, min(num_shards, len(units)))
+    heap = [(0, index, []) for index in range(num_shards)]
+    first = set(first)
+    for identifier, weight in sorted(units.items(), key=lambda item: (item[0] not in first, -item[1], item[0])):
+        total, index, shard = heapq.heappop(heap)
+        shard.append(identifier)
+        heapq.heappush(heap, (total + weight, index, shard))
+    return [shard for _, _, shard in sorted(heap, key=lambda entry: entry[1]) if shard]
+
+def _destination_device_name():
+    for part in DEFAULT_DESTINATION.split(","):
+        key, _, value = part.partition("=")
+        if key == "name":
+            return value
+    raise ValueError(f"DEFAULT_DESTINATION has no simulator name: {DEFAULT_DESTINATION}")
+
+@traced_step
+def clone_simulators_step(count):
+    """
+    Clones the DEFAULT_DESTINATION simulator count times and returns the UDIDs of the clones.
+    """
+    device_name = _destination_device_name()
+    print(f"📱\tCloning {count} '{device_name}' simulators...")
+    start = time.time()
+    listing = run_command(["xcrun", "simctl", "list", "devices", "available", "--json"], capture=True)
+    if listing.returncode != 0:
+        print(f"\t❌\tCould not list simulators: {listing.stderr.decode('utf-8', 'replace').strip()}")
+        sys.exit(listing.returncode)
+    devices = [
+        device
+        for runtime_devices in json.loads(listing.stdout)["devices"].values()
+        for device in runtime_devices
+        if device["name"] == device_name
+    ]
+    if not devices:
+        print(f"\t❌\tNo available simulator named '{device_name}'")
+        sys.exit(1)
+    source_udid = devices[-1]["udid"]
+    clones = []
+    for index in range(1, count + 1):
+        result = run_command(
+            ["xcrun", "simctl", "clone", source_udid, f"{device_name} (test shard {index})"],
+            capture=True,
+        )
+        if result.returncode != 0:
+            delete_simulators_step(clones)
+            print(f"\t❌\tCould not clone '{device_name}' (is it booted?): {result.stderr.decode('utf-8', 'replace').strip()}")
+            sys.exit(1)
+        clones.append(result.stdout.decode("utf-8").strip())
+    elapsed = time.time() - start
+    print(f"\t✅\tSimulators cloned (took {elapsed:.2f} seconds)")
+    return clones
+
+@traced_step
+def delete_simulators_step(udids):
+    for udid in udids:
+        run_command(["xcrun", "simctl", "delete", udid], capture=True)
+
+def _hash_file(sha, path):
+    sha.update(path.encode("utf-8") + b"\0")
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            sha.update(chunk)
+    sha.update(b"\0")
+
+@traced_step
+def check_formatting_step():
+    """
+    Runs ./format.py --check in its own process, so its diffs come out prefixed instead of mixed into the
+    output of the steps running alongside it.
+    """
+    format_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "format.py")
+    result = run_command([sys.executable, format_script, "--check"], name="format.py --check", prefix="🧹\t")
+    if result.returncode != 0:
+        print("\t❌\tSwift files are not formatted, run ./format.py")
+        raise StepFailed(result.returncode)
+
+@traced_step
+def test_build_fingerprint_step():
+    """
+    Returns a fingerprint of everything a test build depends on: the sources and resources under
+    Apps/ and Libs/, the Tuist manifests, the destination and the Xcode version.
+    """
+    import hashlib
+    print("🔍\tFingerprinting test build inputs...")
+    start = time.time()
+    sha = hashlib.sha256()
+    files = [
+        file for file in list_repo_files(".", PROJECT_FILE_EXTENSIONS)
+        if file.split("/")[0] in BUILD_INPUT_ROOTS or file in BUILD_INPUT_FILES
+    ]
+    for file in files:
+        _hash_file(sha, file)
+    try:
+        toolchain = subprocess.check_output(["xcodebuild", "-version"], encoding="utf-8", stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        toolchain = "unknown"
+    sha.update(f"{toolchain}\0{DEFAULT_DESTINATION}\0{DEFAULT_WORKSPACE}".encode("utf-8"))
+    fingerprint = sha.hexdigest()[:16]
+    elapsed = time.time() - start
+    print(f"\t✅\tFingerprint {fingerprint} of {len(files)} files (took {elapsed:.2f} seconds)")
+    return fingerprint
+
+@traced_step
+def build_for_testing_step(scheme=DEFAULT_SCHEME):
+    """
+    Builds the app and test bundles of scheme with build-for-testing and returns (path of its .xctestrun file, fingerprint).
+    The build is skipped while the fingerprint of its inputs matches the last successful build of scheme,
+    so repeated runs, runs of other test names and shards only run tests.
+    """
+    fingerprint = test_build_fingerprint_step()
+    stamp_path = TEST_BUILD_STAMP_PATH.format(scheme=scheme)
+    try:
+        with open(stamp_path, "r", encoding="utf-8") as f:
+            stamp = json.load(f)
+    except (OSError, ValueError):
+        stamp = {}
+    if stamp.get("fingerprint") == fingerprint and os.path.exists(stamp.get("xctestrun", "")):
+        print(f"\t✅\tReusing test build of {scheme}, its inputs are unchanged ({stamp['xctestrun']})")
+        return stamp["xctestrun"], fingerprint
     cmd = [
         "xcodebuild",
-        "test",
+        "build-for-testing",
         "-workspace", DEFAULT_WORKSPACE,
         "-scheme", scheme,
         "-destination", DEFAULT_DESTINATION,
-        "-only-testing", test_name,
-        "-resultBundlePath", TEST_RESULTS_BUNDLE_FILE
+        "-derivedDataPath", TEST_DERIVED_DATA_PATH,
     ]
-    print(f"🧪\tRunning: {' '.join(cmd)}")
-    start = time.time()
-    with open(COMPILER_LOG_PATH, "w") as log_file:
-        result = subprocess.run(cmd, stdout=log_file, stderr=subprocess.STDOUT)
-    elapsed = time.time() - start
+    print(f"🔨\tRunning: {' '.join(cmd)}")
+    result = run_command(cmd, name=f"build-for-testing {scheme}", log_path=BUILD_LOG_PATH)
     if result.returncode != 0:
-        print(f"\t❌\tTest failed (see {COMPILER_LOG_PATH})")
+        print(f"\t❌\tBuild for testing failed (see {BUILD_LOG_PATH})")
         sys.exit(result.returncode)
+    xctestrun_paths = sorted(
+        glob.glob(os.path.join(TEST_DERIVED_DATA_PATH, "Build", "Products", f"{scheme}_*.xctestrun")),
+        key=os.path.getmtime,
+    )
+    if not xctestrun_paths:
+        print(f"\t❌\tBuild for testing produced no .xctestrun file for {scheme} in {TEST_DERIVED_DATA_PATH}")
+        sys.exit(1)
+    with open(stamp_path, "w", encoding="utf-8") as f:
+        json.dump({"fingerprint": fingerprint, "xctestrun": xctestrun_paths[-1]}, f, indent=4)
+    print(f"\t✅\tBuild for testing succeeded (took {result.elapsed:.2f} seconds, {result.describe_usage()})")
+    return xctestrun_paths[-1], fingerprint
+
+def _remove_path(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+def _run_test_shard(index, identifiers, udid, parser, xctestrun_path, failed_first=()):
+    """
+    Runs identifiers on the simulator udid. Those in failed_first run first, in their own xcodebuild run, since
+    xcodebuild does not run tests in the order they are listed. Returns (exit code, elapsed seconds, log paths, bundle paths).
+    """
+    destination = f"platform=iOS Simulator,id={udid}"
+    first = [identifier for identifier in identifiers if identifier in failed_first]
+    rest = [identifier for identifier in identifiers if identifier not in failed_first]
+    runs = [(rest, SHARD_LOG_PATH.format(index=index), SHARD_RESULTS_BUNDLE_FILE.format(index=index))]
+    if first and rest:
+        runs.insert(0, (
+            first,
+            SHARD_FAILED_FIRST_LOG_PATH.format(index=index),
+            SHARD_FAILED_FIRST_RESULTS_BUNDLE_FILE.format(index=index),
+        ))
+    elif first:
+        runs = [(first, runs[0][1], runs[0][2])]
+    start = time.time()
+    returncode = 0
+    for run_identifiers, log_path, bundle_path in runs:
+        cmd = _test_without_building_cmd(xctestrun_path, destination, bundle_path, run_identifiers)
+        returncode = run_and_parse(cmd, log_path, parser) or returncode
+    return returncode, time.time() - start, [log_path for _, log_path, _ in runs], [bundle_path for _, _, bundle_path in runs]
+
+def run_sharded_tests(num_shards, scheme=DEFAULT_SCHEME, units=None):
+    print(f"🧪\tRunning {'all' if units is None else 'selected'} tests in up to {num_shards} shards with xcodebuild...")
+    start = time.time()
+    prepare_test_environment()
+    # Logs and result bundles of an earlier run with more shards would otherwise be mistaken for this run's.
+    for path in glob.glob(SHARD_LOG_PATH.format(index="*")) + glob.glob(SHARD_RESULTS_BUNDLE_FILE.format(index="*")):
+        _remove_path(path)
+    all_units = find_test_units_step()
+    history = TestHistory(TEST_HISTORY_DB_PATH)
+    selected_units = all_units if units is None else units
+    # Tests that failed the last time they ran are spread over the shards and run first in each of them.
+    failed_first = history.previously_failed_units() & set(selected_units)
+    if failed_first:
+        print(f"🔁\tRunning {len(failed_first)} previously failing test classes and functions first in their shards")
+    shards = plan_test_shards(historical_unit_weights(selected_units, history), num_shards, first=failed_first)
+    if not shards:
+        print("\t⚠️\tNo tests found")
+        return
+    xctestrun_path, fingerprint = build_for_testing_step(scheme)
+    udids = clone_simulators_step(len(shards))
+    try:
+        for index, shard in enumerate(shards, start=1):
+            print(f"🧪\tShard {index}/{len(shards)}: {len(shard)} test classes and functions, starting with {shard[0]}")
+        parsers = [make_test_log_parser(prefix=f"[shard {index}] ") for index in range(1, len(shards) + 1)]
+        with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            results = list(executor.map(
+                lambda args: _run_test_shard(*args, xctestrun_path, failed_first),
+                [
+                    (index, shard, udid, parser)
+                    for index, (shard, udid, parser) in enumerate(zip(shards, udids, parsers), start=1)
+                ],
+            ))
+    finally:
+        delete_simulators_step(udids)
+    elapsed = time.time() - start
+    test_results = [result for parser in parsers for result in parser.finished_results()]
+    report_test_results_step(test_results)
+    record_test_history_step(history, scheme, fingerprint, test_results, all_units)
+    history.close()
+    failed_shards = 0
+    for index, (returncode, shard_elapsed, log_paths, bundle_paths) in enumerate(results, start=1):
+        outputs = ", ".join(log_paths + bundle_paths)
+        if returncode != 0:
+            failed_shards += 1
+            print(f"\t❌\tShard {index} failed with exit code {returncode} (took {shard_elapsed:.2f} seconds, see {outputs})")
+        else:
+            print(f"\t✅\tShard {index} passed (took {shard_elapsed:.2f} seconds, see {outputs})")
+    if failed_shards:
+        print(f"\t❌\t{failed_shards} of {len(results)} shards failed (took {elapsed:.2f} seconds)")
+        sys.exit(1)
+    print(f"\t✅\tAll tests passed in {len(results)} shards (took {elapsed:.2f} seconds)")
+
+@traced_step
+def print_test_stats_step():
+    """
+    Prints the tests with the highest p95 duration over their recent runs, with the p50 trend, and the flaky tests.
+    """
+    if not os.path.exists(TEST_HISTORY_DB_PATH):
+        print(f"⚠️\tNo test history yet ({TEST_HISTORY_DB_PATH} is created by the next test run)")
+        return
+    history = TestHistory(TEST_HISTORY_DB_PATH)
+    trends = sorted(history.duration_trends(), key=lambda trend: -trend[3])[:STATS_REPORT_COUNT]
+    print(f"📈\tTop {len(trends)} tests by p95 duration over their recent runs:")
+    print(f"\t{'p50':>9}  {'p95':>9}  {'trend':>7}  {'runs':>5}  test")
+    for identifier, runs, p50, p95, previous_p50 in trends:
+        trend = f"{(p50 - previous_p50) / previous_p50 * 100:+.0f}%" if previous_p50 else "-"
+        print(f"\t{p50:8.3f}s  {p95:8.3f}s  {trend:>7}  {runs:>5}  {identifier}")
+    flaky = history.flaky_tests()
+    if flaky:
+        print(f"🎲\t{len(flaky)} flaky tests (passed and failed on the same source fingerprint):")
+        for identifier, fingerprints, passes, failures in flaky:
+            print(f"\t\t{identifier}: {passes} passed, {failures} failed across {fingerprints} fingerprint(s)")
     else:
-        print(f"\t✅\tTest passed (took {elapsed:.2f} seconds, see {COMPILER_LOG_PATH})")
+        print("✅\tNo flaky tests")
+    history.close()
 
 def main():
-    if len(sys.argv) == 1:
-        run_all_tests()
-    elif len(sys.argv) == 2:
-        run_specific_test(sys.argv[1])
-    elif len(sys.argv) == 3:
-        run_specific_test(sys.argv[1], scheme=sys.argv[2])
+    parser = argparse.ArgumentParser(description="Run the Rick and Morty tests with xcodebuild.")
+    parser.add_argument("test_name", nargs="?", help="A specific test to run (e.g. RickAndMortyAppUITests/testDemo), or 'stats' to report test durations and flaky tests.")
+    parser.add_argument("scheme", nargs="?", default=DEFAULT_SCHEME, help=f"The scheme to test (default: {DEFAULT_SCHEME}).")
+    parser.add_argument("--shards", type=int, help="Split all tests into this many groups and run them concurrently, each on its own simulator clone. Tests that failed last time run first in their group.")
+    parser.add_argument("--affected", action="store_true", help="Run only the tests affected by the changes since the branch left main.")
+    parser.add_argument("--check-format", action="store_true", help="Check Swift formatting with ./format.py --check while the project is generated, and fail before testing if it is off.")
+    args = parser.parse_args()
+
+    start_trace("test")
+    if args.test_name == "stats":
+        print_test_stats_step()
+        return
+    if args.test_name and (args.shards is not None or args.affected):
+        parser.error("--shards and --affected select the tests themselves and cannot be combined with a test name")
+    if args.shards is not None and args.shards < 1:
+        parser.error("--shards must be at least 1")
+    # The project is generated while the affected tests are selected and the formatting is checked;
+    # tests run once all of them are done.
+    steps = [Step("generate", "Generate project", lambda _: ensure_project_generated(prefix="⚡\t"))]
+    if args.affected:
+        steps.append(Step("affected", "Select affected tests", lambda _: affected_test_units_step(changed_files_step())))
+    if args.check_format:
+        steps.append(Step("format", "Check Swift formatting", lambda _: check_formatting_step()))
+    results, returncode = run_step_graph(steps)
+    if returncode:
+        sys.exit(returncode)
+    units = results.get("affected")
+    if units == {}:
+        print("✅\tNo tests are affected by the changes.")
+        return
+    if args.shards is not None:
+        run_sharded_tests(args.shards, scheme=args.scheme, units=units)
+    elif units is not None:
+        run_selected_tests(sorted(units), scheme=args.scheme)
+    elif args.test_name:
+        run_specific_test(args.test_name, scheme=args.scheme)
     else:
-        print("Usage:\n  ./test.py\n  ./test.py <test_name>\n  ./test.py <test_name> <scheme>")
-        sys.exit(1)
+        run_all_tests()
 
 if __name__ == "__main__":
     main()
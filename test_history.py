@@ -0,0 +1,143 @@
+"""
+Local SQLite history of test durations and outcomes, recorded by test.py after every run.
+It is used to balance shards by real durations, to run previously failing tests first,
+and by `./test.py stats` to report duration percentiles and flaky tests.
+"""
+import sqlite3
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started_at REAL NOT NULL,
+    scheme TEXT NOT NULL,
+    fingerprint TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    identifier TEXT NOT NULL,
+    unit TEXT,
+    status TEXT NOT NULL,
+    seconds REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_by_identifier ON results(identifier, run_id);
+CREATE INDEX IF NOT EXISTS results_by_unit ON results(unit, run_id);
+"""
+# Only the most recent runs of a unit are used to estimate its duration, so it follows the test as it changes.
+RECENT_RUNS = 10
+
+
+def percentile(values, fraction):
+    """
+    Returns the value at fraction (0.0 to 1.0) of values, interpolating between the closest ranks.
+    """
+    values = sorted(values)
+    if not values:
+        return None
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class TestHistory:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def record_run(self, scheme, fingerprint, results):
+        """
+        Stores results, a list of (identifier, unit, status, seconds), as one run.
+        """
+        with self.connection:
+            run_id = self.connection.execute(
+                "INSERT INTO runs (started_at, scheme, fingerprint) VALUES (?, ?, ?)",
+                (time.time(), scheme, fingerprint),
+            ).lastrowid
+            self.connection.executemany(
+                "INSERT INTO results (run_id, identifier, unit, status, seconds) VALUES (?, ?, ?, ?, ?)",
+                [(run_id, identifier, unit, status, seconds) for identifier, unit, status, seconds in results],
+            )
+
+    def unit_seconds(self):
+        """
+        Returns {unit: median total duration} over each unit's RECENT_RUNS most recent runs.
+        """
+        rows = self.connection.execute(
+            """
+            SELECT unit, run_id, SUM(seconds) FROM results
+            WHERE unit IS NOT NULL
+            GROUP BY unit, run_id
+            ORDER BY unit, run_id DESC
+            """
+        )
+        samples = {}
+        for unit, _, seconds in rows:
+            unit_samples = samples.setdefault(unit, [])
+            if len(unit_samples) < RECENT_RUNS:
+                unit_samples.append(seconds)
+        return {unit: percentile(unit_samples, 0.5) for unit, unit_samples in samples.items()}
+
+    def previously_failed_units(self):
+        """
+        Returns the units that had a failing test the last time they ran.
+        """
+        rows = self.connection.execute(
+            """
+            SELECT results.unit FROM results
+            JOIN (SELECT unit, MAX(run_id) AS last_run_id FROM results WHERE unit IS NOT NULL GROUP BY unit) AS last
+              ON results.unit = last.unit AND results.run_id = last.last_run_id
+            WHERE results.status = 'failed'
+            """
+        )
+        return {unit for (unit,) in rows}
+
+    def duration_trends(self, window=RECENT_RUNS):
+        """
+        Returns [(identifier, runs, p50, p95, previous p50)] where p50 and p95 cover the last `window` runs
+        of the test and previous p50 the `window` runs before them (None if there were none).
+        """
+        rows = self.connection.execute(
+            "SELECT identifier, seconds FROM results WHERE status != 'skipped' ORDER BY identifier, run_id DESC"
+        )
+        samples = {}
+        for identifier, seconds in rows:
+            samples.setdefault(identifier, []).append(seconds)
+        trends = []
+        for identifier, durations in samples.items():
+            recent = durations[:window]
+            previous = durations[window:2 * window]
+            trends.append((
+                identifier,
+                len(durations),
+                percentile(recent, 0.5),
+                percentile(recent, 0.95),
+                percentile(previous, 0.5),
+            ))
+        return trends
+
+    def flaky_tests(self):
+        """
+        Returns [(identifier, fingerprints, passes, failures)] for tests that both passed and failed on the same
+        source fingerprint, counting only the runs on those fingerprints.
+        """
+        rows = self.connection.execute(
+            """
+            WITH outcomes AS (
+                SELECT results.identifier, runs.fingerprint,
+                       SUM(results.status = 'passed') AS passes,
+                       SUM(results.status = 'failed') AS failures
+                FROM results JOIN runs ON runs.id = results.run_id
+                GROUP BY results.identifier, runs.fingerprint
+            )
+            SELECT identifier, COUNT(*), SUM(passes), SUM(failures) FROM outcomes
+            WHERE passes > 0 AND failures > 0
+            GROUP BY identifier
+            ORDER BY SUM(failures) DESC, identifier
+            """
+        )
+        return rows.fetchall()
@@ -0,0 +1,33 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from api_load import ApiClient, walk_episodes
+
+API_URL = "http://127.0.0.1:8080/api"
+
+
+class FakeApiClient(ApiClient):
+    """
+    Serves one episode page with two characters, of which the second has a body that is not JSON.
+    """
+
+    def _fetch(self, url, kind):
+        if url == f"{API_URL}/episode":
+            characters = [f"{API_URL}/character/1", f"{API_URL}/character/2"]
+            return {"info": {"next": None}, "results": [{"characters": characters}]}
+        if url.endswith("/2"):
+            raise ValueError("Expecting value: line 1 column 1 (char 0)")
+        return {"id": 1}
+
+
+class WalkEpisodesTests(unittest.TestCase):
+    def test_failed_preloads_are_counted_in_errors(self):
+        client = FakeApiClient(concurrency=2, timeout=1, use_etags=False)
+        with ThreadPoolExecutor(max_workers=2) as fan_out:
+            pages = walk_episodes(client, fan_out, API_URL, max_pages=None, characters_per_episode=20)
+        self.assertEqual(pages, 1)
+        self.assertEqual(client.errors, {"ValueError": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
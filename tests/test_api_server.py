@@ -0,0 +1,34 @@
+import json
+import os
+import unittest
+from urllib.parse import urlsplit
+
+from api_server import FIXTURES_DIR, FixtureDataset
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASE_URL = "http://127.0.0.1:8080/api"
+
+
+class FixtureDatasetTests(unittest.TestCase):
+    def setUp(self):
+        self.dataset = FixtureDataset(os.path.join(REPO_DIR, FIXTURES_DIR), BASE_URL)
+
+    def test_root_lists_endpoints_like_the_live_api(self):
+        status, _, body, _ = self.dataset.render("/api")
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body), {
+            "characters": f"{BASE_URL}/character",
+            "locations": f"{BASE_URL}/location",
+            "episodes": f"{BASE_URL}/episode",
+        })
+
+    def test_root_endpoints_resolve_on_this_server(self):
+        _, _, body, _ = self.dataset.render("/api")
+        for url in json.loads(body).values():
+            status, _, page, _ = self.dataset.render(urlsplit(url).path)
+            self.assertEqual(status, 200, url)
+            self.assertIn("results", json.loads(page))
+
+
+if __name__ == "__main__":
+    unittest.main()
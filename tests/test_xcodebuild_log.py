@@ -0,0 +1,50 @@
+import unittest
+
+from xcodebuild_log import XcodebuildTestLogParser
+
+DEVICE = "iPhone 16 - RickAndMortyApp (1234)"
+
+
+def parse(lines):
+    parser = XcodebuildTestLogParser()
+    for line in lines:
+        parser.feed(line)
+    return parser.finished_results()
+
+
+class XcodebuildTestLogParserTests(unittest.TestCase):
+    def test_swift_testing_display_name_and_xcode_function_name_count_once(self):
+        results = parse([
+            '􀟈 Test "EpisodeDomainModel Codable conformance" started.',
+            '✔ Test "EpisodeDomainModel Codable conformance" passed after 0.004 seconds.',
+            f"Test case 'EpisodeDomainModel_Codable_conformance()' passed on '{DEVICE}' (0.004 seconds)",
+            '✔ Test "CharacterSpecies static values" passed after 0.001 seconds.',
+            f"Test case 'CharacterSpecies_static_values()' passed on '{DEVICE}' (0.001 seconds)",
+        ])
+        self.assertEqual(
+            sorted(result.name for result in results),
+            ["CharacterSpecies_static_values()", "EpisodeDomainModel_Codable_conformance()"],
+        )
+
+    def test_swift_testing_lines_are_used_without_xcode_test_case_lines(self):
+        results = parse([
+            '✔ Test "EpisodeDomainModel Codable conformance" passed after 0.004 seconds.',
+            '✘ Test "CharacterSpecies static values" failed after 0.001 seconds.',
+        ])
+        self.assertEqual(
+            sorted((result.name, result.status) for result in results),
+            [('"CharacterSpecies static values"', "failed"), ('"EpisodeDomainModel Codable conformance"', "passed")],
+        )
+
+    def test_xctest_and_xcode_formats_count_once(self):
+        results = parse([
+            "Test Case '-[RickAndMortyAppTests.CharacterLocationTests testInit]' started.",
+            "Test Case '-[RickAndMortyAppTests.CharacterLocationTests testInit]' passed (0.002 seconds).",
+            f"Test case 'CharacterLocationTests/testInit()' passed on '{DEVICE}' (0.002 seconds)",
+        ])
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0].suite, "RickAndMortyAppTests.CharacterLocationTests")
+
+
+if __name__ == "__main__":
+    unittest.main()
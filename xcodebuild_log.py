@@ -0,0 +1,185 @@
+"""
+Streaming parser for xcodebuild test output, shared by the tooling scripts that run tests.
+Lines are parsed as xcodebuild prints them and the raw output is copied to a log file on the way,
+so memory grows with the number of tests, never with the size of the log.
+"""
+import heapq
+import re
+import xml.etree.ElementTree as ET
+
+from steps import run_command
+
+# Test Case '-[RickAndMortyAppUITests.RickAndMortyAppUITests testDemo]' passed (12.345 seconds).
+XCTEST_CASE_PATTERN = re.compile(
+    r"^Test Case '-\[(?P<suite>[\w.]+) (?P<name>\w+)\]' (?P<status>started|passed|failed|skipped)"
+    r"(?: \((?P<seconds>[\d.]+) seconds\))?"
+)
+# Test case 'CharacterLocationTests/testInitializer()' passed on 'iPhone 16 - RickAndMortyApp (1234)' (0.002 seconds)
+XCODE_TEST_CASE_PATTERN = re.compile(
+    r"^Test case '(?:(?P<suite>[^']*)/)?(?P<name>[^'/]+)' (?P<status>passed|failed|skipped) on '.*?'"
+    r"(?: \((?P<seconds>[\d.]+) seconds\))?"
+)
+# ✔ Test NetworkGateway_episodeList() passed after 0.004 seconds.
+SWIFT_TESTING_CASE_PATTERN = re.compile(
+    r"^\S+ Test (?P<name>\".*?\"|\S+) (?:(?P<started>started)\.|(?P<status>passed|failed|skipped) after (?P<seconds>[\d.]+) seconds)"
+)
+# /path/File.swift:12: error: -[Target.Class testName] : XCTAssertEqual failed: ...
+XCTEST_FAILURE_PATTERN = re.compile(r"^(?P<location>\S+:\d+): error: -\[(?P<suite>[\w.]+) (?P<name>\w+)\] : (?P<message>.*)")
+# ✘ Test NetworkGateway_episodeList() recorded an issue at File.swift:12:5: Expectation failed: ...
+SWIFT_TESTING_FAILURE_PATTERN = re.compile(r"^\S+ Test (?P<name>\".*?\"|\S+) recorded an issue at (?P<location>\S+): (?P<message>.*)")
+# Only the first messages of a failing test are kept, so a test that fails in a loop cannot grow memory without bound.
+MAX_FAILURE_MESSAGES = 5
+MAX_FAILURE_MESSAGE_CHARS = 1000
+
+
+class TestCaseResult:
+    def __init__(self, suite, name):
+        self.suite = suite
+        self.name = name
+        self.status = "started"
+        self.seconds = 0.0
+        self.failure_messages = []
+
+    @property
+    def identifier(self):
+        return f"{self.suite}/{self.name}" if self.suite else self.name
+
+
+class XcodebuildTestLogParser:
+    """
+    Collects per-test results from xcodebuild output fed to it one line at a time.
+    on_event, if given, is called with (event, result) for every 'started', 'passed', 'failed' and 'skipped' event.
+    """
+
+    def __init__(self, on_event=None):
+        self.on_event = on_event
+        self.results = {}
+        # Swift Testing names a test by its @Test("…") display name and Xcode by its function name, so the two
+        # cannot be matched. Swift Testing's own lines are only used until Xcode reports any test case itself.
+        self.swift_testing_results = {}
+        self.has_xcode_test_cases = False
+
+    def _result(self, suite, name):
+        # XCTest reports a test as "Target.Class testX" and Xcode as "Class/testX()", so the key drops the target
+        # and the parentheses to land both formats on one result.
+        key = ((suite or "").rsplit(".", 1)[-1], name.removesuffix("()"))
+        result = self.results.get(key)
+        if result is None:
+            result = self.results[key] = TestCaseResult(suite, name)
+        elif suite and "." in suite and "." not in (result.suite or ""):
+            # Keep the target when a later line reports it.
+            result.suite = suite
+        return result
+
+    def _swift_testing_result(self, name):
+        result = self.swift_testing_results.get(name)
+        if result is None:
+            result = self.swift_testing_results[name] = TestCaseResult(None, name)
+        return result
+
+    def _record(self, suite, name, status, seconds, result=None):
+        result = result or self._result(suite, name)
+        if status == "started":
+            if result.status != "started":
+                return
+        else:
+            # The same result can be reported in more than one format.
+            if result.status == status:
+                return
+            result.status = status
+            result.seconds = float(seconds or 0.0)
+        if self.on_event:
+            self.on_event(status, result)
+
+    def _add_failure_message(self, result, location, message):
+        if result is not None and len(result.failure_messages) < MAX_FAILURE_MESSAGES:
+            result.failure_messages.append(f"{location}: {message[:MAX_FAILURE_MESSAGE_CHARS]}")
+
+    def feed(self, line):
+        line = line.rstrip("\r\n")
+        match = XCTEST_CASE_PATTERN.match(line)
+        if match:
+            self._record(match.group("suite"), match.group("name"), match.group("status"), match.group("seconds"))
+            return
+        match = XCODE_TEST_CASE_PATTERN.match(line)
+        if match:
+            self.has_xcode_test_cases = True
+            self._record(match.group("suite"), match.group("name"), match.group("status"), match.group("seconds"))
+            return
+        match = SWIFT_TESTING_CASE_PATTERN.match(line)
+        if match:
+            if self.has_xcode_test_cases:
+                return
+            status = "started" if match.group("started") else match.group("status")
+            name = match.group("name")
+            self._record(None, name, status, match.group("seconds"), self._swift_testing_result(name))
+            return
+        match = XCTEST_FAILURE_PATTERN.match(line)
+        if match:
+            result = self._result(match.group("suite"), match.group("name"))
+            self._add_failure_message(result, match.group("location"), match.group("message"))
+            return
+        match = SWIFT_TESTING_FAILURE_PATTERN.match(line)
+        if match:
+            result = self._swift_testing_result(match.group("name"))
+            self._add_failure_message(result, match.group("location"), match.group("message"))
+
+    def finished_results(self):
+        results = list(self.results.values())
+        if not self.has_xcode_test_cases:
+            results += self.swift_testing_results.values()
+        return [result for result in results if result.status != "started"]
+
+
+def run_and_parse(cmd, log_path, parser):
+    """
+    Runs cmd, copying its combined output to log_path while feeding every line to parser, and returns the exit code.
+    """
+    return run_command(cmd, name=" ".join(cmd[:2]), log_path=log_path, on_line=parser.feed).returncode
+
+
+def write_junit_report(results, path):
+    """
+    Writes results as JUnit XML, with one testsuite per test class (or per target for free test functions).
+    """
+    suites = {}
+    for result in results:
+        suites.setdefault(result.suite or "Tests", []).append(result)
+    root = ET.Element("testsuites", {
+        "tests": str(len(results)),
+        "failures": str(sum(result.status == "failed" for result in results)),
+        "time": f"{sum(result.seconds for result in results):.3f}",
+    })
+    for suite_name, suite_results in sorted(suites.items()):
+        suite = ET.SubElement(root, "testsuite", {
+            "name": suite_name,
+            "tests": str(len(suite_results)),
+            "failures": str(sum(result.status == "failed" for result in suite_results)),
+            "skipped": str(sum(result.status == "skipped" for result in suite_results)),
+            "time": f"{sum(result.seconds for result in suite_results):.3f}",
+        })
+        for result in suite_results:
+            case = ET.SubElement(suite, "testcase", {
+                "classname": suite_name,
+                "name": result.name,
+                "time": f"{result.seconds:.3f}",
+            })
+            if result.status == "failed":
+                failure = ET.SubElement(case, "failure", {
+                    "message": result.failure_messages[0] if result.failure_messages else "Test failed",
+                })
+                failure.text = "\n".join(result.failure_messages)
+            elif result.status == "skipped":
+                ET.SubElement(case, "skipped")
+    ET.ElementTree(root).write(path, encoding="utf-8", xml_declaration=True)
+
+
+def slowest_tests(results, count):
+    return heapq.nlargest(count, results, key=lambda result: result.seconds)
+
+
+def write_slowest_tests_report(results, path, count):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"Top {count} slowest tests\n")
+        for rank, result in enumerate(slowest_tests(results, count), start=1):
+            f.write(f"{rank:>3}. {result.seconds:9.3f}s  {result.status:<7}  {result.identifier}\n")